@@ -42,7 +42,7 @@ class AioReader:  # pylint: disable=too-many-instance-attributes
         path: str,
         consumer: str,
         pins: dict[int, AioReaderPinParams],
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
     ) -> None:
 
         self.__path = path
@@ -126,7 +126,7 @@ class _DebouncedValue:
         self,
         initial: bool,
         debounce: float,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
         loop: asyncio.AbstractEventLoop,
     ) -> None:
 
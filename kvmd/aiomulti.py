@@ -58,11 +58,17 @@ def queue_get_last_sync(  # pylint: disable=invalid-name
 
 # =====
 class AioProcessNotifier:
+    # Уведомления схлопываются в одну маску в разделяемой памяти, как в aiotools.AioCoalescingNotifier,
+    # поэтому ничего не копится, пока ждущий приостановлен. Ожидающий должен быть только один.
+
     def __init__(self) -> None:
-        self.__queue: "multiprocessing.Queue[int]" = multiprocessing.Queue()
+        self.__event = multiprocessing.Event()
+        self.__mask = multiprocessing.Value("i", 0)
 
     def notify(self, mask: int=0) -> None:
-        self.__queue.put_nowait(mask)
+        with self.__mask.get_lock():
+            self.__mask.value |= mask
+            self.__event.set()
 
     async def wait(self) -> int:
         while True:
@@ -71,13 +77,12 @@ class AioProcessNotifier:
                 return mask
 
     def __get(self) -> int:
-        try:
-            mask = self.__queue.get(timeout=0.1)
-            while not self.__queue.empty():
-                mask |= self.__queue.get()
-            return mask
-        except queue.Empty:
+        if not self.__event.wait(timeout=0.1):
             return -1
+        with self.__mask.get_lock():
+            self.__event.clear()
+            (mask, self.__mask.value) = (self.__mask.value, 0)
+        return mask
 
 
 # =====
@@ -259,6 +259,32 @@ class AioNotifier:
         return mask
 
 
+class AioCoalescingNotifier:
+    # В отличие от AioNotifier, уведомления не копятся в очереди, а схлопываются в одну маску
+    # до следующего wait(), даже если ждущий надолго занят или приостановлен.
+    # Поэтому ожидающий должен быть только один.
+
+    def __init__(self) -> None:
+        self.__event = asyncio.Event()
+        self.__mask = 0
+
+    def notify(self, mask: int=0) -> None:
+        self.__mask |= mask
+        self.__event.set()
+
+    async def wait(self, timeout: (float | None)=None) -> int:
+        if timeout is None:
+            await self.__event.wait()
+        else:
+            try:
+                await asyncio.wait_for(self.__event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return -1
+        self.__event.clear()
+        (mask, self.__mask) = (self.__mask, 0)
+        return mask
+
+
 # =====
 class AioStage:
     def __init__(self) -> None:
@@ -288,7 +314,7 @@ class AioExclusiveRegion:
     def __init__(
         self,
         exc_type: type[Exception],
-        notifier: (AioNotifier | None)=None,
+        notifier: (AioCoalescingNotifier | None)=None,
     ) -> None:
 
         self.__exc_type = exc_type
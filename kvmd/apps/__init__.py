@@ -90,6 +90,7 @@ from ..validators.kvm import valid_stream_fps
 from ..validators.kvm import valid_stream_resolution
 from ..validators.kvm import valid_stream_h264_bitrate
 from ..validators.kvm import valid_stream_h264_gop
+from ..validators.kvm import valid_stream_simulcast_variant
 
 from ..validators.ugpio import valid_ugpio_driver
 from ..validators.ugpio import valid_ugpio_channel
@@ -354,6 +355,7 @@ def _get_config_scheme() -> dict:
                 "heartbeat":         Option(15.0,  type=valid_float_f01),
                 "access_log_format": Option("[%P / %{X-Real-IP}i] '%r' => %s; size=%b ---"
                                             " referer='%{Referer}i'; user_agent='%{User-Agent}i'"),
+                "event_log_size":    Option(1024,  type=valid_int_f1),
             },
 
             "auth": {
@@ -515,6 +517,22 @@ def _get_config_scheme() -> dict:
                 "default_edid":      Option("/etc/kvmd/switch-edid.hex", type=valid_abs_path, unpack_as="default_edid_path"),
                 "ignore_hpd_on_top": Option(False, type=valid_bool),
             },
+
+            "recorder": {
+                "memsink": {
+                    "sink":             Option("",  unpack_as="obj"),
+                    "lock_timeout":     Option(1.0, type=valid_float_f01),
+                    "wait_timeout":     Option(1.0, type=valid_float_f01),
+                    "drop_same_frames": Option(0.0, type=valid_float_f0),
+                },
+
+                "storage":        Option("/var/lib/kvmd/recorder", type=valid_abs_path, unpack_as="storage_path"),
+                "segment_time":   Option(60.0,     type=valid_float_f01),
+                "segment_size":   Option(67108864, type=valid_int_f1),  # 64 MiB
+                "retention_time": Option(0.0,      type=valid_float_f0),
+                "retention_size": Option(0,        type=valid_int_f0),
+                "buffer_size":    Option(8388608,  type=valid_int_f1),  # 8 MiB
+            },
         },
 
         "media": {
@@ -541,6 +559,11 @@ def _get_config_scheme() -> dict:
                     "drop_same_frames": Option(0.0, type=valid_float_f0),
                 },
             },
+
+            "simulcast": {
+                "variants": Option([], type=functools.partial(valid_string_list, subval=valid_stream_simulcast_variant)),
+                "workers":  Option(2,  type=valid_int_f1),
+            },
         },
 
         "pst": {
@@ -744,11 +767,26 @@ def _get_config_scheme() -> dict:
             "keymap":          Option("/usr/share/kvmd/keymaps/en-us", type=valid_abs_file),
             "scroll_rate":     Option(4,   type=functools.partial(valid_number, min=1, max=30)),
             "allow_cut_after": Option(3.0, type=valid_float_f0),
+            "workers":         Option(2,   type=functools.partial(valid_number, min=1, max=16)),
+
+            "tiles": {
+                "enabled": Option(False, type=valid_bool),
+                "size":    Option(64, type=functools.partial(valid_number, min=16, max=512)),
+            },
+
+            "congestion": {
+                "enabled":     Option(False,  type=valid_bool),
+                "min_fps":     Option(5,      type=valid_stream_fps),
+                "min_quality": Option(30,     type=valid_stream_quality),
+                "high_water":  Option(262144, type=valid_int_f1),
+            },
 
             "server": {
                 "host":        Option("",   type=valid_ip_or_host, if_empty=""),
                 "port":        Option(5900, type=valid_port),
                 "max_clients": Option(10,   type=valid_int_f1),
+                "processes":   Option(1,    type=functools.partial(valid_number, min=1, max=16)),
+                "metrics":     Option("",   type=valid_abs_path, if_empty=""),
 
                 "no_delay": Option(True, type=valid_bool),
                 "keepalive": {
@@ -22,6 +22,9 @@
 
 from ...logging import get_logger
 
+from ...clients.streamer import StreamerFormats
+from ...clients.streamer import MemsinkStreamerClient
+
 from ...plugins.hid import get_hid_class
 from ...plugins.atx import get_atx_class
 from ...plugins.msd import get_msd_class
@@ -35,6 +38,7 @@ from .ugpio import UserGpio
 from .streamer import Streamer
 from .snapshoter import Snapshoter
 from .ocr import Ocr
+from .recorder import Recorder
 from .switch import Switch
 from .server import KvmdServer
 
@@ -109,10 +113,19 @@ def main(argv: (list[str] | None)=None) -> None:
             streamer=streamer,
             **config.snapshot._unpack(),
         ),
+        recorder=Recorder(
+            streamer=(
+                MemsinkStreamerClient("H264", StreamerFormats.H264, **config.recorder.memsink._unpack())
+                if config.recorder.memsink.sink else None
+            ),
+            **config.recorder._unpack(ignore=["memsink"]),
+        ),
 
         keymap_path=config.hid.keymap,
 
         stream_forever=config.streamer.forever,
-    ).run(**config.server._unpack())
+        event_log_size=config.server.event_log_size,
+        vnc_metrics_path=global_config.vnc.server.metrics,
+    ).run(**config.server._unpack(ignore=["event_log_size"]))
 
     get_logger(0).info("Bye-bye")
@@ -29,10 +29,15 @@ import async_lru
 from aiohttp.web import Request
 from aiohttp.web import Response
 
+from ....logging import get_logger
+
 from .... import tools
+from .... import aiotools
 
 from ....htserver import exposed_http
 
+from ....metrics import HttpMetrics
+
 from ....plugins.atx import BaseAtx
 from ....plugins.ugpio import UserGpioModes
 
@@ -42,16 +47,41 @@ from ..ugpio import UserGpio
 
 # =====
 class ExportApi:
-    def __init__(self, info_manager: InfoManager, atx: BaseAtx, user_gpio: UserGpio) -> None:
+    def __init__(
+        self,
+        info_manager: InfoManager,
+        atx: BaseAtx,
+        user_gpio: UserGpio,
+        http_metrics: HttpMetrics,
+        vnc_metrics_path: str,
+    ) -> None:
+
         self.__info_manager = info_manager
         self.__atx = atx
         self.__user_gpio = user_gpio
+        self.__http_metrics = http_metrics
+        self.__vnc_metrics_path = vnc_metrics_path
 
     # =====
 
     @exposed_http("GET", "/export/prometheus/metrics")
     async def __prometheus_metrics_handler(self, _: Request) -> Response:
-        return Response(text=(await self.__get_prometheus_metrics()))
+        # Метрики запросов не кешируются: они копятся в памяти и отдаются как есть
+        rows = self.__http_metrics.make_rows("kvmd")
+        text = (await self.__get_prometheus_metrics()) + "\n" + "\n".join(rows) + "\n"
+        return Response(text=text + (await self.__get_vnc_metrics()))
+
+    async def __get_vnc_metrics(self) -> str:
+        # kvmd-vnc пишет метрики своих воркеров в текстовый файл, отдаем их как есть.
+        # Если VNC выключен или еще не запустился, то файла просто нет.
+        if self.__vnc_metrics_path:
+            try:
+                return (await aiotools.read_file(self.__vnc_metrics_path))
+            except FileNotFoundError:
+                pass
+            except Exception as ex:
+                get_logger(0).error("Can't read VNC metrics %r: %s", self.__vnc_metrics_path, tools.efmt(ex))
+        return ""
 
     @async_lru.alru_cache(maxsize=1, ttl=5)
     async def __get_prometheus_metrics(self) -> str:
@@ -65,6 +65,7 @@ class HidApi:
 
         self.__keymaps_dir_path = os.path.dirname(keymap_path)
         self.__default_keymap_name = os.path.basename(keymap_path)
+        self.__keymaps: (tuple[int, list[str]] | None) = None
         self.__ensure_symmap(self.__default_keymap_name)
 
     # =====
@@ -100,15 +101,19 @@ class HidApi:
     # =====
 
     async def get_keymaps(self) -> dict:  # Ugly hack to generate hid_keymaps_state (see server.py)
-        keymaps: set[str] = set()
-        for keymap_name in os.listdir(self.__keymaps_dir_path):
-            path = os.path.join(self.__keymaps_dir_path, keymap_name)
-            if os.access(path, os.R_OK) and stat.S_ISREG(os.stat(path).st_mode):
-                keymaps.add(keymap_name)
+        # Список перечитывается только при изменении каталога, а не на каждое подключение
+        mtime = os.stat(self.__keymaps_dir_path).st_mtime_ns
+        if self.__keymaps is None or self.__keymaps[0] != mtime:
+            keymaps: set[str] = set()
+            for keymap_name in os.listdir(self.__keymaps_dir_path):
+                path = os.path.join(self.__keymaps_dir_path, keymap_name)
+                if os.access(path, os.R_OK) and stat.S_ISREG(os.stat(path).st_mode):
+                    keymaps.add(keymap_name)
+            self.__keymaps = (mtime, sorted(keymaps))
         return {
             "keymaps": {
                 "default": self.__default_keymap_name,
-                "available": sorted(keymaps),
+                "available": list(self.__keymaps[1]),
             },
         }
 
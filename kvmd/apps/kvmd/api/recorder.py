@@ -0,0 +1,51 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+from aiohttp.web import Request
+from aiohttp.web import Response
+
+from ....htserver import exposed_http
+from ....htserver import make_json_response
+
+from ..recorder import Recorder
+
+
+# =====
+class RecorderApi:
+    def __init__(self, recorder: Recorder) -> None:
+        self.__recorder = recorder
+
+    # =====
+
+    @exposed_http("GET", "/recorder")
+    async def __state_handler(self, _: Request) -> Response:
+        return make_json_response(await self.__recorder.get_state())
+
+    @exposed_http("POST", "/recorder/start")
+    async def __start_handler(self, _: Request) -> Response:
+        await self.__recorder.start()
+        return make_json_response()
+
+    @exposed_http("POST", "/recorder/stop")
+    async def __stop_handler(self, _: Request) -> Response:
+        await self.__recorder.stop()
+        return make_json_response()
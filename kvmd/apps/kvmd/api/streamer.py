@@ -78,7 +78,8 @@ class StreamerApi:
                     content_type="text/plain",
                 )
             elif valid_bool(req.query.get("preview", False)):
-                data = await snapshot.make_preview(
+                data = await self.__streamer.make_preview(
+                    snapshot=snapshot,
                     max_width=valid_int_f0(req.query.get("preview_max_width", 0)),
                     max_height=valid_int_f0(req.query.get("preview_max_height", 0)),
                     quality=valid_stream_quality(req.query.get("preview_quality", 80)),
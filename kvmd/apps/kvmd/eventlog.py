@@ -0,0 +1,100 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import asyncio
+import collections
+import dataclasses
+import itertools
+import secrets
+
+from ...htserver import make_ws_event
+
+
+# =====
+@dataclasses.dataclass
+class LoggedEvent:
+    seq:        int
+    event_type: str
+    event:      (dict | None)
+
+    def __post_init__(self) -> None:
+        self.__msg: (bytes | None) = None
+
+    def get_msg(self) -> bytes:
+        # Сериализуется только когда событие кому-то понадобилось, и только один раз
+        if self.__msg is None:
+            self.__msg = make_ws_event(self.event_type, self.event)
+        return self.__msg
+
+
+class EventLog:
+    # Ограниченный журнал событий состояния для докачки SSE по Last-Event-ID.
+    # В журнал пишется каждое событие поллеров, поэтому дельты в нем идут без пропусков.
+    # ID содержит метку запуска, чтобы ID от прошлого процесса не принимался за свой.
+
+    def __init__(self, size: int) -> None:
+        self.__epoch = secrets.token_hex(4)
+        self.__events: collections.deque[LoggedEvent] = collections.deque(maxlen=size)
+        self.__seq = 0
+        self.__changed = asyncio.Event()
+
+    def get_seq(self) -> int:
+        return self.__seq
+
+    def make_id(self, seq: int) -> str:
+        return f"{self.__epoch}-{seq}"
+
+    def find_seq(self, event_id: str) -> (int | None):
+        # None, если продолжить с этого места нельзя и нужно полное состояние
+        (epoch, _, seq_str) = event_id.strip().partition("-")
+        if epoch != self.__epoch or not seq_str.isdigit():
+            return None
+        seq = int(seq_str)
+        if self.__is_available(seq):
+            return seq
+        return None
+
+    def append(self, event_type: str, event: (dict | None)) -> None:
+        self.__seq += 1
+        self.__events.append(LoggedEvent(self.__seq, event_type, event))
+        self.__changed.set()
+        self.__changed = asyncio.Event()
+
+    def get_since(self, seq: int) -> (list[LoggedEvent] | None):
+        # None, если часть событий после seq уже вытеснена из журнала
+        if not self.__is_available(seq):
+            return None
+        count = self.__seq - seq
+        return list(itertools.islice(reversed(self.__events), count))[::-1]
+
+    async def wait(self, seq: int, timeout: float) -> bool:
+        if self.__seq > seq:
+            return True
+        try:
+            await asyncio.wait_for(self.__changed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def __is_available(self, seq: int) -> bool:
+        first = (self.__events[0].seq if self.__events else self.__seq + 1)
+        return (first - 1 <= seq <= self.__seq)
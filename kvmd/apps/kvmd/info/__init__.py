@@ -26,6 +26,8 @@ from typing import AsyncGenerator
 
 from ....yamlconf import Section
 
+from .... import aiotools
+
 from .base import BaseInfoSubmanager
 from .auth import AuthInfoSubmanager
 from .system import SystemInfoSubmanager
@@ -46,7 +48,10 @@ class InfoManager:
             "health": HealthInfoSubmanager(**config.kvmd.info.hw._unpack(ignore="platform")),
             "fan":    FanInfoSubmanager(**config.kvmd.info.fan._unpack()),
         }
-        self.__queue: "asyncio.Queue[tuple[str, (dict | None)]]" = asyncio.Queue()
+        self.__changes: dict[str, (dict | None)] = {}
+        self.__notifier = aiotools.AioCoalescingNotifier()
+        self.__consumed = asyncio.Event()
+        self.__consumed.set()
 
     def get_subs(self) -> set[str]:
         return set(self.__subs)
@@ -92,8 +97,13 @@ class InfoManager:
         # ===========================
 
         while True:
-            (field, value) = await self.__queue.get()
-            yield {field: value}
+            # Изменения полей схлопываются, пока их никто не забрал
+            await self.__notifier.wait()
+            if self.__changes:
+                (changes, self.__changes) = (self.__changes, {})
+                self.__consumed.clear()
+                yield changes
+                self.__consumed.set()
 
     async def systask(self) -> None:
         tasks = [
@@ -110,4 +120,8 @@ class InfoManager:
 
     async def __poller(self, field: str) -> None:
         async for state in self.__subs[field].poll_state():
-            self.__queue.put_nowait((field, state))
+            self.__changes[field] = state
+            self.__notifier.notify()
+            # Пока потребитель не забрал изменения (например, стоит без подписчиков),
+            # сабменеджеры стоят на yield и не опрашивают железо
+            await self.__consumed.wait()
@@ -31,7 +31,7 @@ from .base import BaseInfoSubmanager
 class AuthInfoSubmanager(BaseInfoSubmanager):
     def __init__(self, enabled: bool) -> None:
         self.__enabled = enabled
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> dict:
         return {"enabled": self.__enabled}
@@ -43,7 +43,7 @@ from .base import BaseInfoSubmanager
 class ExtrasInfoSubmanager(BaseInfoSubmanager):
     def __init__(self, global_config: Section) -> None:
         self.__global_config = global_config
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> (dict | None):
         try:
@@ -52,7 +52,7 @@ class FanInfoSubmanager(BaseInfoSubmanager):
         self.__timeout = timeout
         self.__state_poll = state_poll
 
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> dict:
         monitored = await self.__get_monitored()
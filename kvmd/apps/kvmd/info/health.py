@@ -21,7 +21,6 @@
 
 
 import asyncio
-import copy
 
 from typing import Callable
 from typing import AsyncGenerator
@@ -36,6 +35,8 @@ from .... import tools
 from .... import aiotools
 from .... import aioproc
 
+from ....statediff import StateStore
+
 from .base import BaseInfoSubmanager
 
 
@@ -56,7 +57,7 @@ class HealthInfoSubmanager(BaseInfoSubmanager):
         self.__ignore_past = ignore_past
         self.__state_poll = state_poll
 
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> dict:
         (
@@ -85,14 +86,14 @@ class HealthInfoSubmanager(BaseInfoSubmanager):
         self.__notifier.notify(1)
 
     async def poll_state(self) -> AsyncGenerator[dict, None]:
-        prev: dict = {}
+        store = StateStore(depth=0)  # Клиенты ждут стейт целиком
         while True:
             if (await self.__notifier.wait(timeout=self.__state_poll)) > 0:
-                prev = {}
-            new = await self.get_state()
-            if new != prev:
-                prev = copy.deepcopy(new)
-                yield new
+                yield store.reset(await self.get_state())
+            else:
+                diff = store.update(await self.get_state())
+                if diff is not None:
+                    yield diff
 
     # =====
 
@@ -35,7 +35,7 @@ from .base import BaseInfoSubmanager
 class MetaInfoSubmanager(BaseInfoSubmanager):
     def __init__(self, meta_path: str) -> None:
         self.__meta_path = meta_path
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> (dict | None):
         try:
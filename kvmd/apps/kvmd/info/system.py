@@ -49,7 +49,7 @@ class SystemInfoSubmanager(BaseInfoSubmanager):
         self.__streamer_cmd = streamer_cmd
 
         self.__dt_cache: dict[str, str] = {}
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> dict:
         (
@@ -0,0 +1,350 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import os
+import asyncio
+import collections
+import threading
+import time
+
+from typing import BinaryIO
+from typing import AsyncGenerator
+
+from ...logging import get_logger
+
+from ...errors import OperationError
+from ...errors import IsBusyError
+
+from ...clients.streamer import StreamerError
+from ...clients.streamer import BaseStreamerClient
+
+from ... import tools
+from ... import aiotools
+
+
+# =====
+class RecorderDisabledError(OperationError):
+    def __init__(self) -> None:
+        super().__init__("Recorder is disabled")
+
+
+class RecorderIsBusyError(IsBusyError, OperationError):
+    def __init__(self) -> None:
+        super().__init__("Recording is already in progress")
+
+
+class RecorderNotRecordingError(OperationError):
+    def __init__(self) -> None:
+        super().__init__("Recording is not running")
+
+
+# =====
+class _SegmentWriter(threading.Thread):  # pylint: disable=too-many-instance-attributes
+    # Пишет сегменты на диск в отдельном потоке, чтобы медленная флешка не тормозила
+    # ни луп, ни дефолтный экзекьютор. Буфер ограничен: если диск не успевает,
+    # write() вернет False и рекордер сам решит, что дропать.
+
+    __SUFFIX = ".h264"
+    __PART_SUFFIX = ".h264.part"
+
+    def __init__(
+        self,
+        storage_path: str,
+        buffer_size: int,
+        retention_time: float,
+        retention_size: int,
+    ) -> None:
+
+        super().__init__(name="recorder", daemon=True)
+
+        self.__storage_path = storage_path
+        self.__buffer_size = buffer_size
+        self.__retention_time = retention_time
+        self.__retention_size = retention_size
+
+        self.__cond = threading.Condition()
+        self.__queue: collections.deque[bytes | str | None] = collections.deque()
+        self.__buffered = 0
+        self.__stopped = False
+
+    def open_segment(self, name: str) -> None:
+        self.__put(name)
+
+    def close_segment(self) -> None:
+        self.__put(None)
+
+    def write(self, data: bytes) -> bool:
+        with self.__cond:
+            if self.__buffered and self.__buffered + len(data) > self.__buffer_size:
+                return False
+            self.__buffered += len(data)
+            self.__queue.append(data)
+            self.__cond.notify()
+        return True
+
+    def stop(self) -> None:
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify()
+        self.join()
+
+    def __put(self, item: (str | None)) -> None:
+        with self.__cond:
+            self.__queue.append(item)
+            self.__cond.notify()
+
+    # =====
+
+    def run(self) -> None:
+        logger = get_logger(0)
+        try:
+            os.makedirs(self.__storage_path, exist_ok=True)
+            self.__recover_parts()
+        except Exception:
+            logger.exception("Can't prepare recorder storage %r", self.__storage_path)
+        seg: (tuple[str, BinaryIO] | None) = None
+        while True:
+            with self.__cond:
+                while not self.__queue and not self.__stopped:
+                    self.__cond.wait()
+                if not self.__queue:
+                    break
+                items = list(self.__queue)
+                self.__queue.clear()
+
+            written = 0
+            for item in items:
+                if isinstance(item, bytes):
+                    written += len(item)
+                    if seg is not None:
+                        try:
+                            seg[1].write(item)
+                        except Exception:
+                            logger.exception("Can't write recorder segment %r", seg[0])
+                            self.__close(seg)
+                            seg = None
+                else:
+                    if seg is not None:
+                        self.__close(seg)
+                        seg = None
+                    if item is not None:
+                        seg = self.__open(item)
+
+            with self.__cond:
+                self.__buffered -= written
+
+        if seg is not None:
+            self.__close(seg)
+
+    def __open(self, name: str) -> (tuple[str, BinaryIO] | None):
+        path = os.path.join(self.__storage_path, name + self.__PART_SUFFIX)
+        try:
+            return (name, open(path, "wb"))  # pylint: disable=consider-using-with
+        except Exception:
+            get_logger(0).exception("Can't create recorder segment %r", path)
+            return None
+
+    def __close(self, seg: tuple[str, BinaryIO]) -> None:
+        logger = get_logger(0)
+        (name, file) = seg
+        path = os.path.join(self.__storage_path, name)
+        try:
+            file.close()
+            os.rename(path + self.__PART_SUFFIX, path + self.__SUFFIX)
+            logger.info("Recorder segment %r is closed", name + self.__SUFFIX)
+        except Exception:
+            logger.exception("Can't close recorder segment %r", name)
+        self.__cleanup_old()
+
+    def __recover_parts(self) -> None:
+        # Недописанные после падения сегменты - валидный Annex-B, просто обрезанный
+        for name in os.listdir(self.__storage_path):
+            if name.endswith(self.__PART_SUFFIX):
+                path = os.path.join(self.__storage_path, name)
+                os.rename(path, path[:-len(self.__PART_SUFFIX)] + self.__SUFFIX)
+
+    def __cleanup_old(self) -> None:
+        if not self.__retention_time and not self.__retention_size:
+            return
+        logger = get_logger(0)
+        try:
+            segs: list[tuple[str, os.stat_result]] = []
+            for name in sorted(os.listdir(self.__storage_path)):  # Имена начинаются с таймстемпа
+                if name.endswith(self.__SUFFIX):
+                    path = os.path.join(self.__storage_path, name)
+                    segs.append((path, os.stat(path)))
+            total = sum(st.st_size for (_, st) in segs)
+            expire_ts = time.time() - self.__retention_time
+            for (path, st) in segs:
+                if (
+                    (self.__retention_size and total > self.__retention_size)
+                    or (self.__retention_time and st.st_mtime < expire_ts)
+                ):
+                    os.remove(path)
+                    total -= st.st_size
+                    logger.info("Removed old recorder segment %r", path)
+        except Exception:
+            logger.exception("Can't cleanup old recorder segments")
+
+
+# =====
+class Recorder:  # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        streamer: (BaseStreamerClient | None),
+
+        storage_path: str,
+        segment_time: float,
+        segment_size: int,
+        retention_time: float,
+        retention_size: int,
+        buffer_size: int,
+    ) -> None:
+
+        self.__streamer = streamer
+
+        self.__storage_path = storage_path
+        self.__segment_time = segment_time
+        self.__segment_size = segment_size
+        self.__retention_time = retention_time
+        self.__retention_size = retention_size
+        self.__buffer_size = buffer_size
+
+        self.__wanted = False
+        self.__recording = False
+        self.__segment = ""
+        self.__dropped = 0
+
+        self.__ctl_notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
+
+    async def get_state(self) -> dict:
+        return {
+            "enabled": (self.__streamer is not None),
+            "recording": self.__recording,
+            "segment": (self.__segment or None),
+            "dropped": self.__dropped,
+        }
+
+    async def poll_state(self) -> AsyncGenerator[dict, None]:
+        while True:
+            await self.__notifier.wait()
+            yield (await self.get_state())
+
+    def recording(self) -> bool:
+        return self.__recording
+
+    async def start(self) -> None:
+        if self.__streamer is None:
+            raise RecorderDisabledError()
+        if self.__wanted:
+            raise RecorderIsBusyError()
+        self.__wanted = True
+        self.__ctl_notifier.notify()
+
+    async def stop(self) -> None:
+        if not self.__wanted:
+            raise RecorderNotRecordingError()
+        self.__wanted = False
+        self.__ctl_notifier.notify()
+
+    async def run(self, notifier: aiotools.AioNotifier) -> None:
+        while True:
+            await self.__ctl_notifier.wait()
+            if not self.__wanted:
+                continue
+
+            get_logger(0).info("Starting H264 recording to %r ...", self.__storage_path)
+            writer = _SegmentWriter(self.__storage_path, self.__buffer_size, self.__retention_time, self.__retention_size)
+            writer.start()
+            self.__set_recording(True, notifier)
+            task = asyncio.create_task(self.__record(writer))
+            try:
+                while self.__wanted:
+                    await self.__ctl_notifier.wait()
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await aiotools.run_async(writer.stop)
+                self.__segment = ""
+                self.__set_recording(False, notifier)
+                get_logger(0).info("H264 recording stopped")
+
+    async def cleanup(self) -> None:
+        self.__wanted = False
+        self.__ctl_notifier.notify()
+
+    def __set_recording(self, recording: bool, notifier: aiotools.AioNotifier) -> None:
+        self.__recording = recording
+        notifier.notify()  # Стрим должен работать, пока идет запись
+        self.__notifier.notify()
+
+    # =====
+
+    async def __record(self, writer: _SegmentWriter) -> None:
+        logger = get_logger(0)
+        while True:
+            try:
+                await self.__inner_record(writer)
+            except StreamerError as ex:
+                logger.error("Recorder stream error: %s", tools.efmt(ex))
+            except Exception:
+                logger.exception("Unexpected recorder error")
+            # После обрыва новый сегмент начнется с кейфрейма
+            writer.close_segment()
+            self.__segment = ""
+            await asyncio.sleep(1)
+
+    async def __inner_record(self, writer: _SegmentWriter) -> None:
+        assert self.__streamer is not None
+        async with self.__streamer.reading() as read_frame:
+            key_wait = True
+            seg_size = 0
+            seg_ts = 0.0
+            while True:
+                rotate = bool(self.__segment) and (
+                    seg_size >= self.__segment_size
+                    or time.monotonic() - seg_ts >= self.__segment_time
+                )
+                frame = await read_frame(key_wait or rotate)
+                if frame["key"] and (not self.__segment or rotate):
+                    self.__segment = self.__make_segment_name()
+                    writer.open_segment(self.__segment)
+                    seg_size = 0
+                    seg_ts = time.monotonic()
+                    self.__notifier.notify()
+                if key_wait:
+                    if not frame["key"]:
+                        continue  # P-фреймы без кейфрейма бесполезны
+                    key_wait = False
+                if writer.write(frame["data"]):
+                    seg_size += len(frame["data"])
+                else:
+                    # Диск не успевает: выкидываем все до следующего кейфрейма,
+                    # сегмент остается декодируемым, просто с пропуском.
+                    self.__dropped += 1
+                    key_wait = True
+                    self.__notifier.notify()
+
+    def __make_segment_name(self) -> str:
+        now = time.time()
+        return time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)) + f"-{int(now * 1000) % 1000:03d}"
@@ -20,7 +20,9 @@
 # ========================================================================== #
 
 
+import asyncio
 import dataclasses
+import functools
 
 from typing import Callable
 from typing import Coroutine
@@ -29,6 +31,7 @@ from typing import Any
 
 from aiohttp.web import Request
 from aiohttp.web import Response
+from aiohttp.web import StreamResponse
 from aiohttp.web import WebSocketResponse
 
 from ... import __version__
@@ -44,7 +47,10 @@ from ...htserver import HttpExposed
 from ...htserver import exposed_http
 from ...htserver import exposed_ws
 from ...htserver import make_json_response
+from ...htserver import make_ws_event
+from ...htserver import get_ws_encodings
 from ...htserver import WsSession
+from ...htserver import SseSession
 from ...htserver import HttpServer
 
 from ...plugins import BasePlugin
@@ -58,6 +64,8 @@ from ...validators.kvm import valid_stream_fps
 from ...validators.kvm import valid_stream_resolution
 from ...validators.kvm import valid_stream_h264_bitrate
 from ...validators.kvm import valid_stream_h264_gop
+from ...validators.kvm import valid_ws_topics
+from ...validators.kvm import valid_ws_encoding
 
 from .auth import AuthManager
 from .info import InfoManager
@@ -66,7 +74,9 @@ from .ugpio import UserGpio
 from .streamer import Streamer
 from .snapshoter import Snapshoter
 from .ocr import Ocr
+from .recorder import Recorder
 from .switch import Switch
+from .eventlog import EventLog
 
 from .api.auth import AuthApi
 from .api.auth import check_request_auth
@@ -79,6 +89,7 @@ from .api.atx import AtxApi
 from .api.msd import MsdApi
 from .api.streamer import StreamerApi
 from .api.switch import SwitchApi
+from .api.recorder import RecorderApi
 from .api.export import ExportApi
 from .api.redfish import RedfishApi
 
@@ -107,12 +118,12 @@ class _Subsystem:
     sysprep:       (Callable[[], None] | None)
     systask:       (Callable[[], Coroutine[Any, Any, None]] | None)
     cleanup:       (Callable[[], Coroutine[Any, Any, dict]] | None)
-    trigger_state: (Callable[[], Coroutine[Any, Any, None]] | None) = None
+    get_state:     (Callable[[], Coroutine[Any, Any, dict]] | None) = None
     poll_state:    (Callable[[], AsyncGenerator[dict, None]] | None) = None
 
     def __post_init__(self) -> None:
         if self.event_type:
-            assert self.trigger_state
+            assert self.get_state
             assert self.poll_state
 
     @classmethod
@@ -125,7 +136,7 @@ class _Subsystem:
             sysprep=getattr(obj, "sysprep", None),
             systask=getattr(obj, "systask", None),
             cleanup=getattr(obj, "cleanup", None),
-            trigger_state=getattr(obj, "trigger_state", None),
+            get_state=getattr(obj, "get_state", None),
             poll_state=getattr(obj, "poll_state", None),
         )
 
@@ -140,6 +151,9 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
     __EV_OCR_STATE = "ocr"
     __EV_INFO_STATE = "info"
     __EV_SWITCH_STATE = "switch"
+    __EV_RECORDER_STATE = "recorder"
+
+    __STATE_RETRIES = 3
 
     def __init__(  # pylint: disable=too-many-arguments,too-many-locals
         self,
@@ -155,10 +169,13 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
         msd: BaseMsd,
         streamer: Streamer,
         snapshoter: Snapshoter,
+        recorder: Recorder,
 
         keymap_path: str,
 
         stream_forever: bool,
+        event_log_size: int,
+        vnc_metrics_path: str,
     ) -> None:
 
         super().__init__()
@@ -167,6 +184,7 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
         self.__hid = hid
         self.__streamer = streamer
         self.__snapshoter = snapshoter  # Not a component: No state or cleanup
+        self.__recorder = recorder
 
         self.__stream_forever = stream_forever
 
@@ -182,7 +200,8 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
             MsdApi(msd),
             StreamerApi(streamer, ocr),
             SwitchApi(switch),
-            ExportApi(info_manager, atx, user_gpio),
+            RecorderApi(recorder),
+            ExportApi(info_manager, atx, user_gpio, self._get_http_metrics(), vnc_metrics_path),
             RedfishApi(info_manager, atx),
         ]
         self.__subsystems = [
@@ -195,8 +214,17 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
             _Subsystem.make(ocr,          "OCR",          self.__EV_OCR_STATE),
             _Subsystem.make(info_manager, "Info manager", self.__EV_INFO_STATE),
             _Subsystem.make(switch,       "Switch",       self.__EV_SWITCH_STATE),
+            _Subsystem.make(recorder,     "Recorder",     self.__EV_RECORDER_STATE),
         ]
 
+        self.__topics = {
+            sub.event_type
+            for sub in self.__subsystems
+            if sub.event_type
+        } | {self.__EV_HID_KEYMAPS_STATE}
+        self.__states: dict[str, asyncio.Task] = {}
+        self.__event_log = EventLog(event_log_size)
+
         self.__streamer_notifier = aiotools.AioNotifier()
         self.__reset_streamer = False
         self.__new_streamer_params: dict = {}
@@ -235,7 +263,9 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
     @exposed_http("GET", "/ws")
     async def __ws_handler(self, req: Request) -> WebSocketResponse:
         stream = valid_bool(req.query.get("stream", True))
-        async with self._ws_session(req, stream=stream) as ws:
+        topics = (valid_ws_topics(req.query["topics"], self.__topics) if "topics" in req.query else None)
+        encoding = valid_ws_encoding(req.query.get("encoding", "json"), get_ws_encodings())
+        async with self._ws_session(req, stream=stream, topics=topics, encoding=encoding) as ws:
             (major, minor) = __version__.split(".")
             await ws.send_event("loop", {
                 "version": {
@@ -243,13 +273,67 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
                     "minor": int(minor),
                 },
             })
-            for sub in self.__subsystems:
-                if sub.event_type:
-                    assert sub.trigger_state
-                    await sub.trigger_state()
-            await self._broadcast_ws_event(self.__EV_HID_KEYMAPS_STATE, await self.__hid_api.get_keymaps())  # FIXME
+            await self.__send_initial_states(ws, (self.__topics if topics is None else topics))
             return (await self._ws_loop(ws))
 
+    # ===== SSE
+
+    @exposed_http("GET", "/state/stream")
+    async def __state_stream_handler(self, req: Request) -> StreamResponse:
+        topics = (valid_ws_topics(req.query["topics"], self.__topics) if "topics" in req.query else set(self.__topics))
+        event_id = req.headers.get("Last-Event-ID", "")
+        seq = (self.__event_log.find_seq(event_id) if event_id else None)
+        async with self._sse_session(req, topics) as sse:
+            since: dict[str, int] = {}
+            if seq is None:
+                (seq, since) = await self.__send_sse_states(sse, topics)
+            sent = -1
+            while True:
+                events = self.__event_log.get_since(seq)
+                if events is None:
+                    # Клиент отстал больше, чем на размер журнала
+                    (seq, since) = await self.__send_sse_states(sse, topics)
+                    continue
+                for item in events:
+                    if item.event_type in topics and item.seq > since.get(item.event_type, 0):
+                        await sse.send_event(item.get_msg(), self.__event_log.make_id(item.seq))
+                        sent = item.seq
+                    seq = item.seq
+                if sent != seq:
+                    await sse.send_event(None, self.__event_log.make_id(seq))
+                    sent = seq
+                if not (await self.__event_log.wait(seq, sse.heartbeat)):
+                    await sse.send_ping()
+        return sse.resp
+
+    async def __send_sse_states(self, sse: SseSession, topics: set[str]) -> tuple[int, dict[str, int]]:
+        # Полное состояние отправляется без id. Для каждого типа запоминается место в журнале,
+        # на котором оно было актуально, и более ранние события этого типа пропускаются.
+        seq = self.__event_log.get_seq()
+        since: dict[str, int] = {}
+        for sub in self.__subsystems:
+            if sub.event_type in topics:
+                state = await self.__get_initial_state(sub)
+                since[sub.event_type] = self.__event_log.get_seq()
+                if state is not None:
+                    await sse.send_event(make_ws_event(sub.event_type, state))
+        if self.__EV_HID_KEYMAPS_STATE in topics:
+            await sse.send_event(make_ws_event(self.__EV_HID_KEYMAPS_STATE, await self.__hid_api.get_keymaps()))  # FIXME
+        return (seq, since)
+
+    @exposed_ws("subscribe")
+    async def __ws_subscribe_handler(self, ws: WsSession, event: dict) -> None:
+        try:
+            topics = (None if event.get("topics") is None else valid_ws_topics(event["topics"], self.__topics))
+        except Exception:
+            return
+        prev = self._get_ws_topics(ws)
+        self._set_ws_topics(ws, topics)
+        await self.__send_initial_states(ws, (
+            (self.__topics if topics is None else topics)
+            - (self.__topics if prev is None else prev)
+        ))
+
     @exposed_ws("ping")
     async def __ws_ping_handler(self, ws: WsSession, _: dict) -> None:
         await ws.send_event("pong", {})
@@ -276,9 +360,9 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
             if sub.systask:
                 aiotools.create_deadly_task(sub.name, sub.systask())
             if sub.event_type:
-                assert sub.poll_state
-                aiotools.create_deadly_task(f"{sub.name} [poller]", self.__poll_state(sub.event_type, sub.poll_state()))
+                aiotools.create_deadly_task(f"{sub.name} [poller]", self.__poll_state(sub))
         aiotools.create_deadly_task("Stream snapshoter", self.__stream_snapshoter())
+        aiotools.create_deadly_task("Stream recorder", self.__recorder.run(self.__streamer_notifier))
         self._add_exposed(*self.__apis)
 
     async def _on_shutdown(self) -> None:
@@ -320,7 +404,12 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
     async def __stream_controller(self) -> None:
         prev = False
         while True:
-            cur = (self.__has_stream_clients() or self.__snapshoter.snapshoting() or self.__stream_forever)
+            cur = (
+                self.__has_stream_clients()
+                or self.__snapshoter.snapshoting()
+                or self.__recorder.recording()
+                or self.__stream_forever
+            )
             if not prev and cur:
                 await self.__streamer.ensure_start(reset=False)
             elif prev and not cur:
@@ -345,6 +434,53 @@ class KvmdServer(HttpServer):  # pylint: disable=too-many-arguments,too-many-ins
             notifier=self.__streamer_notifier,
         )
 
-    async def __poll_state(self, event_type: str, poller: AsyncGenerator[dict, None]) -> None:
-        async for state in poller:
-            await self._broadcast_ws_event(event_type, state)
+    async def __poll_state(self, sub: _Subsystem) -> None:
+        assert sub.poll_state
+        event_type = sub.event_type
+        # Медленному клиенту вместо пачки дельт уйдет одно актуальное полное состояние
+        get_state = functools.partial(self.__get_initial_state, sub)
+        async for state in sub.poll_state():
+            self.__states.pop(event_type, None)  # Кеш полного состояния больше не актуален
+            self.__event_log.append(event_type, state)
+            if self._has_subscribers(event_type):
+                await self._broadcast_ws_event(event_type, state, get_state)
+            else:
+                # Никто не подписан - не забираем новые события, и поллер стоит на yield
+                # вместо того чтобы опрашивать железо. Текущее событие к тому времени
+                # устареет, а новый подписчик все равно получит полное состояние.
+                # Нотифаеры подсистем схлопывают уведомления, так что пока поллер стоит, ничего не копится.
+                await self._wait_subscribers(event_type)
+
+    async def __send_initial_states(self, ws: WsSession, topics: set[str]) -> None:
+        # Новый подписчик получает полное состояние только сам, остальным идут лишь изменения
+        for sub in self.__subsystems:
+            if sub.event_type in topics:
+                state = await self.__get_initial_state(sub)
+                if state is not None:
+                    await ws.send_event(sub.event_type, state)
+        if self.__EV_HID_KEYMAPS_STATE in topics:
+            await ws.send_event(self.__EV_HID_KEYMAPS_STATE, await self.__hid_api.get_keymaps())  # FIXME
+
+    async def __get_initial_state(self, sub: _Subsystem) -> (dict | None):
+        # Полное состояние кешируется до первого изменения, так что пачка переподключений
+        # стоит одного get_state(). Если состояние поменялось, пока мы его получали,
+        # снапшот мог оказаться старее уже разосланных изменений - получаем заново.
+        # Ошибка тоже повторяется, и только после последней попытки клиент остается без состояния.
+        assert sub.get_state
+        state: (dict | None) = None
+        for attempt in range(1, self.__STATE_RETRIES + 1):
+            task = self.__states.get(sub.event_type)
+            if task is None:
+                task = self.__states[sub.event_type] = asyncio.create_task(sub.get_state())
+            try:
+                state = await asyncio.shield(task)
+            except Exception:
+                if self.__states.get(sub.event_type) is task:
+                    self.__states.pop(sub.event_type)
+                if attempt < self.__STATE_RETRIES:
+                    continue
+                get_logger(0).exception("Can't get the initial state of %s", sub.name)
+                return None
+            if self.__states.get(sub.event_type) is task:
+                break
+        return state
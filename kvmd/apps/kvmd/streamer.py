@@ -23,7 +23,7 @@
 import signal
 import asyncio
 import asyncio.subprocess
-import dataclasses
+import concurrent.futures
 import copy
 
 from typing import AsyncGenerator
@@ -42,6 +42,8 @@ from ... import aiotools
 from ... import aioproc
 from ... import htclient
 
+from ...statediff import StateStore
+
 
 # =====
 class _StreamerParams:
@@ -201,7 +203,11 @@ class Streamer:  # pylint: disable=too-many-instance-attributes
 
         self.__snapshot: (StreamerSnapshot | None) = None
 
-        self.__notifier = aiotools.AioNotifier()
+        # Свой небольшой пул для превью: пачка запросов не должна забивать дефолтный экзекутор,
+        # через который идет остальная блокирующая работа. Потоки создаются только по запросу.
+        self.__preview_executor = concurrent.futures.ThreadPoolExecutor(2, thread_name_prefix="streamer-preview")
+
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     # =====
 
@@ -302,34 +308,27 @@ class Streamer:  # pylint: disable=too-many-instance-attributes
         get_logger(0).info("Installing SIGUSR2 streamer handler ...")
         asyncio.get_event_loop().add_signal_handler(signal.SIGUSR2, signal_handler)
 
-        prev: dict = {}
+        store = StateStore(depth=1)
         while True:
-            new: dict = {}
-
             mask = await self.__notifier.wait(timeout=self.__state_poll)
             if mask == self.__ST_FULL:
-                new = await self.get_state()
-                prev = copy.deepcopy(new)
-                yield new
+                yield store.reset(await self.get_state())
                 continue
 
             if mask < 0:
                 mask = self.__ST_STREAMER
 
-            def check_update(key: str, value: (dict | None)) -> None:
-                if prev.get(key) != value:
-                    new[key] = value
-
+            new: dict = {}
             if mask & self.__ST_PARAMS:
-                check_update("params", self.__params.get_params())
+                new["params"] = self.__params.get_params()
             if mask & self.__ST_STREAMER:
-                check_update("streamer", await self.__get_streamer_state())
+                new["streamer"] = await self.__get_streamer_state()
             if mask & self.__ST_SNAPSHOT:
-                check_update("snapshot", self.__get_snapshot_state())
+                new["snapshot"] = self.__get_snapshot_state()
 
-            if new and prev != new:
-                prev.update(copy.deepcopy(new))
-                yield new
+            diff = store.update(new, partial=True)
+            if diff is not None:
+                yield diff
 
     async def __get_streamer_state(self) -> (dict | None):
         if self.__streamer_task:
@@ -344,10 +343,11 @@ class Streamer:  # pylint: disable=too-many-instance-attributes
 
     def __get_snapshot_state(self) -> dict:
         if self.__snapshot:
-            snapshot = dataclasses.asdict(self.__snapshot)
-            del snapshot["headers"]
-            del snapshot["data"]
-            return {"saved": snapshot}
+            return {"saved": {
+                "online": self.__snapshot.online,
+                "width": self.__snapshot.width,
+                "height": self.__snapshot.height,
+            }}
         return {"saved": None}
 
     # =====
@@ -374,6 +374,9 @@ class Streamer:  # pylint: disable=too-many-instance-attributes
     def remove_snapshot(self) -> None:
         self.__snapshot = None
 
+    async def make_preview(self, snapshot: StreamerSnapshot, max_width: int, max_height: int, quality: int) -> bytes:
+        return (await snapshot.make_preview(max_width, max_height, quality, self.__preview_executor))
+
     # =====
 
     @aiotools.atomic_fg
@@ -382,6 +385,7 @@ class Streamer:  # pylint: disable=too-many-instance-attributes
         if self.__client_session:
             await self.__client_session.close()
             self.__client_session = None
+        self.__preview_executor.shutdown(wait=False, cancel_futures=True)
 
     def __ensure_client_session(self) -> HttpStreamerClientSession:
         if not self.__client_session:
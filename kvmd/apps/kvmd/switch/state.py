@@ -20,12 +20,13 @@
 # ========================================================================== #
 
 
-import asyncio
 import dataclasses
 import time
 
 from typing import AsyncGenerator
 
+from .lib import aiotools
+
 from .types import Edids
 from .types import Color
 from .types import Colors
@@ -72,7 +73,7 @@ class StateCache:  # pylint: disable=too-many-instance-attributes
         self.__active_port = -1
         self.__synced = True
 
-        self.__queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     def get_edids(self) -> Edids:
         return self.__edids.copy()
@@ -103,10 +104,7 @@ class StateCache:  # pylint: disable=too-many-instance-attributes
     async def poll_state(self) -> AsyncGenerator[dict, None]:
         atx_ts: float = 0
         while True:
-            try:
-                mask = await asyncio.wait_for(self.__queue.get(), timeout=0.1)
-            except TimeoutError:
-                mask = 0
+            mask = max(await self.__notifier.wait(timeout=0.1), 0)
 
             if mask == self.__ATX:
                 # Откладываем единичное новое событие ATX, чтобы аккумулировать с нескольких свичей
@@ -314,7 +312,7 @@ class StateCache:  # pylint: disable=too-many-instance-attributes
 
     def __bump_state(self, mask: int) -> None:
         assert mask != 0
-        self.__queue.put_nowait(mask)
+        self.__notifier.notify(mask)
 
     # =====
 
@@ -34,6 +34,8 @@ from ...errors import IsBusyError
 from ... import tools
 from ... import aiotools
 
+from ...statediff import StateStore
+
 from ...plugins.ugpio import GpioError
 from ...plugins.ugpio import GpioOperationError
 from ...plugins.ugpio import GpioDriverOfflineError
@@ -112,7 +114,7 @@ class _GpioOutput:  # pylint: disable=too-many-instance-attributes
         ch: str,
         config: Section,
         driver: BaseUserGpioDriver,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
     ) -> None:
 
         self.__ch = ch
@@ -233,7 +235,7 @@ class _GpioOutput:  # pylint: disable=too-many-instance-attributes
 # =====
 class UserGpio:
     def __init__(self, config: Section, otg_config: Section) -> None:
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
         self.__drivers = {
             driver: get_ugpio_driver_class(drv_config.type)(
@@ -277,23 +279,15 @@ class UserGpio:
         #   - state.outputs -- Partial
         # ===========================
 
-        prev: dict = {"inputs": {}, "outputs": {}}
-        while True:  # pylint: disable=too-many-nested-blocks
+        store = StateStore(depth=2)
+        while True:
             if (await self.__notifier.wait()) > 0:
                 full = await self.get_state()
-                prev = copy.deepcopy(full["state"])
+                store.reset(full["state"])
                 yield full
             else:
-                new = await self.__get_io_state()
-                diff: dict = {}
-                for sub in ["inputs", "outputs"]:
-                    for ch in new[sub]:
-                        if new[sub][ch] != prev[sub].get(ch):
-                            if sub not in diff:
-                                diff[sub] = {}
-                            diff[sub][ch] = new[sub][ch]
-                if diff:
-                    prev = copy.deepcopy(new)
+                diff = store.update(await self.__get_io_state())
+                if diff is not None:
                     yield {"state": diff}
 
     async def __get_io_state(self) -> dict:
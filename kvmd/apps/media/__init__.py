@@ -45,4 +45,6 @@ def main(argv: (list[str] | None)=None) -> None:
     MediaServer(
         h264_streamer=make_streamer("h264", StreamerFormats.H264),
         jpeg_streamer=make_streamer("jpeg", StreamerFormats.JPEG),
+        simulcast_variants=config.simulcast.variants,
+        simulcast_workers=config.simulcast.workers,
     ).run(**config.server._unpack())
@@ -0,0 +1,82 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import dataclasses
+import time
+
+
+# =====
+@dataclasses.dataclass(frozen=True)
+class MediaFrame:
+    key:     bool
+    msg:     bytes  # Готовое бинарное сообщение для websocket, одно на всех клиентов
+    grab_ts: float
+    recv_ts: float
+
+
+class GopRing:
+    # Текущая GOP для новых клиентов: кейфрейм и все P-фреймы после него.
+    # Заодно ограничивает частоту запросов кейфрейма у энкодера.
+
+    def __init__(
+        self,
+        max_frames: int=128,
+        max_size: int=(16 * 1024 * 1024),
+        key_interval: float=1.0,
+    ) -> None:
+
+        self.__max_frames = max_frames
+        self.__max_size = max_size
+        self.__key_interval = key_interval
+
+        self.__frames: list[MediaFrame] = []
+        self.__size = 0
+
+        self.__key_wanted = False
+        self.__key_allow_ts = 0.0
+
+    def get_frames(self) -> list[MediaFrame]:
+        return list(self.__frames)
+
+    def request_key(self) -> None:
+        self.__key_wanted = True
+
+    def is_key_required(self) -> bool:
+        # Кейфрейм у энкодера запрашивается не чаще раза в key_interval, считая от последнего
+        return (self.__key_wanted and time.monotonic() >= self.__key_allow_ts)
+
+    def push(self, frame: MediaFrame) -> None:
+        if frame.key:
+            self.__key_wanted = False
+            self.__key_allow_ts = time.monotonic() + self.__key_interval
+            self.reset()
+        elif not self.__frames:
+            return  # Ждем кейфрейм
+        self.__frames.append(frame)
+        self.__size += len(frame.msg)
+        if len(self.__frames) > self.__max_frames or self.__size > self.__max_size:
+            # Слишком длинная GOP, новые клиенты подождут кейфрейм
+            self.reset()
+
+    def reset(self) -> None:
+        self.__frames = []
+        self.__size = 0
@@ -22,8 +22,11 @@
 
 import asyncio
 import dataclasses
+import time
+import concurrent.futures
 
 from aiohttp.web import Request
+from aiohttp.web import Response
 from aiohttp.web import WebSocketResponse
 
 from ...logging import get_logger
@@ -31,8 +34,16 @@ from ...logging import get_logger
 from ... import tools
 from ... import aiotools
 
+from ...metrics import FrameLatency
+
+from .gop import MediaFrame
+from .gop import GopRing
+from .simulcast import SimulcastVariant
+from .simulcast import SimulcastStreamerClient
+
 from ...htserver import exposed_http
 from ...htserver import exposed_ws
+from ...htserver import make_ws_bin
 from ...htserver import WsSession
 from ...htserver import HttpServer
 
@@ -43,25 +54,32 @@ from ...clients.streamer import BaseStreamerClient
 
 
 # =====
-@dataclasses.dataclass
-class _Source:
-    type:         str
-    fmt:          str
-    streamer:     BaseStreamerClient
-    meta:         dict = dataclasses.field(default_factory=dict)
-    clients:      dict[WsSession, "_Client"] = dataclasses.field(default_factory=dict)
-    key_required: bool = dataclasses.field(default=False)
+@dataclasses.dataclass(eq=False)  # Сравнение по идентичности, см. __switch_variant()
+class _Source:  # pylint: disable=too-many-instance-attributes
+    type:     str
+    fmt:      str
+    streamer: BaseStreamerClient
+    meta:     dict = dataclasses.field(default_factory=dict)
+    variant:  str = dataclasses.field(default="")
+    clients:  dict[WsSession, "_Client"] = dataclasses.field(default_factory=dict)
+    gop:      GopRing = dataclasses.field(default_factory=GopRing)
+    latency:  FrameLatency = dataclasses.field(default_factory=FrameLatency)
+    notifier: aiotools.AioCoalescingNotifier = dataclasses.field(default_factory=aiotools.AioCoalescingNotifier)  # Новый подписчик
 
     def is_diff(self) -> bool:
         return StreamerFormats.is_diff(self.streamer.get_format())
 
 
 @dataclasses.dataclass
-class _Client:
-    ws:     WsSession
-    src:    _Source
-    queue:  asyncio.Queue[dict]
-    sender: (asyncio.Task | None) = dataclasses.field(default=None)
+class _Client:  # pylint: disable=too-many-instance-attributes
+    ws:        WsSession
+    src:       _Source
+    queue:     asyncio.Queue[MediaFrame]
+    backlog:   list[MediaFrame]
+    key_wait:  bool
+    auto:      bool = dataclasses.field(default=False)
+    switch_ts: float = dataclasses.field(default=0.0)
+    sender:    (asyncio.Task | None) = dataclasses.field(default=None)
 
 
 class MediaServer(HttpServer):
@@ -72,10 +90,15 @@ class MediaServer(HttpServer):
 
     __Q_SIZE = 32
 
+    __V_AUTO = "auto"
+    __AUTO_UP_INTERVAL = 10.0
+
     def __init__(
         self,
         h264_streamer: (BaseStreamerClient | None),
         jpeg_streamer: (BaseStreamerClient | None),
+        simulcast_variants: list[str],
+        simulcast_workers: int,
     ) -> None:
 
         super().__init__()
@@ -83,20 +106,46 @@ class MediaServer(HttpServer):
         self.__srcs: list[_Source] = []
         if h264_streamer:
             self.__srcs.append(_Source(self.__K_VIDEO, self.__F_H264, h264_streamer, {"profile_level_id": "42E01F"}))
+
+        # Лестница JPEG от оригинала к самому маленькому варианту, по ней ходит автовыбор
+        self.__jpeg_ladder: list[_Source] = []
         if jpeg_streamer:
-            self.__srcs.append(_Source(self.__K_VIDEO, self.__F_JPEG, jpeg_streamer))
+            variants = sorted(
+                map(SimulcastVariant.from_string, dict.fromkeys(simulcast_variants)),
+                key=(lambda variant: (variant.max_width * variant.max_height, variant.quality)),
+                reverse=True,
+            )
+            meta = {"variants": [variant.name for variant in variants]}
+            self.__jpeg_ladder.append(_Source(self.__K_VIDEO, self.__F_JPEG, jpeg_streamer, meta))
+            if variants:
+                executor = concurrent.futures.ThreadPoolExecutor(simulcast_workers, thread_name_prefix="media-simulcast")
+                for variant in variants:
+                    streamer = SimulcastStreamerClient(jpeg_streamer, variant, executor)
+                    self.__jpeg_ladder.append(_Source(self.__K_VIDEO, self.__F_JPEG, streamer, meta, variant.name))
+            self.__srcs.extend(self.__jpeg_ladder)
 
     # =====
 
     @exposed_http("GET", "/ws")
     async def __ws_handler(self, req: Request) -> WebSocketResponse:
-        async with self._ws_session(req) as ws:
+        # Видео не сжимается, а permessage-deflate стоил бы отдельного прохода по каждому кадру для каждого клиента
+        async with self._ws_session(req, compress=False) as ws:
             media: dict = {self.__K_VIDEO: {}}
             for src in self.__srcs:
-                media[src.type][src.fmt] = src.meta
+                if not src.variant:
+                    media[src.type][src.fmt] = src.meta
             await ws.send_event("media", media)
             return (await self._ws_loop(ws))
 
+    @exposed_http("GET", "/metrics")
+    async def __metrics_handler(self, _: Request) -> Response:
+        # Клиенты агрегируются по источнику: метка на каждого клиента дала бы неограниченное число серий
+        rows = FrameLatency.make_rows("kvmd_media_frame", [
+            ({"format": src.fmt, "variant": src.variant}, src.latency)
+            for src in self.__srcs
+        ])
+        return Response(text="\n".join(rows) + "\n")
+
     @exposed_ws(0)
     async def __ws_bin_ping_handler(self, ws: WsSession, _: bytes) -> None:
         await ws.send_bin(255, b"")  # Ping-pong
@@ -104,9 +153,11 @@ class MediaServer(HttpServer):
     @exposed_ws(1)
     async def __ws_bin_key_handler(self, ws: WsSession, _: bytes) -> None:
         for src in self.__srcs:
-            if ws in src.clients:
+            client = src.clients.get(ws)
+            if client:
                 if src.is_diff():
-                    src.key_required = True
+                    client.key_wait = True
+                    src.gop.request_key()
                 break
 
     @exposed_ws("start")
@@ -114,18 +165,37 @@ class MediaServer(HttpServer):
         try:
             req_type = str(event.get("type"))
             req_fmt = str(event.get("format"))
+            req_variant = str(event.get("variant", ""))
         except Exception:
             return
+        auto = (req_variant == self.__V_AUTO)
+        if auto:
+            req_variant = ""  # Автовыбор начинается с оригинала и спускается при перегрузке
         src: (_Source | None) = None
         for cand in self.__srcs:
             if ws in cand.clients:
                 return  # Don't allow any double streaming
-            if (cand.type, cand.fmt) == (req_type, req_fmt):
+            if (cand.type, cand.fmt, cand.variant) == (req_type, req_fmt, req_variant):
                 src = cand
         if src:
-            client = _Client(ws, src, asyncio.Queue(self.__Q_SIZE))
+            # Новый клиент сразу получает текущую GOP из кольца: кейфрейм и все P-фреймы после него.
+            # Кольцо и очередь заполняются в одном и том же потоке, поэтому кадры не теряются и не дублируются.
+            backlog = src.gop.get_frames()
+            key_wait = (src.is_diff() and not backlog)
+            if key_wait:
+                src.gop.request_key()
+            client = _Client(
+                ws=ws,
+                src=src,
+                queue=asyncio.Queue(self.__Q_SIZE),
+                backlog=backlog,
+                key_wait=key_wait,
+                auto=(auto and src.fmt == self.__F_JPEG),
+                switch_ts=time.monotonic(),
+            )
             client.sender = aiotools.create_deadly_task(str(ws), self.__sender(client))
             src.clients[ws] = client
+            src.notifier.notify()
             get_logger(0).info("Streaming %s to %s ...", src.streamer, ws)
 
     # =====
@@ -156,41 +226,48 @@ class MediaServer(HttpServer):
     # =====
 
     async def __sender(self, client: _Client) -> None:
-        need_key = client.src.is_diff()
-        if need_key:
-            client.src.key_required = True
-        has_key = False
+        (backlog, client.backlog) = (client.backlog, [])
+        for frame in backlog:
+            try:
+                await client.ws.send_prepared_bin(frame.msg)
+            except Exception:
+                pass
         while True:
             frame = await client.queue.get()
-            has_key = (not need_key or has_key or frame["key"])
-            if has_key:
-                try:
-                    await client.ws.send_bin(1, frame["key"].to_bytes() + frame["data"])
-                except Exception:
-                    pass
+            dequeue_ts = time.monotonic()
+            if client.key_wait:
+                if not frame.key:
+                    continue  # P-фреймы без кейфрейма бесполезны
+                client.key_wait = False
+            try:
+                await client.ws.send_prepared_bin(frame.msg)
+            except Exception:
+                pass
+            else:
+                client.src.latency.observe(frame.grab_ts, frame.recv_ts, dequeue_ts, dequeue_ts, time.monotonic())
+                if client.auto and time.monotonic() - client.switch_ts >= self.__AUTO_UP_INTERVAL:
+                    self.__switch_variant(client, -1)  # Долго не было перегрузки, пробуем вариант получше
 
     async def __streamer(self, src: _Source) -> None:
         logger = get_logger(0)
         while True:
             if len(src.clients) == 0:
-                await asyncio.sleep(1)
+                await src.notifier.wait()
                 continue
             try:
                 async with src.streamer.reading() as read_frame:
                     while len(src.clients) > 0:
-                        frame = await read_frame(src.key_required)
-                        if frame["key"]:
-                            src.key_required = False
-                        for client in src.clients.values():
-                            try:
-                                client.queue.put_nowait(frame)
-                            except asyncio.QueueFull:
-                                # Если какой-то из клиентов не справляется, очищаем ему очередь и запрашиваем кейфрейм.
-                                # Я вижу у такой логики кучу минусов, хз как себя покажет, но лучше пока ничего не придумал.
-                                tools.clear_queue(client.queue)
-                                src.key_required = True
-                            except Exception:
-                                pass
+                        frame = await read_frame(src.gop.is_key_required())
+                        # Сообщение собирается один раз, клиенты получают один и тот же объект
+                        packet = MediaFrame(
+                            key=frame["key"],
+                            msg=make_ws_bin(1, frame["key"].to_bytes(), frame["data"]),
+                            grab_ts=frame["grab_ts"],
+                            recv_ts=frame["recv_ts"],
+                        )
+                        if src.is_diff():
+                            src.gop.push(packet)
+                        self.__broadcast(src, packet)
             except StreamerError as ex:
                 if isinstance(ex, StreamerPermError):
                     logger.exception("Streamer failed: %s", src.streamer)
@@ -198,4 +275,38 @@ class MediaServer(HttpServer):
                     logger.error("Streamer error: %s: %s", src.streamer, tools.efmt(ex))
             except Exception:
                 get_logger(0).exception("Unexpected streamer error: %s", src.streamer)
-            await asyncio.sleep(1)
+            src.gop.reset()
+            if len(src.clients) > 0:
+                await asyncio.sleep(1)  # Streamer error, don't restart it too often
+
+    def __broadcast(self, src: _Source, packet: MediaFrame) -> None:
+        slow: list[_Client] = []
+        for client in src.clients.values():
+            try:
+                client.queue.put_nowait(packet)
+            except asyncio.QueueFull:
+                # Клиент не справляется: чистим только его очередь, и он сам ждет следующий кейфрейм.
+                # Энкодер просим о кейфрейме с ограничением частоты, остальные клиенты не страдают.
+                tools.clear_queue(client.queue)
+                if src.is_diff():
+                    client.key_wait = True
+                    src.gop.request_key()
+                client.queue.put_nowait(packet)
+                if client.auto:
+                    slow.append(client)
+            except Exception:
+                pass
+        for client in slow:
+            self.__switch_variant(client, 1)
+
+    def __switch_variant(self, client: _Client, step: int) -> None:
+        # JPEG-кадры независимы, поэтому клиент просто переезжает на соседний источник вместе с очередью
+        client.switch_ts = time.monotonic()
+        index = self.__jpeg_ladder.index(client.src) + step
+        if 0 <= index < len(self.__jpeg_ladder):
+            dst = self.__jpeg_ladder[index]
+            del client.src.clients[client.ws]
+            dst.clients[client.ws] = client
+            dst.notifier.notify()
+            client.src = dst
+            get_logger(0).info("Switched %s to the JPEG variant %r", client.ws, (dst.variant or "original"))
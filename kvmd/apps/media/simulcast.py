@@ -0,0 +1,99 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import io
+import asyncio
+import contextlib
+import dataclasses
+import concurrent.futures
+
+from typing import Callable
+from typing import Awaitable
+from typing import AsyncGenerator
+
+from PIL import Image as PilImage
+
+from ...clients.streamer import StreamerFormats
+from ...clients.streamer import BaseStreamerClient
+
+
+# =====
+@dataclasses.dataclass(frozen=True)
+class SimulcastVariant:
+    name:       str
+    max_width:  int
+    max_height: int
+    quality:    int
+
+    @classmethod
+    def from_string(cls, variant: str) -> "SimulcastVariant":
+        # Строка уже провалидирована valid_stream_simulcast_variant()
+        (resolution, quality) = variant.split(":")
+        (width, height) = resolution.split("x")
+        return SimulcastVariant(variant, int(width), int(height), int(quality))
+
+
+def encode_variant(data: bytes, variant: SimulcastVariant) -> tuple[bytes, int, int]:
+    with io.BytesIO(data) as bio:
+        with PilImage.open(bio) as image:
+            # Декодер JPEG сразу уменьшает картинку в 2/4/8 раз, остальное делает ресемплинг
+            image.draft("RGB", (variant.max_width, variant.max_height))
+            image.thumbnail((variant.max_width, variant.max_height), PilImage.Resampling.BILINEAR)
+            with io.BytesIO() as out_bio:
+                image.save(out_bio, format="jpeg", quality=variant.quality)
+                return (out_bio.getvalue(), *image.size)
+
+
+class SimulcastStreamerClient(BaseStreamerClient):
+    # Уменьшенная копия JPEG-стрима. Читает исходный стример как еще один подписчик,
+    # поэтому кодирование идет, только пока этот вариант кто-то смотрит.
+    # Если пул не успевает, лишние кадры отбрасывает очередь подписчика исходного стримера.
+
+    def __init__(
+        self,
+        streamer: BaseStreamerClient,
+        variant: SimulcastVariant,
+        executor: concurrent.futures.Executor,
+    ) -> None:
+
+        assert streamer.get_format() == StreamerFormats.JPEG
+        self.__streamer = streamer
+        self.__variant = variant
+        self.__executor = executor
+
+    def get_format(self) -> int:
+        return StreamerFormats.JPEG
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        loop = asyncio.get_running_loop()
+        async with self.__streamer.reading() as read_frame:
+
+            async def read_variant_frame(key_required: bool) -> dict:
+                frame = await read_frame(key_required)
+                (data, width, height) = await loop.run_in_executor(self.__executor, encode_variant, frame["data"], self.__variant)
+                return {**frame, "data": data, "width": width, "height": height}
+
+            yield read_variant_frame
+
+    def __str__(self) -> str:
+        return f"SimulcastStreamerClient({self.__streamer}, {self.__variant.name})"
@@ -60,6 +60,8 @@ def main(argv: (list[str] | None)=None) -> None:
         host=config.server.host,
         port=config.server.port,
         max_clients=config.server.max_clients,
+        processes=config.server.processes,
+        metrics_path=config.server.metrics,
 
         no_delay=config.server.no_delay,
 
@@ -74,6 +76,16 @@ def main(argv: (list[str] | None)=None) -> None:
         scroll_rate=config.scroll_rate,
         allow_cut_after=config.allow_cut_after,
 
+        workers=config.workers,
+
+        tiles_enabled=config.tiles.enabled,
+        tiles_size=config.tiles.size,
+
+        congestion_enabled=config.congestion.enabled,
+        congestion_min_fps=config.congestion.min_fps,
+        congestion_min_quality=config.congestion.min_quality,
+        congestion_high_water=config.congestion.high_water,
+
         kvmd=KvmdClient(user_agent=user_agent, **config.kvmd._unpack()),
         streamers=streamers,
         vnc_auth_manager=VncAuthManager(**config.auth.vncauth._unpack()),
@@ -0,0 +1,91 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import time
+
+
+# =====
+class CongestionController:  # pylint: disable=too-many-instance-attributes
+    # Подстраивает fps и качество под конкретного клиента, не трогая общие параметры стримера.
+    # Перегрузка определяется по размеру буфера сокета и по времени drain() после отправки кадра.
+    # При перегрузке fps делится пополам, а уровень деградации растет; после секунды без
+    # перегрузки все возвращается обратно по шагу.
+
+    __MAX_LEVEL = 4
+    __QUALITY_STEP = 15
+    __DEGRADE_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_fps: int,
+        min_fps: int,
+        min_quality: int,
+        high_water: int,
+    ) -> None:
+
+        self.__enabled = enabled
+        self.__max_fps = max(max_fps, 1)
+        self.__min_fps = max(min(min_fps, self.__max_fps), 1)
+        self.__min_quality = min_quality
+        self.__high_water = high_water
+
+        self.__fps = self.__max_fps
+        self.__level = 0
+        self.__good = 0
+        self.__degraded_ts = 0.0
+        self.__sent_ts = 0.0
+
+    def get_delay(self) -> float:
+        if self.__fps >= self.__max_fps:
+            return 0.0
+        return max(self.__sent_ts + 1 / self.__fps - time.monotonic(), 0.0)
+
+    def get_jpeg_params(self, quality: int) -> tuple[int, float]:
+        if self.__level == 0:
+            return (quality, 1.0)
+        quality = max(quality - self.__level * self.__QUALITY_STEP, min(quality, self.__min_quality))
+        scale = (0.5 if self.__level >= self.__MAX_LEVEL else 1.0)
+        return (quality, scale)
+
+    def get_state(self) -> tuple[int, int]:
+        return (self.__fps, self.__level)
+
+    def update(self, buffer_size: int, drain_time: float) -> bool:
+        if not self.__enabled:
+            return False
+        now = time.monotonic()
+        self.__sent_ts = now
+        prev = self.get_state()
+        if buffer_size > self.__high_water or drain_time > 1 / self.__fps:
+            self.__good = 0
+            if now - self.__degraded_ts >= self.__DEGRADE_INTERVAL:
+                self.__degraded_ts = now
+                self.__fps = max(self.__fps // 2, self.__min_fps)
+                self.__level = min(self.__level + 1, self.__MAX_LEVEL)
+        else:
+            self.__good += 1
+            if self.__good >= self.__fps:  # About a second without congestion
+                self.__good = 0
+                self.__fps = min(self.__fps + max(self.__max_fps // 10, 1), self.__max_fps)
+                self.__level = max(self.__level - 1, 0)
+        return (self.get_state() != prev)
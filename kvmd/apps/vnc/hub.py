@@ -0,0 +1,96 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import asyncio
+import contextlib
+
+from typing import Callable
+from typing import Awaitable
+from typing import AsyncGenerator
+
+from ...logging import get_logger
+
+from ...clients.streamer import StreamerError
+from ...clients.streamer import StreamerTempError
+from ...clients.streamer import StreamerFormats
+from ...clients.streamer import BaseStreamerClient
+from ...clients.streamer import StreamerSubscriber
+
+from ... import tools
+
+
+# =====
+class StreamerHub(BaseStreamerClient):
+    # Один читатель на стример, кадры раздаются всем подписанным клиентам
+
+    __Q_SIZE = 16
+
+    def __init__(self, streamer: BaseStreamerClient) -> None:
+        self.__streamer = streamer
+        self.__subs: set[StreamerSubscriber] = set()
+        self.__reader_task: (asyncio.Task | None) = None
+
+    def get_format(self) -> int:
+        return self.__streamer.get_format()
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        sub = StreamerSubscriber(StreamerFormats.is_diff(self.get_format()), self.__Q_SIZE)
+        self.__subs.add(sub)
+        try:
+            if self.__reader_task is None:
+                self.__reader_task = asyncio.create_task(self.__reader_task_loop())
+            yield sub.read_frame
+        finally:
+            self.__subs.discard(sub)
+
+    async def __reader_task_loop(self) -> None:
+        logger = get_logger(0)
+        while True:
+            logger.info("%s: Starting shared reader for %d clients ...", self, len(self.__subs))
+            try:
+                async with self.__streamer.reading() as read_frame:
+                    while self.__subs:
+                        frame = await read_frame(any(sub.is_key_required() for sub in self.__subs))
+                        for sub in list(self.__subs):
+                            sub.put_frame(frame)
+            except StreamerError as ex:
+                self.__put_error(ex)
+                await asyncio.sleep(1)
+            except Exception as ex:
+                logger.exception("%s: Unexpected streamer error", self)
+                self.__put_error(StreamerTempError(tools.efmt(ex)))
+                await asyncio.sleep(1)
+
+            if not self.__subs:
+                # Проверка и сброс без await между ними, чтобы новый подписчик не потерялся
+                logger.info("%s: No more clients, shared reader is stopped", self)
+                self.__reader_task = None
+                return
+
+    def __put_error(self, ex: StreamerError) -> None:
+        # Клиенты сами решают, что делать с ошибкой: переподключиться или сменить стример
+        for sub in list(self.__subs):
+            sub.put_error(ex)
+
+    def __str__(self) -> str:
+        return f"StreamerHub({self.__streamer})"
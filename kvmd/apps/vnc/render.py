@@ -25,6 +25,8 @@ import os
 import io
 import functools
 
+import numpy
+
 from PIL import Image as PilImage
 from PIL import ImageDraw as PilImageDraw
 from PIL import ImageFont as PilImageFont
@@ -53,3 +55,33 @@ def _get_font() -> PilImageFont.FreeTypeFont:
     assert module_path is not None
     path = os.path.join(os.path.dirname(module_path), "fonts", "Azbuka04.ttf")
     return PilImageFont.truetype(path, size=20)
+
+
+# =====
+def decode_jpeg(data: bytes) -> numpy.ndarray:
+    with io.BytesIO(data) as bio:
+        with PilImage.open(bio) as image:
+            return numpy.asarray(image.convert("RGB"))
+
+
+def encode_jpeg(pixels: numpy.ndarray, quality: int) -> bytes:
+    image = PilImage.fromarray(pixels)
+    with io.BytesIO() as bio:
+        image.save(bio, format="jpeg", quality=quality)
+        return bio.getvalue()
+
+
+def reencode_jpeg(data: bytes, quality: int, scale: float) -> bytes:
+    with io.BytesIO(data) as bio:
+        with PilImage.open(bio) as image:
+            size = image.size
+            if scale < 1:
+                # Декодирование сразу в уменьшенном виде (DCT), потом растягиваем обратно,
+                # чтобы не менять размер фреймбуфера у клиента. Мелкие детали уходят, JPEG худеет.
+                image.draft("RGB", (int(size[0] * scale), int(size[1] * scale)))
+            result = image.convert("RGB")
+            if result.size != size:
+                result = result.resize(size, PilImage.Resampling.BILINEAR)
+            with io.BytesIO() as out_bio:
+                result.save(out_bio, format="jpeg", quality=quality)
+                return out_bio.getvalue()
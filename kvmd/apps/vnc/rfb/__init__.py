@@ -28,6 +28,8 @@ from typing import Callable
 from typing import Coroutine
 from typing import AsyncGenerator
 
+import numpy
+
 from ....logging import get_logger
 
 from .... import tools
@@ -41,6 +43,13 @@ from .errors import RfbConnectionError
 from .encodings import RfbEncodings
 from .encodings import RfbClientEncodings
 
+from .pixels import RfbPixelFormat
+from .pixels import RfbBasePixelsEncoder
+from .pixels import RfbRawEncoder
+from .pixels import RfbZrleEncoder
+from .pixels import RfbTightEncoder
+from .pixels import make_tight_jpeg_header
+
 from .crypto import rfb_make_challenge
 from .crypto import rfb_encrypt_challenge
 
@@ -53,6 +62,8 @@ class RfbClient(RfbClientStream):  # pylint: disable=too-many-instance-attribute
     # https://www.toptal.com/java/implementing-remote-framebuffer-server-java
     # https://github.com/TigerVNC/tigervnc
 
+    __ZLIB_LEVEL = 1  # Pixels are encoded on the fly, CPU is more important than the ratio
+
     def __init__(  # pylint: disable=too-many-arguments
         self,
         reader: asyncio.StreamReader,
@@ -90,10 +101,17 @@ class RfbClient(RfbClientStream):  # pylint: disable=too-many-instance-attribute
 
         self.__rfb_version = 0
         self._encodings = RfbClientEncodings(frozenset())
+        self.__pixel_format = RfbPixelFormat(
+            bpp=32, depth=24, big_endian=False, true_color=True,
+            red_max=255, green_max=255, blue_max=255,
+            red_shift=16, green_shift=8, blue_shift=0,
+        )
+        self.__pixels_encoders: dict[int, RfbBasePixelsEncoder] = {}
 
         self.__fb_notifier = aiotools.AioNotifier()
         self.__fb_cont_updates = False
         self.__fb_reset_h264 = False
+        self.__fb_full_requested = True
 
         self.__allow_cut_since_ts = 0.0
 
@@ -178,31 +196,96 @@ class RfbClient(RfbClientStream):  # pylint: disable=too-many-instance-attribute
     async def _send_fb_allow_again(self) -> None:
         self.__fb_notifier.notify()
 
+    def _is_fb_full_requested(self) -> bool:
+        return self.__fb_full_requested
+
+    def _is_fb_jpeg_supported(self) -> bool:
+        # JpegCompression may only be used when the client has advertized
+        # a quality level using the JPEG Quality Level Pseudo-encoding
+        # and when bits-per-pixel is either 16 or 32
+        return (
+            self._encodings.has_tight
+            and self._encodings.tight_jpeg_quality > 0
+            and self.__pixel_format.bpp in [16, 32]
+        )
+
     async def _send_fb_jpeg(self, data: bytes) -> None:
         assert self._encodings.has_tight
         assert self._encodings.tight_jpeg_quality > 0
         assert len(data) <= 4194303, len(data)
         async with self.__lock:
             await self._write_fb_update("JPEG FBUR", self._width, self._height, RfbEncodings.TIGHT, drain=False)
-            length = len(data)
-            if length <= 127:
-                length_bytes = bytes([0b10011111, length & 0x7F])
-            elif length <= 16383:
-                length_bytes = bytes([0b10011111, length & 0x7F | 0x80, length >> 7 & 0x7F])
-            else:
-                length_bytes = bytes([0b10011111, length & 0x7F | 0x80, length >> 7 & 0x7F | 0x80, length >> 14 & 0xFF])
-            await self._write_struct("JPEG length + data", "", length_bytes, data)
+            await self._write_struct("JPEG length + data", "", make_tight_jpeg_header(len(data)), data)
+            self.__fb_reset_h264 = True
+            self.__fb_full_requested = False
+            if self.__fb_cont_updates:
+                self.__fb_notifier.notify()
+
+    async def _send_fb_jpeg_rects(self, rects: list[tuple[int, int, int, int, bytes]]) -> None:
+        # Incremental update: only changed parts of the screen, each one as a separate JPEG
+        assert self._encodings.has_tight
+        assert self._encodings.tight_jpeg_quality > 0
+        assert 0 < len(rects) <= 0xFFFF, len(rects)
+        async with self.__lock:
+            await self._write_fb_update_header("JPEG rects FBUR", len(rects), drain=False)
+            for (index, (x, y, width, height, data)) in enumerate(rects):
+                assert len(data) <= 4194303, len(data)
+                await self._write_fb_rect("JPEG rect", x, y, width, height, RfbEncodings.TIGHT, drain=False)
+                await self._write_struct(
+                    "JPEG rect length + data", "",
+                    make_tight_jpeg_header(len(data)), data,
+                    drain=(index == len(rects) - 1),
+                )
             self.__fb_reset_h264 = True
             if self.__fb_cont_updates:
                 self.__fb_notifier.notify()
 
-    async def _send_fb_h264(self, data: bytes) -> None:
+    def _encode_fb_pixels(
+        self,
+        rgb: numpy.ndarray,
+        rects: list[tuple[int, int, int, int]],
+    ) -> tuple[int, list[tuple[int, int, int, int, bytes]]]:
+
+        # Fallback for the clients without Tight JPEG and H.264.
+        # This is CPU-bound and may be called from the executor, but only from one task at a time:
+        # ZRLE and Tight encoders keep persistent zlib streams.
+        if self._encodings.has_zrle:
+            encoding = RfbEncodings.ZRLE
+        elif self._encodings.has_tight:
+            encoding = RfbEncodings.TIGHT
+        else:
+            encoding = RfbEncodings.RAW
+        encoder = self.__pixels_encoders.get(encoding)
+        if encoder is None:
+            encoder = self.__pixels_encoders[encoding] = {
+                RfbEncodings.ZRLE: lambda: RfbZrleEncoder(self.__ZLIB_LEVEL),
+                RfbEncodings.TIGHT: lambda: RfbTightEncoder(self.__ZLIB_LEVEL),
+                RfbEncodings.RAW: RfbRawEncoder,
+            }[encoding]()
+        return (encoding, encoder.encode(self.__pixel_format, rgb, rects))
+
+    async def _send_fb_pixels(self, encoding: int, rects: list[tuple[int, int, int, int, bytes]], full: bool) -> None:
+        assert 0 < len(rects) <= 0xFFFF, len(rects)
+        async with self.__lock:
+            await self._write_fb_update_header("pixels FBUR", len(rects), drain=False)
+            for (index, (x, y, width, height, data)) in enumerate(rects):
+                await self._write_fb_rect("pixels rect", x, y, width, height, encoding, drain=False)
+                await self._write_struct("pixels rect data", "", data, drain=(index == len(rects) - 1))
+            self.__fb_reset_h264 = True
+            if full:
+                self.__fb_full_requested = False
+            if self.__fb_cont_updates:
+                self.__fb_notifier.notify()
+
+    async def _send_fb_h264(self, parts: list[bytes]) -> None:
+        # Aggregated access units are sent as a list to avoid copying them into a single buffer
         assert self._encodings.has_h264
-        assert len(data) <= 0xFFFFFFFF, len(data)
+        length = sum(map(len, parts))
+        assert length <= 0xFFFFFFFF, length
         async with self.__lock:
             await self._write_fb_update("H264 FBUR", self._width, self._height, RfbEncodings.H264, drain=False)
-            await self._write_struct("H264 length + flags", "LL", len(data), int(self.__fb_reset_h264), drain=False)
-            await self._write_struct("H264 data", "", data)
+            await self._write_struct("H264 length + flags", "LL", length, int(self.__fb_reset_h264), drain=False)
+            await self._write_parts("H264 data", parts)
             self.__fb_reset_h264 = False
             if self.__fb_cont_updates:
                 self.__fb_notifier.notify()
@@ -441,10 +524,11 @@ class RfbClient(RfbClientStream):  # pylint: disable=too-many-instance-attribute
                 raise RfbError(f"Unknown message type: {msg_type}")
 
     async def __handle_set_pixel_format(self) -> None:
-        # JpegCompression may only be used when bits-per-pixel is either 16 or 32
-        bits_per_pixel = (await self._read_struct("pixel format", "xxx BB?? HHH BBB xxx"))[0]
-        if bits_per_pixel not in [16, 32]:
-            raise RfbError(f"Requested unsupported bits_per_pixel={bits_per_pixel} for Tight JPEG; required 16 or 32")
+        (bpp, depth, big_endian, true_color, *colors) = await self._read_struct("pixel format", "xxx BB?? HHH BBB xxx")
+        fmt = RfbPixelFormat(bpp, depth, bool(big_endian), bool(true_color), *colors)
+        get_logger(0).info("%s [main]: Using pixel format %s", self._remote, fmt)
+        self.__pixel_format = fmt
+        self.__fb_full_requested = True
 
     async def __handle_set_encodings(self) -> None:
         logger = get_logger(0)
@@ -474,17 +558,16 @@ class RfbClient(RfbClientStream):  # pylint: disable=too-many-instance-attribute
 
     async def __handle_fb_update_request(self) -> None:
         self.__check_encodings()
-        await self._read_struct("FBUR", "? HH HH")  # Ignore any arguments, just perform the full update
+        incremental = (await self._read_struct("FBUR", "? HH HH"))[0]  # Ignore the area, just perform the full update
+        if not incremental:
+            self.__fb_full_requested = True
         if not self.__fb_cont_updates:
             self.__fb_notifier.notify()
 
     def __check_encodings(self) -> None:
-        # JpegCompression may only be used when the client has advertized
-        # a quality level using the JPEG Quality Level Pseudo-encoding
+        # Raw is always supported, so any client can be served
         if len(self._encodings.encodings) == 0:
             raise RfbError("The client did not send SetEncodings")
-        if not self._encodings.has_tight or self._encodings.tight_jpeg_quality == 0:
-            raise RfbError("Tight JPEG encoding is not supported by client")
 
     async def __handle_key_event(self) -> None:
         (state, code) = await self._read_struct("key event", "? xx L")
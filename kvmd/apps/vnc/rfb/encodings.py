@@ -34,6 +34,9 @@ class RfbEncodings:
     EXT_MOUSE = -316  # ExtendedMouseButtons Pseudo-encoding
     CONT_UPDATES = -313  # ContinuousUpdates Pseudo-encoding
 
+    RAW = 0
+    ZRLE = 16
+
     TIGHT = 7
     TIGHT_JPEG_QUALITIES = dict(zip(  # JPEG Quality Level Pseudo-encoding
         [-32, -31, -30, -29, -28, -27, -26, -25, -24, -23],
@@ -58,6 +61,8 @@ class RfbClientEncodings:  # pylint: disable=too-many-instance-attributes
     has_ext_mouse: bool     = dataclasses.field(default=False, metadata=_make_meta(RfbEncodings.EXT_MOUSE))  # noqa: E224
     has_cont_updates: bool  = dataclasses.field(default=False, metadata=_make_meta(RfbEncodings.CONT_UPDATES))  # noqa: E224
 
+    has_zrle: bool          = dataclasses.field(default=False, metadata=_make_meta(RfbEncodings.ZRLE))  # noqa: E224
+
     has_tight: bool         = dataclasses.field(default=False, metadata=_make_meta(RfbEncodings.TIGHT))  # noqa: E224
     tight_jpeg_quality: int = dataclasses.field(default=0,     metadata=_make_meta(frozenset(RfbEncodings.TIGHT_JPEG_QUALITIES)))  # noqa: E224
 
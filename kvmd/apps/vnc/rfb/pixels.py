@@ -0,0 +1,209 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import dataclasses
+import zlib
+
+import numpy
+
+from .errors import RfbError
+
+
+# =====
+@dataclasses.dataclass(frozen=True)
+class RfbPixelFormat:  # pylint: disable=too-many-instance-attributes
+    bpp: int
+    depth: int
+    big_endian: bool
+    true_color: bool
+    red_max: int
+    green_max: int
+    blue_max: int
+    red_shift: int
+    green_shift: int
+    blue_shift: int
+
+    def __post_init__(self) -> None:
+        if self.bpp not in [8, 16, 32]:
+            raise RfbError(f"Requested unsupported bits_per_pixel={self.bpp}; required 8, 16 or 32")
+        if not self.true_color:
+            raise RfbError("Requested unsupported color map pixel format; required true color")
+
+    def make_pixels(self, rgb: numpy.ndarray) -> numpy.ndarray:
+        # RGB888 (HxWx3) -> PIXEL bytes (HxWxN) in the client format
+        values = numpy.zeros(rgb.shape[:2], dtype=numpy.uint32)
+        for (index, (cmax, shift)) in enumerate([
+            (self.red_max, self.red_shift),
+            (self.green_max, self.green_shift),
+            (self.blue_max, self.blue_shift),
+        ]):
+            channel = rgb[..., index].astype(numpy.uint32)
+            if cmax != 255:
+                channel = (channel * cmax + 127) // 255
+            values |= channel << shift
+        dtype = numpy.dtype(f"{'>' if self.big_endian else '<'}u{self.bpp // 8}")
+        return values.astype(dtype).view(numpy.uint8).reshape(*rgb.shape[:2], self.bpp // 8)
+
+    def make_cpixels(self, rgb: numpy.ndarray) -> numpy.ndarray:
+        # ZRLE: 32bpp pixel is sent as 3 bytes if all colors fit in LS or MS 3 bytes
+        pixels = self.make_pixels(rgb)
+        if self.bpp == 32 and self.depth <= 24:
+            if self.__fits_bits(24):
+                return (pixels[..., 1:] if self.big_endian else pixels[..., :3])
+            if self.__fits_bits(32, 8):
+                return (pixels[..., :3] if self.big_endian else pixels[..., 1:])
+        return pixels
+
+    def make_tpixels(self, rgb: numpy.ndarray) -> numpy.ndarray:
+        # Tight: 32bpp depth 24 pixel with 8-bit channels is sent as RGB
+        if (
+            self.bpp == 32 and self.depth == 24
+            and self.red_max == self.green_max == self.blue_max == 255
+        ):
+            return rgb
+        return self.make_pixels(rgb)
+
+    def __fits_bits(self, high: int, low: int=0) -> bool:
+        return all(
+            shift >= low and shift + cmax.bit_length() <= high
+            for (cmax, shift) in [
+                (self.red_max, self.red_shift),
+                (self.green_max, self.green_shift),
+                (self.blue_max, self.blue_shift),
+            ]
+        )
+
+
+def make_tight_length(length: int) -> bytes:
+    # Compact representation: 1-3 bytes, 7 bits per byte
+    if length <= 127:
+        return bytes([length & 0x7F])
+    elif length <= 16383:
+        return bytes([length & 0x7F | 0x80, length >> 7 & 0x7F])
+    return bytes([length & 0x7F | 0x80, length >> 7 & 0x7F | 0x80, length >> 14 & 0xFF])
+
+
+def make_tight_jpeg_header(length: int) -> bytes:
+    # JPEG compression control byte without the reset bits: zlib stream 0 is persistent
+    # and shared with the basic compression of RfbTightEncoder, so it must not be reset.
+    return bytes([0b10010000]) + make_tight_length(length)
+
+
+def _is_solid(pixels: numpy.ndarray) -> bool:
+    return bool((pixels == pixels[0, 0]).all())
+
+
+# =====
+class RfbBasePixelsEncoder:
+    def encode(
+        self,
+        fmt: RfbPixelFormat,
+        rgb: numpy.ndarray,
+        rects: list[tuple[int, int, int, int]],
+    ) -> list[tuple[int, int, int, int, bytes]]:
+
+        raise NotImplementedError
+
+
+class RfbRawEncoder(RfbBasePixelsEncoder):
+    def encode(
+        self,
+        fmt: RfbPixelFormat,
+        rgb: numpy.ndarray,
+        rects: list[tuple[int, int, int, int]],
+    ) -> list[tuple[int, int, int, int, bytes]]:
+
+        return [
+            (x, y, width, height, fmt.make_pixels(rgb[y:y + height, x:x + width]).tobytes())
+            for (x, y, width, height) in rects
+        ]
+
+
+class RfbZrleEncoder(RfbBasePixelsEncoder):
+    # https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst#zrle-encoding
+    # Only Raw and Solid subencodings, zlib does the rest. The stream is shared by the whole connection.
+
+    __TILE = 64
+
+    def __init__(self, zlib_level: int) -> None:
+        self.__zobj = zlib.compressobj(zlib_level)
+
+    def encode(
+        self,
+        fmt: RfbPixelFormat,
+        rgb: numpy.ndarray,
+        rects: list[tuple[int, int, int, int]],
+    ) -> list[tuple[int, int, int, int, bytes]]:
+
+        result: list[tuple[int, int, int, int, bytes]] = []
+        for (x, y, width, height) in rects:
+            cpixels = fmt.make_cpixels(rgb[y:y + height, x:x + width])
+            tiles: list[bytes] = []
+            for ty in range(0, height, self.__TILE):
+                for tx in range(0, width, self.__TILE):
+                    tile = cpixels[ty:ty + self.__TILE, tx:tx + self.__TILE]
+                    if _is_solid(tile):
+                        tiles.append(b"\x01" + tile[0, 0].tobytes())
+                    else:
+                        tiles.append(b"\x00" + tile.tobytes())
+            data = self.__zobj.compress(b"".join(tiles)) + self.__zobj.flush(zlib.Z_SYNC_FLUSH)
+            result.append((x, y, width, height, len(data).to_bytes(4, "big") + data))
+        return result
+
+
+class RfbTightEncoder(RfbBasePixelsEncoder):
+    # https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst#tight-encoding
+    # Basic compression without filters using zlib stream 0 and Fill compression for solid rects.
+
+    __MAX_WIDTH = 2048
+    __MAX_SIZE = 65536
+    __MIN_TO_COMPRESS = 12
+
+    def __init__(self, zlib_level: int) -> None:
+        self.__zobj = zlib.compressobj(zlib_level)
+
+    def encode(
+        self,
+        fmt: RfbPixelFormat,
+        rgb: numpy.ndarray,
+        rects: list[tuple[int, int, int, int]],
+    ) -> list[tuple[int, int, int, int, bytes]]:
+
+        result: list[tuple[int, int, int, int, bytes]] = []
+        for (x, y, width, height) in rects:
+            for sx in range(x, x + width, self.__MAX_WIDTH):
+                sub_width = min(self.__MAX_WIDTH, x + width - sx)
+                band = max(self.__MAX_SIZE // sub_width, 1)
+                for sy in range(y, y + height, band):
+                    sub_height = min(band, y + height - sy)
+                    tpixels = fmt.make_tpixels(rgb[sy:sy + sub_height, sx:sx + sub_width])
+                    result.append((sx, sy, sub_width, sub_height, self.__encode_tpixels(tpixels)))
+        return result
+
+    def __encode_tpixels(self, tpixels: numpy.ndarray) -> bytes:
+        if _is_solid(tpixels):
+            return b"\x80" + tpixels[0, 0].tobytes()  # Fill compression
+        data = tpixels.tobytes()
+        if len(data) < self.__MIN_TO_COMPRESS:
+            return b"\x00" + data
+        data = self.__zobj.compress(data) + self.__zobj.flush(zlib.Z_SYNC_FLUSH)
+        return b"\x00" + make_tight_length(len(data)) + data  # Basic compression, stream 0, no filter
@@ -23,6 +23,7 @@
 import asyncio
 import ssl
 import struct
+import time
 
 from .... import aiotools
 
@@ -41,6 +42,8 @@ class RfbClientStream:
 
         self._remote = rfb_format_remote(writer)
 
+        self.__drain_time = 0.0
+
     # =====
 
     async def _read_number(self, msg: str, fmt: str) -> int:
@@ -70,6 +73,19 @@ class RfbClientStream:
 
     # =====
 
+    def _get_write_buffer_size(self) -> int:
+        return self.__writer.transport.get_write_buffer_size()
+
+    def _pop_drain_time(self) -> float:
+        # Time spent waiting for the socket since the last call, without the encoding work
+        (drain_time, self.__drain_time) = (self.__drain_time, 0.0)
+        return drain_time
+
+    async def __drain(self) -> None:
+        begin_ts = time.monotonic()
+        await self.__writer.drain()
+        self.__drain_time += time.monotonic() - begin_ts
+
     async def _write_struct(self, msg: str, fmt: str, *values: (int | bytes), drain: bool=True) -> None:
         try:
             if not fmt:
@@ -83,7 +99,16 @@ class RfbClientStream:
             else:
                 self.__writer.write(struct.pack(f">{fmt}", *values))
             if drain:
-                await self.__writer.drain()
+                await self.__drain()
+        except ConnectionError as ex:
+            raise RfbConnectionError(f"Can't write {msg}", ex)
+
+    async def _write_parts(self, msg: str, parts: list[bytes], drain: bool=True) -> None:
+        # Buffers are passed to the transport as is, without joining them here
+        try:
+            self.__writer.writelines(parts)
+            if drain:
+                await self.__drain()
         except ConnectionError as ex:
             raise RfbConnectionError(f"Can't write {msg}", ex)
 
@@ -93,7 +118,7 @@ class RfbClientStream:
         try:
             self.__writer.write(encoded)
             if drain:
-                await self.__writer.drain()
+                await self.__drain()
         except ConnectionError as ex:
             raise RfbConnectionError(f"Can't write {msg}", ex)
 
@@ -107,6 +132,12 @@ class RfbClientStream:
             drain=drain,
         )
 
+    async def _write_fb_update_header(self, msg: str, rects: int, drain: bool=True) -> None:
+        await self._write_struct(msg, "BxH", 0, rects, drain=drain)  # FB update, number of rects
+
+    async def _write_fb_rect(self, msg: str, x: int, y: int, width: int, height: int, encoding: int, drain: bool=True) -> None:
+        await self._write_struct(msg, "HH HH l", x, y, width, height, encoding, drain=drain)
+
     # =====
 
     async def _start_tls(self, ssl_context: ssl.SSLContext, ssl_timeout: float) -> None:
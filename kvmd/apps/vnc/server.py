@@ -22,9 +22,13 @@
 
 import os
 import asyncio
+import time
 import socket
-import dataclasses
 import contextlib
+import multiprocessing
+import concurrent.futures
+
+from typing import Callable
 
 import aiohttp
 
@@ -47,8 +51,11 @@ from ...clients.streamer import BaseStreamerClient
 
 from ... import tools
 from ... import aiotools
+from ... import aioproc
 from ... import network
 
+from ...metrics import FrameLatency
+
 from .rfb import RfbClient
 from .rfb.stream import rfb_format_remote
 from .rfb.errors import RfbError
@@ -57,14 +64,73 @@ from .vncauth import VncAuthKvmdCredentials
 from .vncauth import VncAuthManager
 
 from .render import make_text_jpeg
+from .render import reencode_jpeg
+
+from .hub import StreamerHub
+from .tiles import FbDiffer
+from .tiles import JpegTilesEncoder
+from .congestion import CongestionController
 
 
 # =====
-@dataclasses.dataclass()
 class _SharedParams:
-    width: int = dataclasses.field(default=800)
-    height: int = dataclasses.field(default=600)
-    name: str = dataclasses.field(default="PiKVM")
+    # Общие для всех клиентов и всех воркеров параметры, лежат в разделяемой памяти.
+    # Создаются до форка, поэтому новые клиенты в любом процессе видят последние значения.
+
+    __NAME_SIZE = 256
+
+    def __init__(self) -> None:
+        self.__lock = multiprocessing.Lock()
+        self.__width = multiprocessing.RawValue("i", 800)
+        self.__height = multiprocessing.RawValue("i", 600)
+        self.__name = multiprocessing.RawArray("c", self.__NAME_SIZE)
+        self.set_name("PiKVM")
+
+    def get(self) -> dict:
+        with self.__lock:
+            return {
+                "width": self.__width.value,
+                "height": self.__height.value,
+                "name": self.__name.value.decode("utf-8", errors="ignore"),
+            }
+
+    def set_size(self, width: int, height: int) -> None:
+        with self.__lock:
+            self.__width.value = width
+            self.__height.value = height
+
+    def set_name(self, name: str) -> None:
+        with self.__lock:
+            self.__name.value = name.encode("utf-8")[:self.__NAME_SIZE - 1]
+
+
+class _WorkersStats:
+    # Каждый воркер пишет только в свою ячейку, поэтому без блокировок
+    def __init__(self, count: int) -> None:
+        self.__clients = multiprocessing.RawArray("i", count)
+        self.__connections = multiprocessing.RawArray("q", count)
+        size = FrameLatency.get_size()
+        latency = multiprocessing.RawArray("d", count * size)
+        self.__latencies = [FrameLatency(latency, worker * size) for worker in range(count)]
+
+    def on_connected(self, worker: int) -> None:
+        self.__clients[worker] += 1
+        self.__connections[worker] += 1
+
+    def on_disconnected(self, worker: int) -> None:
+        self.__clients[worker] -= 1
+
+    def get_clients(self) -> int:
+        return sum(self.__clients)
+
+    def get_latency(self, worker: int) -> FrameLatency:
+        return self.__latencies[worker]
+
+    def get(self) -> list[dict]:
+        return [
+            {"clients": clients, "connections": connections}
+            for (clients, connections) in zip(self.__clients, self.__connections)
+        ]
 
 
 class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
@@ -86,6 +152,11 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
 
         kvmd: KvmdClient,
         streamers: list[BaseStreamerClient],
+        executor: concurrent.futures.Executor,
+        tiles: (JpegTilesEncoder | None),
+        differ: FbDiffer,
+        congestion: CongestionController,
+        latency: FrameLatency,
 
         vnc_credentials: dict[str, VncAuthKvmdCredentials],
         vencrypt: bool,
@@ -107,7 +178,7 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
             vnc_passwds=list(vnc_credentials),
             vencrypt=vencrypt,
             none_auth_only=none_auth_only,
-            **dataclasses.asdict(shared_params),
+            **shared_params.get(),
         )
 
         self.__desired_fps = desired_fps
@@ -117,6 +188,11 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
 
         self.__kvmd = kvmd
         self.__streamers = streamers
+        self.__executor = executor
+        self.__tiles = tiles
+        self.__differ = differ
+        self.__congestion = congestion
+        self.__latency = latency
 
         self.__shared_params = shared_params
 
@@ -169,7 +245,8 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
             logger.info("%s [kvmd]: Applying HID params: mouse_output=%s ...", self._remote, self.__mouse_output)
             await self.__kvmd_session.hid.set_params(mouse_output=self.__mouse_output)
 
-            async with self.__kvmd_session.ws() as self.__kvmd_ws:
+            move_interval = (1 / self.__desired_fps if self.__desired_fps > 0 else 0.0)  # Не чаще одного движения на кадр
+            async with self.__kvmd_session.ws(move_interval, topics=["info", "hid"]) as self.__kvmd_ws:
                 logger.info("%s [kvmd]: Connected to KVMD websocket", self._remote)
                 self.__stage3_ws_connected.set_passed()
                 async for (event_type, event) in self.__kvmd_ws.communicate():
@@ -190,7 +267,7 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
                         name = f"PiKVM: {host}"
                         if self._encodings.has_rename:
                             await self._send_rename(name)
-                        self.__shared_params.name = name
+                        self.__shared_params.set_name(name)
 
         elif event_type == "hid":
             if (
@@ -229,13 +306,14 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
                 await asyncio.sleep(1)
 
     def __get_preferred_streamer(self) -> BaseStreamerClient:
+        # JPEG is always acceptable: without Tight JPEG it will be converted to the pixels
         formats = {
-            StreamerFormats.JPEG: "has_tight",
-            StreamerFormats.H264: "has_h264",
+            StreamerFormats.JPEG: True,
+            StreamerFormats.H264: self._encodings.has_h264,
         }
         streamer: (BaseStreamerClient | None) = None
         for streamer in self.__streamers:
-            if getattr(self._encodings, formats[streamer.get_format()]):
+            if formats[streamer.get_format()]:
                 get_logger(0).info("%s [streamer]: Using preferred %s", self._remote, streamer)
                 return streamer
         raise RuntimeError("No streamers found")
@@ -254,67 +332,120 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
 
     async def __make_text_frame(self, text: str) -> dict:
         return {
-            "data": (await make_text_jpeg(self._width, self._height, self._encodings.tight_jpeg_quality, text)),
+            "data": (await make_text_jpeg(self._width, self._height, (self._encodings.tight_jpeg_quality or 80), text)),
             "width": self._width,
             "height": self._height,
             "format": StreamerFormats.JPEG,
         }
 
-    async def __fb_sender_task_loop(self) -> None:  # pylint: disable=too-many-branches
+    async def __fb_sender_task_loop(self) -> None:
         last: (dict | None) = None
         async for _ in self._send_fb_allowed():
-            while True:
-                frame = await self.__fb_queue.get()
-                if (
-                    last is None  # pylint: disable=too-many-boolean-expressions
-                    or frame["format"] == StreamerFormats.JPEG
-                    or last["format"] != frame["format"]
-                    or (frame["format"] == StreamerFormats.H264 and (
-                        frame["key"]
-                        or last["width"] != frame["width"]
-                        or last["height"] != frame["height"]
-                        or len(last["data"]) + len(frame["data"]) > 4194304
-                    ))
-                ):
-                    self.__fb_has_key = (frame["format"] == StreamerFormats.H264 and frame["key"])
-                    last = frame
-                    if self.__fb_queue.qsize() == 0:
-                        break
-                    continue
-                assert frame["format"] == StreamerFormats.H264
-                last["data"] += frame["data"]
-                if self.__fb_queue.qsize() == 0:
-                    break
+            delay = self.__congestion.get_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)  # Frames are merged or replaced in the queue meanwhile
+            (last, parts, newest, dequeue_ts) = await self.__get_fb_parts(last)
 
             if self._width != last["width"] or self._height != last["height"]:
-                self.__shared_params.width = last["width"]
-                self.__shared_params.height = last["height"]
+                self.__shared_params.set_size(last["width"], last["height"])
                 if not self._encodings.has_resize:
                     msg = (
                         f"Resoultion changed: {self._width}x{self._height}"
                         f" -> {last['width']}x{last['height']}\nPlease reconnect"
                     )
-                    await self._send_fb_jpeg((await self.__make_text_frame(msg))["data"])
+                    await self.__send_fb_jpeg((await self.__make_text_frame(msg))["data"])
                     continue
                 await self._send_resize(last["width"], last["height"])
 
-            if len(last["data"]) == 0:
+            if not any(parts):
                 # Вдруг какой-то баг
                 await self._send_fb_allow_again()
                 continue
 
+            self._pop_drain_time()
+            start_ts = time.monotonic()
             if last["format"] == StreamerFormats.JPEG:
-                await self._send_fb_jpeg(last["data"])
+                assert len(parts) == 1
+                await self.__send_fb_jpeg(parts[0])
             elif last["format"] == StreamerFormats.H264:
                 if not self._encodings.has_h264:
                     raise RfbError("The client doesn't want to accept H264 anymore")
                 if self.__fb_has_key:
-                    await self._send_fb_h264(last["data"])
+                    await self._send_fb_h264(parts)
                 else:
                     await self._send_fb_allow_again()
             else:
                 raise RuntimeError(f"Unknown format: {last['format']}")
-            last["data"] = b""
+            self.__on_fb_sent(newest, dequeue_ts, start_ts)
+
+    async def __get_fb_parts(self, last: (dict | None)) -> tuple[dict, list[bytes], dict, float]:
+        # Забирает из очереди все накопившиеся кадры. JPEG заменяет предыдущие,
+        # а H264 склеивается до ключевого кадра, смены разрешения или 4 MiB.
+        # Кадры не джойнятся, а отдаются списком и пишутся по одному.
+        parts: list[bytes] = []
+        parts_size = 0
+        while True:
+            frame = await self.__fb_queue.get()
+            dequeue_ts = time.monotonic()
+            if (
+                last is None  # pylint: disable=too-many-boolean-expressions
+                or frame["format"] == StreamerFormats.JPEG
+                or last["format"] != frame["format"]
+                or (frame["format"] == StreamerFormats.H264 and (
+                    frame["key"]
+                    or last["width"] != frame["width"]
+                    or last["height"] != frame["height"]
+                    or parts_size + len(frame["data"]) > 4194304
+                ))
+            ):
+                self.__fb_has_key = (frame["format"] == StreamerFormats.H264 and frame["key"])
+                last = frame
+                parts = [frame["data"]]
+                parts_size = len(frame["data"])
+            else:
+                assert frame["format"] == StreamerFormats.H264
+                parts.append(frame["data"])
+                parts_size += len(frame["data"])
+            if self.__fb_queue.qsize() == 0:
+                return (last, parts, frame, dequeue_ts)
+
+    def __on_fb_sent(self, newest: dict, dequeue_ts: float, start_ts: float) -> None:
+        if "recv_ts" in newest:  # Not a text frame
+            self.__latency.observe(newest["grab_ts"], newest["recv_ts"], dequeue_ts, start_ts, time.monotonic())
+        if self.__congestion.update(self._get_write_buffer_size(), self._pop_drain_time()):
+            (fps, level) = self.__congestion.get_state()
+            get_logger(0).info("%s [fb_sender]: Congestion control: fps=%d, level=%d", self._remote, fps, level)
+
+    async def __send_fb_jpeg(self, data: bytes) -> None:
+        if not self._is_fb_jpeg_supported():
+            await self.__send_fb_pixels(data)
+            return
+        (quality, scale) = self.__congestion.get_jpeg_params(self._encodings.tight_jpeg_quality)
+        if self.__tiles:
+            rects = await self.__tiles.encode(data, quality, self._is_fb_full_requested())
+            if rects is not None:
+                if rects:
+                    await self._send_fb_jpeg_rects(rects)
+                else:
+                    await self._send_fb_allow_again()  # Nothing changed, wait for the next frame
+                return
+        if quality < self._encodings.tight_jpeg_quality or scale < 1:
+            # Only for this client, the global streamer params are not affected
+            data = await asyncio.get_running_loop().run_in_executor(self.__executor, reencode_jpeg, data, quality, scale)
+        await self._send_fb_jpeg(data)
+
+    async def __send_fb_pixels(self, data: bytes) -> None:
+        (rgb, rects) = await self.__differ.diff(data, self._is_fb_full_requested())
+        full = (rects is None)
+        if rects is None:
+            (height, width) = rgb.shape[:2]
+            rects = [(0, 0, width, height)]
+        elif not rects:
+            await self._send_fb_allow_again()  # Nothing changed, wait for the next frame
+            return
+        loop = asyncio.get_running_loop()
+        (encoding, encoded) = await loop.run_in_executor(self.__executor, self._encode_fb_pixels, rgb, rects)
+        await self._send_fb_pixels(encoding, encoded, full)
 
     # =====
 
@@ -418,7 +549,7 @@ class _Client(RfbClient):  # pylint: disable=too-many-instance-attributes
         self.__stage2_encodings_accepted.set_passed(multi=True)
 
         has_quality = (await self.__kvmd_session.streamer.get_state())["features"]["quality"]
-        quality = (self._encodings.tight_jpeg_quality if has_quality else None)
+        quality = ((self._encodings.tight_jpeg_quality or None) if has_quality else None)
         get_logger(0).info("%s [main]: Applying streamer params: jpeg_quality=%s; desired_fps=%d ...",
                            self._remote, quality, self.__desired_fps)
         await self.__kvmd_session.streamer.set_params(quality, self.__desired_fps)
@@ -431,6 +562,8 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
         host: str,
         port: int,
         max_clients: int,
+        processes: int,
+        metrics_path: str,
 
         no_delay: bool,
         keepalive_enabled: bool,
@@ -451,6 +584,16 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
         scroll_rate: int,
         allow_cut_after: float,
 
+        workers: int,
+
+        tiles_enabled: bool,
+        tiles_size: int,
+
+        congestion_enabled: bool,
+        congestion_min_fps: int,
+        congestion_min_quality: int,
+        congestion_high_water: int,
+
         kvmd: KvmdClient,
         streamers: list[BaseStreamerClient],
         vnc_auth_manager: VncAuthManager,
@@ -459,6 +602,8 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
         self.__host = network.get_listen_host(host)
         self.__port = port
         self.__max_clients = max_clients
+        self.__processes = processes
+        self.__metrics_path = metrics_path
 
         keymap_name = os.path.basename(keymap_path)
         symmap = build_symmap(keymap_path)
@@ -466,6 +611,15 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
         self.__vnc_auth_manager = vnc_auth_manager
 
         shared_params = _SharedParams()
+        self.__stats = _WorkersStats(processes)
+        self.__worker = 0
+
+        # Все клиенты читают один и тот же стример через общий хаб,
+        # чтобы не плодить читателей мемсинка и HTTP-стримы на каждое подключение.
+        hubs: list[BaseStreamerClient] = [StreamerHub(streamer) for streamer in streamers]
+
+        # Перекодирование картинки для клиентов делается в отдельном пуле, не в дефолтном
+        executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="vnc-worker")
 
         async def cleanup_client(writer: asyncio.StreamWriter) -> None:
             if (await aiotools.close_writer(writer)):
@@ -475,7 +629,15 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
             logger = get_logger(0)
             remote = rfb_format_remote(writer)
             logger.info("%s [entry]: Connected client", remote)
+            worker = self.__worker
+            self.__stats.on_connected(worker)
             try:
+                # Лимит общий на все воркеры: бэклог у каждого сокета SO_REUSEPORT свой,
+                # а счетчики клиентов лежат в разделяемой памяти.
+                if self.__stats.get_clients() > self.__max_clients:
+                    logger.error("%s [entry]: Too many clients, max_clients=%d", remote, self.__max_clients)
+                    return
+
                 sock = writer.get_extra_info("socket")
                 if no_delay:
                     sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -510,7 +672,18 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
                     scroll_rate=scroll_rate,
                     allow_cut_after=allow_cut_after,
                     kvmd=kvmd,
-                    streamers=streamers,
+                    streamers=hubs,
+                    executor=executor,
+                    tiles=(JpegTilesEncoder(tiles_size, executor) if tiles_enabled else None),
+                    differ=FbDiffer(tiles_size, executor),
+                    congestion=CongestionController(
+                        enabled=congestion_enabled,
+                        max_fps=desired_fps,
+                        min_fps=congestion_min_fps,
+                        min_quality=congestion_min_quality,
+                        high_water=congestion_high_water,
+                    ),
+                    latency=self.__stats.get_latency(worker),
                     vnc_credentials=(await self.__vnc_auth_manager.read_credentials())[0],
                     none_auth_only=none_auth_only,
                     vencrypt=vencrypt_enabled,
@@ -519,6 +692,7 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
             except Exception:
                 logger.exception("%s [entry]: Unhandled exception in client task", remote)
             finally:
+                self.__stats.on_disconnected(worker)
                 await aiotools.shield_fg(cleanup_client(writer))
 
         self.__handle_client = handle_client
@@ -533,6 +707,9 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
             if family == socket.AF_INET6:
                 sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.__processes > 1:
+                # Ядро само раскидывает новые подключения между воркерами
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             sock.bind(addr)
 
             server = await asyncio.start_server(
@@ -544,5 +721,84 @@ class VncServer:  # pylint: disable=too-many-instance-attributes
                 await server.serve_forever()
 
     def run(self) -> None:
-        aiotools.run(self.__inner_run())
+        if self.__processes > 1:
+            # Хаб стримера общий только внутри процесса, поэтому каждый воркер держит
+            # своего читателя мемсинка (или свой HTTP-стрим): N воркеров - N читателей.
+            # Это цена за изоляцию воркеров, метрики по ним пишутся в server.metrics
+            # и отдаются через /api/export/prometheus/metrics.
+            # Процессы стартуют до создания event loop, он не должен попасть в форки.
+            # Именно fork: воркеры наследуют замыкания и разделяемую память, а дефолтный метод
+            # может быть другим (например, spawn, если нас самих запустили через spawn).
+            ctx = multiprocessing.get_context("fork")
+            procs: list[multiprocessing.process.BaseProcess] = [
+                ctx.Process(target=self.__worker_run, args=(worker,), daemon=True)
+                for worker in range(self.__processes)
+            ]
+            for proc in procs:
+                proc.start()
+            aiotools.run(self.__supervise(procs))
+        elif self.__metrics_path:
+            aiotools.run(self.__single_run())
+        else:
+            aiotools.run(self.__inner_run())
         get_logger().info("Bye-bye")
+
+    def __worker_run(self, worker: int) -> None:
+        aioproc.settle(f"VNC worker {worker}", f"vnc-{worker}")
+        self.__worker = worker
+        aiotools.run(self.__inner_run())
+
+    async def __single_run(self) -> None:
+        await asyncio.gather(
+            self.__inner_run(),
+            self.__stats_loop([str(os.getpid())], (lambda: True)),
+        )
+
+    async def __supervise(self, procs: list[multiprocessing.process.BaseProcess]) -> None:
+        logger = get_logger(0)
+        logger.info("Started %d VNC workers", len(procs))
+        try:
+            await self.__stats_loop(
+                pids=[str(proc.pid) for proc in procs],
+                is_alive=(lambda: all(proc.is_alive() for proc in procs)),
+            )
+            logger.error("One of VNC workers is dead, stopping all of them ...")
+        finally:
+            for proc in procs:
+                if proc.is_alive():
+                    proc.terminate()
+            for proc in procs:
+                await aiotools.run_async(proc.join, 3)
+
+    async def __stats_loop(self, pids: list[str], is_alive: Callable[[], bool]) -> None:
+        prev: list[dict] = []
+        while is_alive():
+            stats = [
+                {**worker_stats, "frames": self.__stats.get_latency(worker).get_histogram("send_complete").get_count()}
+                for (worker, worker_stats) in enumerate(self.__stats.get())
+            ]
+            if stats != prev:
+                if self.__metrics_path:
+                    await aiotools.run_async(self.__write_metrics, pids, stats)
+                prev = stats
+            await asyncio.sleep(1)
+
+    def __write_metrics(self, pids: list[str], stats: list[dict]) -> None:
+        # Prometheus text format, suitable for the node_exporter textfile collector
+        rows: list[str] = []
+        for (key, kind, help_text) in [
+            ("clients", "gauge", "Number of connected VNC clients"),
+            ("connections", "counter", "Total number of accepted VNC connections"),
+        ]:
+            name = f"kvmd_vnc_{key}{'_total' if kind == 'counter' else ''}"
+            rows.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+            for (worker, (pid, worker_stats)) in enumerate(zip(pids, stats)):
+                rows.append(f"{name}{{worker=\"{worker}\",pid=\"{pid}\"}} {worker_stats[key]}")
+        rows.extend(FrameLatency.make_rows("kvmd_vnc_frame", [
+            ({"worker": str(worker), "pid": pid}, self.__stats.get_latency(worker))
+            for (worker, pid) in enumerate(pids)
+        ]))
+        tmp_path = f"{self.__metrics_path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write("\n".join(rows) + "\n")
+        os.rename(tmp_path, self.__metrics_path)
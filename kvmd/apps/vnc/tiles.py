@@ -0,0 +1,98 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import asyncio
+import concurrent.futures
+
+import numpy
+
+from .render import decode_jpeg
+from .render import encode_jpeg
+
+
+# =====
+def find_dirty_rects(prev: numpy.ndarray, cur: numpy.ndarray, size: int) -> list[tuple[int, int, int, int]]:
+    assert prev.shape == cur.shape, (prev.shape, cur.shape)
+    (height, width) = cur.shape[:2]
+    rows = -(-height // size)
+    cols = -(-width // size)
+
+    changed = numpy.zeros((rows * size, cols * size), dtype=bool)
+    numpy.not_equal(prev, cur).any(axis=2, out=changed[:height, :width])
+    dirty = numpy.any(changed.reshape(rows, size, cols, size), axis=(1, 3))
+
+    # Соседние тайлы в строке склеиваем в один прямоугольник, меньше заголовков и JPEG-ов
+    rects: list[tuple[int, int, int, int]] = []
+    for row in range(rows):
+        col = 0
+        while col < cols:
+            if dirty[row, col]:
+                begin = col
+                while col < cols and dirty[row, col]:
+                    col += 1
+                (x, y) = (begin * size, row * size)
+                rects.append((x, y, min(col * size, width) - x, min(y + size, height) - y))
+            else:
+                col += 1
+    return rects
+
+
+class FbDiffer:
+    def __init__(self, size: int, executor: concurrent.futures.Executor) -> None:
+        self.__size = size
+        self.__executor = executor
+        self.__prev: (numpy.ndarray | None) = None
+
+    async def diff(self, data: bytes, full: bool) -> tuple[numpy.ndarray, (list[tuple[int, int, int, int]] | None)]:
+        # Декодированный кадр и изменившиеся прямоугольники; None - нужно обновить весь экран
+        loop = asyncio.get_running_loop()
+        cur = await loop.run_in_executor(self.__executor, decode_jpeg, data)
+        (prev, self.__prev) = (self.__prev, cur)
+        if full or prev is None or prev.shape != cur.shape:
+            return (cur, None)
+        return (cur, (await loop.run_in_executor(self.__executor, find_dirty_rects, prev, cur, self.__size)))
+
+
+class JpegTilesEncoder:
+    # Если поменялась большая часть экрана, дешевле отправить исходный кадр целиком
+    __MAX_DIRTY_AREA = 0.5
+
+    def __init__(self, size: int, executor: concurrent.futures.Executor) -> None:
+        self.__executor = executor
+        self.__differ = FbDiffer(size, executor)
+
+    async def encode(self, data: bytes, quality: int, full: bool) -> (list[tuple[int, int, int, int, bytes]] | None):
+        # None означает, что нужно отправить исходный JPEG как есть
+        (cur, rects) = await self.__differ.diff(data, full)
+        if rects is None:
+            return None
+
+        (height, width) = cur.shape[:2]
+        if sum(rect[2] * rect[3] for rect in rects) > width * height * self.__MAX_DIRTY_AREA:
+            return None
+
+        loop = asyncio.get_running_loop()
+        tiles = await asyncio.gather(*[
+            loop.run_in_executor(self.__executor, encode_jpeg, cur[y:y + h, x:x + w], quality)
+            for (x, y, w, h) in rects
+        ])
+        return [(*rect, tile) for (rect, tile) in zip(rects, tiles)]
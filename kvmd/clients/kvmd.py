@@ -23,6 +23,7 @@
 import asyncio
 import contextlib
 import struct
+import time
 
 from typing import Callable
 from typing import AsyncGenerator
@@ -131,12 +132,23 @@ class _AtxApiPart(_BaseApiPart):
 
 
 # =====
-class KvmdClientWs:
-    def __init__(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+class KvmdClientWs:  # pylint: disable=too-many-instance-attributes
+    # Pointer events are coalesced: at most one move per move_interval,
+    # consecutive wheel or relative deltas are batched into a single multi-delta message.
+    # The batches are flushed in the order of arrival, keys and buttons flush them too.
+
+    __MAX_DELTAS = 64
+
+    def __init__(self, ws: aiohttp.ClientWebSocketResponse, move_interval: float) -> None:
         self.__ws = ws
+        self.__move_interval = move_interval
         self.__writer_queue: "asyncio.Queue[tuple[str, dict] | bytes]" = asyncio.Queue()
         self.__communicated = False
 
+        self.__pending: list[tuple[int, list[tuple[int, int]]]] = []  # (op, [move] or deltas)
+        self.__flush_handle: (asyncio.TimerHandle | None) = None
+        self.__flushed_ts = 0.0
+
     async def communicate(self) -> AsyncGenerator[tuple[str, dict], None]:  # pylint: disable=too-many-branches
         assert not self.__communicated
         self.__communicated = True
@@ -175,6 +187,9 @@ class KvmdClientWs:
                 recv_task.cancel()
             if writer_task:
                 writer_task.cancel()
+            if self.__flush_handle:
+                self.__flush_handle.cancel()
+                self.__flush_handle = None
             try:
                 await aiotools.shield_fg(self.__ws.close())
             except Exception:
@@ -183,21 +198,61 @@ class KvmdClientWs:
                 self.__communicated = False
 
     async def send_key_event(self, key: str, state: bool) -> None:
+        self.__flush_pointer()
         mask = (0b01 if state else 0)
         await self.__writer_queue.put(bytes([1, mask]) + key.encode("ascii"))
 
     async def send_mouse_button_event(self, button: str, state: bool) -> None:
+        self.__flush_pointer()
         mask = (0b01 if state else 0)
         await self.__writer_queue.put(bytes([2, mask]) + button.encode("ascii"))
 
     async def send_mouse_move_event(self, to_x: int, to_y: int) -> None:
-        await self.__writer_queue.put(struct.pack(">bhh", 3, to_x, to_y))
+        if self.__pending and self.__pending[-1][0] == 3:
+            self.__pending[-1][1][0] = (to_x, to_y)
+        else:
+            self.__pending.append((3, [(to_x, to_y)]))
+        self.__schedule_pointer()
 
     async def send_mouse_relative_event(self, delta_x: int, delta_y: int) -> None:
-        await self.__writer_queue.put(struct.pack(">bbbb", 4, 0, delta_x, delta_y))
+        self.__append_delta(4, delta_x, delta_y)
 
     async def send_mouse_wheel_event(self, delta_x: int, delta_y: int) -> None:
-        await self.__writer_queue.put(struct.pack(">bbbb", 5, 0, delta_x, delta_y))
+        self.__append_delta(5, delta_x, delta_y)
+
+    def __append_delta(self, op: int, delta_x: int, delta_y: int) -> None:
+        if not self.__pending or self.__pending[-1][0] != op:
+            self.__pending.append((op, []))
+        deltas = self.__pending[-1][1]
+        deltas.append((delta_x, delta_y))
+        if len(deltas) >= self.__MAX_DELTAS:
+            self.__flush_pointer()
+        else:
+            self.__schedule_pointer()
+
+    def __schedule_pointer(self) -> None:
+        if self.__flush_handle is None:
+            delay = self.__flushed_ts + self.__move_interval - time.monotonic()
+            if delay <= 0:
+                self.__flush_pointer()
+            else:
+                self.__flush_handle = asyncio.get_running_loop().call_later(delay, self.__flush_pointer)
+
+    def __flush_pointer(self) -> None:
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+        if self.__pending:
+            for (op, items) in self.__pending:
+                if op == 3:
+                    self.__writer_queue.put_nowait(struct.pack(">bhh", op, *items[0]))
+                else:
+                    self.__writer_queue.put_nowait(bytes([op, 0]) + b"".join(
+                        struct.pack(">bb", *delta)
+                        for delta in items
+                    ))
+            self.__pending = []
+            self.__flushed_ts = time.monotonic()
 
 
 class KvmdClientSession(BaseHttpClientSession):
@@ -209,10 +264,13 @@ class KvmdClientSession(BaseHttpClientSession):
         self.atx = _AtxApiPart(self._ensure_http_session)
 
     @contextlib.asynccontextmanager
-    async def ws(self) -> AsyncGenerator[KvmdClientWs, None]:
+    async def ws(self, move_interval: float=0.0, topics: (list[str] | None)=None) -> AsyncGenerator[KvmdClientWs, None]:
         session = self._ensure_http_session()
-        async with session.ws_connect("/ws", params={"legacy": "0"}) as ws:
-            yield KvmdClientWs(ws)
+        params = {"legacy": "0"}
+        if topics is not None:
+            params["topics"] = ",".join(topics)
+        async with session.ws_connect("/ws", params=params) as ws:
+            yield KvmdClientWs(ws, move_interval)
 
 
 class KvmdClient(BaseHttpClient):
@@ -21,10 +21,14 @@
 
 
 import io
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
 import contextlib
 import dataclasses
 import functools
-import types
 
 from typing import Callable
 from typing import Awaitable
@@ -37,7 +41,6 @@ import ustreamer
 from PIL import Image as PilImage
 
 from .. import tools
-from .. import aiotools
 from .. import htclient
 
 from . import BaseHttpClient
@@ -74,12 +77,105 @@ class BaseStreamerClient:
 
     @contextlib.asynccontextmanager
     async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        # Кроме картинки кадр содержит монотонные таймстемпы для замера задержек:
+        #   - grab_ts: время захвата в ustreamer (0, если стример его не сообщил);
+        #   - recv_ts: время получения кадра клиентом стримера.
         if self is not None:  # XXX: Vulture and pylint hack
             raise NotImplementedError()
         yield
 
 
+class StreamerSubscriber:
+    # Очередь кадров одного потребителя общего читателя стрима.
+    # Фреймы общие для всех подписчиков, менять их нельзя.
+
+    def __init__(self, diff: bool, queue_size: int) -> None:
+        self.__diff = diff
+        self.__queue: "asyncio.Queue[dict | StreamerError]" = asyncio.Queue(queue_size)
+        self.__key_wait = diff  # Новый клиент начинает с кейфрейма
+        self.__key_requested = False
+
+    def is_key_required(self) -> bool:
+        return (self.__key_wait or self.__key_requested)
+
+    def put_frame(self, frame: dict) -> None:
+        if self.__diff:
+            if self.__key_wait:
+                if not frame["key"]:
+                    return  # P-фреймы без кейфрейма бесполезны
+                self.__key_wait = False
+        try:
+            self.__queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Клиент не успевает. Для H264 дропаем ему все до следующего кейфрейма,
+            # для JPEG просто выкидываем самый старый кадр. Остальных это не касается.
+            if self.__diff:
+                tools.clear_queue(self.__queue)
+                if frame["key"]:
+                    self.__queue.put_nowait(frame)
+                else:
+                    self.__key_wait = True
+            else:
+                self.__queue.get_nowait()
+                self.__queue.put_nowait(frame)
+
+    def put_error(self, ex: StreamerError) -> None:
+        tools.clear_queue(self.__queue)
+        self.__queue.put_nowait(ex)
+
+    async def read_frame(self, key_required: bool) -> dict:
+        self.__key_requested = (self.__diff and key_required)
+        item = await self.__queue.get()
+        if isinstance(item, StreamerError):
+            raise item
+        return item
+
+
 # =====
+class _StreamerPreviews:
+    # Превью одного снапшота в разных размерах. Одинаковые запросы, пришедшие одновременно,
+    # ждут одну и ту же задачу; готовые превью вытесняются по суммарному размеру (LRU).
+
+    __MAX_BYTES = 1024 * 1024
+
+    def __init__(self) -> None:
+        self.__previews: collections.OrderedDict[tuple[int, int, int], bytes] = collections.OrderedDict()
+        self.__size = 0
+        self.__tasks: dict[tuple[int, int, int], asyncio.Future] = {}
+
+    async def get(
+        self,
+        key: tuple[int, int, int],
+        make: Callable[[], bytes],
+        executor: concurrent.futures.Executor,
+    ) -> bytes:
+
+        data = self.__previews.get(key)
+        if data is not None:
+            self.__previews.move_to_end(key)
+            return data
+        task = self.__tasks.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().run_in_executor(executor, make)
+            task.add_done_callback(functools.partial(self.__on_done, key))
+            self.__tasks[key] = task
+        # Отмена одного из ждущих не должна отменять задачу для остальных
+        return (await asyncio.shield(task))
+
+    def __on_done(self, key: tuple[int, int, int], task: asyncio.Future) -> None:
+        self.__tasks.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        data: bytes = task.result()
+        if len(data) > self.__MAX_BYTES:
+            return
+        self.__previews[key] = data
+        self.__size += len(data)
+        while self.__size > self.__MAX_BYTES:
+            (_, evicted) = self.__previews.popitem(last=False)
+            self.__size -= len(evicted)
+
+
 @dataclasses.dataclass(frozen=True)
 class StreamerSnapshot:
     online: bool
@@ -88,7 +184,21 @@ class StreamerSnapshot:
     headers: tuple[tuple[str, str], ...]
     data: bytes
 
-    async def make_preview(self, max_width: int, max_height: int, quality: int) -> bytes:
+    __previews: _StreamerPreviews = dataclasses.field(
+        default_factory=_StreamerPreviews,
+        init=False,
+        repr=False,
+        compare=False,
+    )
+
+    async def make_preview(
+        self,
+        max_width: int,
+        max_height: int,
+        quality: int,
+        executor: concurrent.futures.Executor,
+    ) -> bytes:
+
         assert max_width >= 0
         assert max_height >= 0
         assert quality > 0
@@ -102,13 +212,18 @@ class StreamerSnapshot:
 
         if (max_width, max_height) == (self.width, self.height):
             return self.data
-        return (await aiotools.run_async(self.__inner_make_preview, max_width, max_height, quality))
+        return (await self.__previews.get(
+            key=(max_width, max_height, quality),
+            make=functools.partial(self.__inner_make_preview, max_width, max_height, quality),
+            executor=executor,
+        ))
 
-    @functools.lru_cache(maxsize=1)
     def __inner_make_preview(self, max_width: int, max_height: int, quality: int) -> bytes:
         with io.BytesIO(self.data) as snapshot_bio:
             with io.BytesIO() as preview_bio:
                 with PilImage.open(snapshot_bio) as image:
+                    # Декодер JPEG сразу уменьшает картинку в 2/4/8 раз, но не меньше запрошенного размера
+                    image.draft("RGB", (max_width, max_height))
                     image.thumbnail((max_width, max_height), PilImage.Resampling.LANCZOS)
                     image.save(preview_bio, format="jpeg", quality=quality)
                     return preview_bio.getvalue()
@@ -158,6 +273,38 @@ def _http_reading_handle_errors() -> Generator[None, None, None]:
         raise StreamerTempError(tools.efmt(ex))
 
 
+class _MjpegStreamReader:
+    # Разбирает multipart/x-mixed-replace от ustreamer без MultipartReader.
+    # Каждая часть содержит Content-Length, поэтому тело читается одним readexactly()
+    # прямо из буфера StreamReader, без поиска границы по картинке и лишних копий.
+    # На EOF вылетает IncompleteReadError, а не бесконечный цикл, как было с BodyPartReader:
+    #   - https://github.com/pikvm/pikvm/issues/92
+
+    def __init__(self, content: aiohttp.StreamReader, boundary: str) -> None:
+        self.__content = content
+        self.__boundary = b"--" + boundary.encode()
+
+    async def read_part(self) -> tuple[dict[str, str], bytes]:
+        while True:
+            line = await self.__content.readline()
+            if not line:
+                raise StreamerTempError("Reached EOF")
+            if line.rstrip() == self.__boundary:
+                break
+            # Остаток предыдущей части (CRLF после тела) или мусор до первой границы
+
+        headers: dict[str, str] = {}
+        for header in (await self.__content.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n"):
+            (key, sep, value) = header.partition(":")
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+
+        data = await self.__content.readexactly(int(headers["content-length"]))
+        if not data:
+            raise StreamerTempError("Empty frame")
+        return (headers, data)
+
+
 class HttpStreamerClient(BaseHttpClient, BaseStreamerClient):
     def __init__(
         self,
@@ -190,43 +337,30 @@ class HttpStreamerClient(BaseHttpClient, BaseStreamerClient):
                 ) as resp:
 
                     htclient.raise_not_200(resp)
-                    reader = aiohttp.MultipartReader.from_response(resp)
-                    self.__patch_stream_reader(reader.resp.content)
+                    boundary = aiohttp.helpers.parse_mimetype(resp.headers["Content-Type"]).parameters["boundary"]
+                    reader = _MjpegStreamReader(resp.content, boundary)
 
                     async def read_frame(key_required: bool) -> dict:
                         _ = key_required
                         with _http_reading_handle_errors():
-                            frame = await reader.next()  # pylint: disable=not-callable
-                            if not isinstance(frame, aiohttp.BodyPartReader):
-                                raise StreamerTempError("Expected body part")
-
-                            data = bytes(await frame.read())
-                            if not data:
-                                raise StreamerTempError("Reached EOF")
-
+                            (headers, data) = await reader.read_part()
+                            recv_ts = time.monotonic()
+                            # X-Timestamp - это время отправки по часам реального времени, а не захват.
+                            # Grab-Time идет по CLOCK_MONOTONIC, как и time.monotonic(), но на всякий случай
+                            # не верим значению из будущего, тогда задержка считается от получения.
+                            grab_ts = float(headers.get("x-ustreamer-grab-time", 0))
                             return {
-                                "online": (frame.headers["X-UStreamer-Online"] == "true"),
-                                "width": int(frame.headers["X-UStreamer-Width"]),
-                                "height": int(frame.headers["X-UStreamer-Height"]),
+                                "online": (headers["x-ustreamer-online"] == "true"),
+                                "width": int(headers["x-ustreamer-width"]),
+                                "height": int(headers["x-ustreamer-height"]),
                                 "data": data,
                                 "format": StreamerFormats.JPEG,
+                                "grab_ts": (grab_ts if grab_ts <= recv_ts else 0.0),
+                                "recv_ts": recv_ts,
                             }
 
                     yield read_frame
 
-    def __patch_stream_reader(self, reader: aiohttp.StreamReader) -> None:
-        # https://github.com/pikvm/pikvm/issues/92
-        # Infinite looping in BodyPartReader.read() because _at_eof flag.
-
-        orig_read = reader.read
-
-        async def read(self: aiohttp.StreamReader, n: int=-1) -> bytes:  # pylint: disable=invalid-name
-            if self.is_eof():
-                raise StreamerTempError("StreamReader.read(): Reached EOF")
-            return (await orig_read(n))
-
-        reader.read = types.MethodType(read, reader)  # type: ignore
-
     def __str__(self) -> str:
         return f"HttpStreamerClient({self.__name})"
 
@@ -244,7 +378,30 @@ def _memsink_reading_handle_errors() -> Generator[None, None, None]:
         raise StreamerPermError(tools.efmt(ex))
 
 
+class _MemsinkSubscriber(StreamerSubscriber):
+    def __init__(self, diff: bool, queue_size: int) -> None:
+        super().__init__(diff, queue_size)
+        self.__loop = asyncio.get_running_loop()
+
+    def put_frame_threadsafe(self, frame: dict) -> None:
+        self.__call_threadsafe(self.put_frame, frame)
+
+    def put_error_threadsafe(self, ex: StreamerError) -> None:
+        self.__call_threadsafe(self.put_error, ex)
+
+    def __call_threadsafe(self, method: Callable, arg: object) -> None:
+        try:
+            self.__loop.call_soon_threadsafe(method, arg)
+        except RuntimeError:
+            pass  # Loop is closed, the subscriber is gone
+
+
 class MemsinkStreamerClient(BaseStreamerClient):
+    # Один поток на мемсинк, ждет кадры и раздает их всем подписчикам через call_soon_threadsafe().
+    # Так кадр не стоит перехода в дефолтный экзекьютор, а его потоки не заняты ожиданием стрима.
+
+    __Q_SIZE = 8
+
     def __init__(
         self,
         name: str,
@@ -264,22 +421,52 @@ class MemsinkStreamerClient(BaseStreamerClient):
             "drop_same_frames": drop_same_frames,
         }
 
+        self.__lock = threading.Lock()
+        self.__subs: set[_MemsinkSubscriber] = set()
+        self.__thread: (threading.Thread | None) = None
+
     def get_format(self) -> int:
         return self.__fmt
 
     @contextlib.asynccontextmanager
     async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
-        with _memsink_reading_handle_errors():
-            with ustreamer.Memsink(**self.__kwargs) as sink:
-                async def read_frame(key_required: bool) -> dict:
-                    key_required = (key_required and self.__fmt == StreamerFormats.H264)
-                    with _memsink_reading_handle_errors():
-                        while True:
-                            frame = await aiotools.run_async(sink.wait_frame, key_required)
-                            if frame is not None:
-                                self.__check_format(frame["format"])
-                                return frame
-                yield read_frame
+        sub = _MemsinkSubscriber(StreamerFormats.is_diff(self.__fmt), self.__Q_SIZE)
+        with self.__lock:
+            self.__subs.add(sub)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__reader_thread, name=f"memsink-{self.__name}", daemon=True)
+                self.__thread.start()
+        try:
+            yield sub.read_frame
+        finally:
+            with self.__lock:
+                self.__subs.discard(sub)
+
+    def __reader_thread(self) -> None:
+        subs: list[_MemsinkSubscriber] = []
+        try:
+            with _memsink_reading_handle_errors():
+                with ustreamer.Memsink(**self.__kwargs) as sink:
+                    while True:
+                        with self.__lock:
+                            subs = list(self.__subs)
+                            if not subs:
+                                # Проверка и сброс под локом, чтобы новый подписчик не потерялся
+                                self.__thread = None
+                                return
+                        frame = sink.wait_frame(any(sub.is_key_required() for sub in subs))
+                        if frame is not None:
+                            self.__check_format(frame["format"])
+                            frame["recv_ts"] = time.monotonic()
+                            for sub in subs:
+                                sub.put_frame_threadsafe(frame)
+        except StreamerError as ex:
+            with self.__lock:
+                # Подписчики получат ошибку и сами решат, переподключаться ли
+                self.__thread = None
+                subs = list(self.__subs)
+            for sub in subs:
+                sub.put_error_threadsafe(ex)
 
     def __check_format(self, fmt: int) -> None:
         if fmt == StreamerFormats._MJPEG:  # pylint: disable=protected-access
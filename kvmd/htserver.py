@@ -24,34 +24,53 @@ import os
 import socket
 import struct
 import asyncio
+import collections
 import contextlib
 import dataclasses
 import inspect
+import functools
 import urllib.parse
 import json
+import time
 
 from typing import Callable
+from typing import Coroutine
 from typing import AsyncGenerator
 from typing import Any
 
 from aiohttp import ClientWebSocketResponse
+from aiohttp.abc import AbstractStreamWriter
 from aiohttp.web import BaseRequest
 from aiohttp.web import Request
 from aiohttp.web import Response
 from aiohttp.web import StreamResponse
 from aiohttp.web import WebSocketResponse
 from aiohttp.web import WSMsgType
+from aiohttp.web import HTTPException
 from aiohttp.web import Application
 from aiohttp.web import AccessLogger
 from aiohttp.web import run_app
 from aiohttp.web import normalize_path_middleware
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # type: ignore
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None  # type: ignore
+
 from .logging import get_logger
 
 from .errors import OperationError
 from .errors import IsBusyError
 
 from .validators import ValidatorError
+from .validators.basic import valid_bool
+
+from .metrics import HttpMetrics
 
 from . import aiotools
 
@@ -161,6 +180,51 @@ def _get_exposed_ws(obj: object) -> list[WsExposed]:
 
 
 # =====
+class _JsonResponse(Response):
+    # Формат выбирается при отправке, когда известен запрос: людям в браузере - читаемый JSON,
+    # автоматике - компактный. Явно можно попросить через ?pretty=0/1.
+
+    def __init__(self, obj: object, status: int) -> None:
+        super().__init__(status=status, content_type="application/json", charset="utf-8")
+        self.__obj = obj
+
+    async def prepare(self, request: BaseRequest) -> (AbstractStreamWriter | None):
+        if not self.prepared:
+            self.body = json_dumps(self.__obj, pretty=_is_pretty_json_wanted(request))
+        return (await super().prepare(request))
+
+
+def _is_pretty_json_wanted(req: BaseRequest) -> bool:
+    pretty = req.query.get("pretty")
+    if pretty is not None:
+        try:
+            return valid_bool(pretty)
+        except Exception:
+            pass
+    return ("text/html" in req.headers.get("Accept", ""))
+
+
+def _std_json_dumps(obj: object) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+# Компактный сериализатор выбирается один раз при импорте: orjson, если он установлен
+_json_dumps: Callable[[object], bytes]
+try:
+    import orjson
+    _json_dumps = functools.partial(orjson.dumps, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    _json_dumps = _std_json_dumps
+
+
+def json_dumps(obj: object, pretty: bool=False) -> bytes:
+    # Единая точка сериализации для HTTP, стримов и вебсокетов.
+    # Читаемый вывод всегда делает json, чтобы сохранить sort_keys и indent=4.
+    if pretty:
+        return json.dumps(obj, sort_keys=True, indent=4).encode("utf-8")
+    return _json_dumps(obj)
+
+
 def make_json_response(
     result: (dict | None)=None,
     status: int=200,
@@ -168,14 +232,10 @@ def make_json_response(
     wrap_result: bool=True,
 ) -> Response:
 
-    resp = Response(
-        text=json.dumps(({
-            "ok": (status == 200),
-            "result": (result or {}),
-        } if wrap_result else result), sort_keys=True, indent=4),
-        status=status,
-        content_type="application/json",
-    )
+    resp = _JsonResponse(({
+        "ok": (status == 200),
+        "result": (result or {}),
+    } if wrap_result else result), status)
     if set_cookies:
         for (key, value) in set_cookies.items():
             resp.set_cookie(key, value, httponly=True, samesite="Strict")
@@ -196,6 +256,14 @@ def make_json_exception(ex: Exception, status: (int | None)=None) -> Response:
     }, status=status)
 
 
+_REQ_STREAMING = "_streaming"
+
+
+def _mark_streaming(req: Request) -> None:
+    # Обертка ручки по этому флагу пишет длительность в метрику стримов, а не в задержки запросов
+    req[_REQ_STREAMING] = True
+
+
 async def start_streaming(
     req: Request,
     content_type: str,
@@ -210,15 +278,16 @@ async def start_streaming(
     if file_name:
         file_name = urllib.parse.quote(file_name, safe="")
         resp.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{file_name}"
+    _mark_streaming(req)
     await resp.prepare(req)
     return resp
 
 
 async def stream_json(resp: StreamResponse, result: dict, ok: bool=True) -> None:
-    await resp.write(json.dumps({
+    await resp.write(json_dumps({
         "ok": ok,
         "result": result,
-    }).encode("utf-8") + b"\r\n")
+    }) + b"\r\n")
 
 
 async def stream_json_exception(resp: StreamResponse, ex: Exception) -> None:
@@ -237,20 +306,46 @@ async def send_ws_event(
     event: (dict | None),
 ) -> None:
 
-    await wsr.send_str(json.dumps({
+    await wsr.send_frame(make_ws_event(event_type, event), WSMsgType.TEXT)
+
+
+def make_ws_event(event_type: str, event: (dict | None), encoding: str="json") -> bytes:
+    # Как и make_ws_bin(): событие для бродкаста сериализуется один раз для всех клиентов
+    obj = {
         "event_type": event_type,
         "event": event,
-    }))
+    }
+    if encoding == "msgpack":
+        return msgpack.packb(obj)
+    elif encoding == "cbor":
+        return cbor2.dumps(obj)
+    assert encoding == "json", encoding
+    return json_dumps(obj)
 
 
-async def send_ws_bin(
-    wsr: (ClientWebSocketResponse | WebSocketResponse),
-    op: int,
-    data: bytes,
-) -> None:
+def get_ws_encodings() -> list[str]:
+    # Бинарные кодировки доступны, только если установлены соответствующие модули
+    return [
+        "json",
+        *(["msgpack"] if msgpack is not None else []),
+        *(["cbor"] if cbor2 is not None else []),
+    ]
+
 
+def make_sse_event(msg: (bytes | None), event_id: str="") -> bytes:
+    # msg - однострочный JSON, так что хватает одного поля data.
+    # Без msg получается только отметка id, по которой клиент продолжит после переподключения.
+    return (
+        (f"id: {event_id}\n".encode() if event_id else b"")
+        + (b"data: " + msg + b"\n" if msg is not None else b"")
+        + b"\n"
+    )
+
+
+def make_ws_bin(op: int, *parts: bytes) -> bytes:
+    # Готовое бинарное сообщение можно один раз собрать и разослать многим клиентам
     assert 0 <= op <= 255
-    await wsr.send_bytes(op.to_bytes() + data)
+    return b"".join([op.to_bytes(), *parts])
 
 
 def parse_ws_event(msg: str) -> tuple[str, dict]:
@@ -310,10 +405,127 @@ def get_request_unix_credentials(req: BaseRequest) -> (RequestUnixCredentials |
 
 
 # =====
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass
+class _WsMessage:
+    event_type: str
+    msg:        (bytes | None)
+    get_state:  (Callable[[], Coroutine[Any, Any, (dict | None)]] | None)
+    sent:       (asyncio.Future | None) = None  # Только у бинарных сообщений
+
+
+class _WsSender:  # pylint: disable=too-many-instance-attributes
+    # Своя очередь и свой таск на каждого клиента: медленный клиент копит очередь у себя,
+    # а не тормозит бродкаст для остальных. Несколько неотправленных событий состояния
+    # одного типа схлопываются в одно полное состояние, полученное прямо перед отправкой.
+    # Generic dict-merge тут не годится: у подсистем разная гранулярность дельт,
+    # и слияние воскрешало бы удаленные элементы (например, образы MSD).
+    # Бинарные сообщения идут через ту же очередь, чтобы не обгонять события,
+    # но отправитель ждет их фактической отправки, как и раньше с send_bytes().
+
+    def __init__(self, wsr: WebSocketResponse, encoding: str, queue_size: int) -> None:
+        self.__wsr = wsr
+        self.__encoding = encoding
+        self.__queue_size = queue_size
+
+        # В бинарных кодировках событие - это BINARY-фрейм с мапой {event_type, event}.
+        # От бинарных сообщений make_ws_bin() он отличается первым байтом:
+        # заголовок мапы в msgpack и CBOR никогда не совпадает с кодами операций.
+        self.__opcode = (WSMsgType.TEXT if encoding == "json" else WSMsgType.BINARY)
+
+        self.__queue: collections.deque[_WsMessage] = collections.deque()
+        self.__states: dict[str, _WsMessage] = {}
+        self.__notifier = aiotools.AioCoalescingNotifier()
+        self.__task = asyncio.create_task(self.__sender())
+
+    def put(
+        self,
+        event_type: str,
+        msg: bytes,
+        get_state: (Callable[[], Coroutine[Any, Any, (dict | None)]] | None)=None,
+    ) -> bool:
+
+        if get_state is not None:
+            pending = self.__states.get(event_type)
+            if pending is not None:
+                pending.msg = None  # Latest wins
+                pending.get_state = get_state
+                return True
+        if len(self.__queue) >= self.__queue_size:
+            return False
+        item = _WsMessage(event_type, msg, get_state)
+        self.__queue.append(item)
+        if get_state is not None:
+            self.__states[event_type] = item
+        self.__notifier.notify()
+        return True
+
+    def put_bin(self, msg: bytes) -> (asyncio.Future | None):
+        if len(self.__queue) >= self.__queue_size:
+            return None
+        sent = asyncio.get_running_loop().create_future()
+        self.__queue.append(_WsMessage("", msg, None, sent))
+        self.__notifier.notify()
+        return sent
+
+    async def stop(self) -> None:
+        self.__task.cancel()
+        await asyncio.gather(self.__task, return_exceptions=True)
+        for item in self.__queue:
+            if item.sent is not None and not item.sent.done():
+                item.sent.set_exception(ConnectionResetError("The websocket session is closed"))
+        self.__queue.clear()
+
+    async def __sender(self) -> None:
+        logger = get_logger(0)
+        while True:
+            while not self.__queue:
+                await self.__notifier.wait()
+            item = self.__queue.popleft()
+            if self.__states.get(item.event_type) is item:
+                del self.__states[item.event_type]
+            msg = item.msg
+            if msg is None:
+                assert item.get_state is not None
+                try:
+                    state = await item.get_state()
+                except Exception:
+                    logger.exception("Can't get the actual %r state for the websocket", item.event_type)
+                    continue
+                if state is None:
+                    continue
+                msg = make_ws_event(item.event_type, state, self.__encoding)
+            if item.sent is not None:
+                await self.__send_bin(msg, item.sent)
+                continue
+            try:
+                await self.__wsr.send_frame(msg, self.__opcode)
+            except Exception:
+                pass  # Сессия закрывается, все равно не доставим
+
+    async def __send_bin(self, msg: bytes, sent: asyncio.Future) -> None:
+        error: (Exception | None) = ConnectionResetError("The websocket session is closed")
+        try:
+            await self.__wsr.send_frame(msg, WSMsgType.BINARY)
+            error = None
+        except Exception as ex:
+            error = ex
+        finally:
+            if not sent.done():  # Отправитель мог уже уйти по отмене
+                if error is None:
+                    sent.set_result(None)
+                else:
+                    sent.set_exception(error)
+
+
+@dataclasses.dataclass(eq=False)
 class WsSession:
     wsr: WebSocketResponse
-    kwargs: dict[str, Any] = dataclasses.field(hash=False)
+    kwargs: dict[str, Any]
+    encoding: str = "json"
+    queue_size: int = 256
+
+    def __post_init__(self) -> None:
+        self.__sender = _WsSender(self.wsr, self.encoding, self.queue_size)
 
     def __str__(self) -> str:
         return f"WsSession(id={id(self)}, {self.kwargs})"
@@ -326,18 +538,74 @@ class WsSession:
         )
 
     async def send_event(self, event_type: str, event: (dict | None)) -> None:
-        await send_ws_event(self.wsr, event_type, event)
+        self.queue_event(event_type, make_ws_event(event_type, event, self.encoding))
 
     async def send_bin(self, op: int, data: bytes) -> None:
-        await send_ws_bin(self.wsr, op, data)
+        await self.send_prepared_bin(make_ws_bin(op, data))
+
+    async def send_prepared_bin(self, msg: bytes) -> None:
+        # Через очередь сессии, в порядке с событиями. Возвращается после фактической отправки,
+        # так что у вызывающего остается обратное давление (например, у видео в kvmd-media).
+        sent = self.__sender.put_bin(msg)
+        if sent is None:
+            self.__on_overflow()
+            raise ConnectionResetError("Websocket queue overflow")
+        await sent
+
+    def queue_event(
+        self,
+        event_type: str,
+        msg: bytes,
+        get_state: (Callable[[], Coroutine[Any, Any, (dict | None)]] | None)=None,
+    ) -> bool:
+        # События уходят через очередь, так что порядок сохраняется.
+        # msg должен быть закодирован в кодировке сессии (см. make_ws_event()).
+        # Если передан get_state, неотправленное событие этого типа можно заменить
+        # на актуальное полное состояние. При переполнении сессия закрывается.
+        if self.__sender.put(event_type, msg, get_state):
+            return True
+        self.__on_overflow()
+        return False
+
+    def __on_overflow(self) -> None:
+        if not self.wsr.closed:
+            get_logger(0).error("Websocket queue overflow, closing the slow client session: %s", self)
+            aiotools.create_short_task(self.wsr.close())
+
+    async def close(self) -> None:
+        try:
+            await self.wsr.close()
+        finally:
+            await self.__sender.stop()
+
 
+@dataclasses.dataclass(eq=False)
+class SseSession:
+    resp:      StreamResponse
+    heartbeat: float
 
-class HttpServer:
+    def __str__(self) -> str:
+        return f"SseSession(id={id(self)})"
+
+    async def send_event(self, msg: (bytes | None), event_id: str="") -> None:
+        await self.resp.write(make_sse_event(msg, event_id))
+
+    async def send_ping(self) -> None:
+        await self.resp.write(b": ping\n\n")
+
+
+class HttpServer:  # pylint: disable=too-many-instance-attributes
     def __init__(self) -> None:
         self.__ws_heartbeat: (float | None) = None
         self.__ws_handlers: dict[str, Callable] = {}
         self.__ws_bin_handlers: dict[int, Callable] = {}
         self.__ws_sessions: list[WsSession] = []
+        self.__ws_topics: dict[WsSession, (set[str] | None)] = {}
+        self.__ws_subs_all: set[WsSession] = set()  # Подписаны на все события
+        self.__ws_subs: dict[str, set[WsSession]] = {}  # Индекс подписчиков по типу события
+        self.__sse_topics: dict[SseSession, (set[str] | None)] = {}
+        self.__http_metrics = HttpMetrics()
+        self.__subs_changed = asyncio.Event()
         self.__ws_sessions_lock = asyncio.Lock()
 
     def run(
@@ -349,8 +617,6 @@ class HttpServer:
         access_log_format: str,
     ) -> None:
 
-        self.__ws_heartbeat = heartbeat
-
         if unix_rm and os.path.exists(unix_path):
             os.remove(unix_path)
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -361,13 +627,33 @@ class HttpServer:
 
         run_app(
             sock=sock,
-            app=self.__make_app(),
+            app=self.make_app(heartbeat),
             shutdown_timeout=1,
             access_log_format=access_log_format,
             print=self.__run_app_print,
             loop=asyncio.get_event_loop(),
         )
 
+    async def make_app(self, heartbeat: float) -> Application:
+        # Отдельно от run(), чтобы приложение можно было запустить в чужом лупе, например в тестах
+        self.__ws_heartbeat = heartbeat
+        self.__app = Application(middlewares=[normalize_path_middleware(  # pylint: disable=attribute-defined-outside-init
+            append_slash=False,
+            remove_slash=True,
+            merge_slashes=True,
+        )])
+
+        async def on_shutdown(_: Application) -> None:
+            await self._on_shutdown()
+        self.__app.on_shutdown.append(on_shutdown)
+
+        async def on_cleanup(_: Application) -> None:
+            await self._on_cleanup()
+        self.__app.on_cleanup.append(on_cleanup)
+
+        await self._init_app()
+        return self.__app
+
     # =====
 
     def _add_exposed(self, *objs: object) -> None:
@@ -379,15 +665,37 @@ class HttpServer:
 
     def __add_exposed_http(self, exposed: HttpExposed) -> None:
         async def wrapper(req: Request) -> Response:
+            self.__http_metrics.start_request(exposed.method, exposed.path)
+            started = time.monotonic()
+            (status, error) = (500, "")
             try:
-                await self._check_request_auth(exposed, req)
-                return (await exposed.handler(req))
-            except IsBusyError as ex:
-                return make_json_exception(ex, 409)
-            except (ValidatorError, OperationError) as ex:
-                return make_json_exception(ex, 400)
-            except HttpError as ex:
-                return make_json_exception(ex)
+                try:
+                    await self._check_request_auth(exposed, req)
+                    resp = await exposed.handler(req)
+                except IsBusyError as ex:
+                    (resp, error) = (make_json_exception(ex, 409), type(ex).__name__)
+                except (ValidatorError, OperationError) as ex:
+                    (resp, error) = (make_json_exception(ex, 400), type(ex).__name__)
+                except HttpError as ex:
+                    (resp, error) = (make_json_exception(ex), type(ex).__name__)
+                status = resp.status
+                return resp
+            except asyncio.CancelledError:
+                # Клиент отключился или сервер останавливается - это не ошибка сервера, пишем как nginx
+                (status, error) = (499, "CancelledError")
+                raise
+            except Exception as ex:
+                (status, error) = ((ex.status if isinstance(ex, HTTPException) else 500), type(ex).__name__)
+                raise
+            finally:
+                self.__http_metrics.finish_request(
+                    method=exposed.method,
+                    path=exposed.path,
+                    status=status,
+                    error=error,
+                    duration=(time.monotonic() - started),
+                    stream=bool(req.get(_REQ_STREAMING)),
+                )
         self.__app.router.add_route(exposed.method, exposed.path, wrapper)
 
     def __add_exposed_ws(self, exposed: WsExposed) -> None:
@@ -402,14 +710,25 @@ class HttpServer:
     # =====
 
     @contextlib.asynccontextmanager
-    async def _ws_session(self, req: Request, **kwargs: Any) -> AsyncGenerator[WsSession, None]:
+    async def _ws_session(
+        self,
+        req: Request,
+        compress: bool=True,
+        topics: (set[str] | None)=None,
+        encoding: str="json",
+        **kwargs: Any,
+    ) -> AsyncGenerator[WsSession, None]:
+
         assert self.__ws_heartbeat is not None
-        wsr = WebSocketResponse(heartbeat=self.__ws_heartbeat)
+        assert encoding in get_ws_encodings(), encoding
+        wsr = WebSocketResponse(heartbeat=self.__ws_heartbeat, compress=compress)
+        _mark_streaming(req)
         await wsr.prepare(req)
-        ws = WsSession(wsr, kwargs)
+        ws = WsSession(wsr, kwargs, encoding)
 
         async with self.__ws_sessions_lock:
             self.__ws_sessions.append(ws)
+            self._set_ws_topics(ws, topics)
             get_logger(2).info("Registered new client session: %s; clients now: %d", ws, len(self.__ws_sessions))
 
         try:
@@ -418,6 +737,32 @@ class HttpServer:
         finally:
             await aiotools.shield_fg(self.__close_ws(ws))
 
+    @contextlib.asynccontextmanager
+    async def _sse_session(
+        self,
+        req: Request,
+        topics: (set[str] | None)=None,
+    ) -> AsyncGenerator[SseSession, None]:
+
+        assert self.__ws_heartbeat is not None
+        resp = StreamResponse(status=200, reason="OK", headers={"Cache-Control": "no-cache"})
+        resp.content_type = "text/event-stream"
+        _mark_streaming(req)
+        await resp.prepare(req)
+        sse = SseSession(resp, self.__ws_heartbeat)
+
+        self.__sse_topics[sse] = (None if topics is None else set(topics))
+        self.__notify_subs_changed()
+        get_logger(2).info("Registered new SSE client: %s; SSE clients now: %d", sse, len(self.__sse_topics))
+        try:
+            yield sse
+        except ConnectionResetError:
+            pass  # Клиент отключился
+        finally:
+            del self.__sse_topics[sse]
+            self.__notify_subs_changed()
+            get_logger(3).info("Removed SSE client: %s; SSE clients now: %d", sse, len(self.__sse_topics))
+
     async def _ws_loop(self, ws: WsSession) -> WebSocketResponse:
         logger = get_logger()
         async for msg in ws.wsr:
@@ -425,32 +770,47 @@ class HttpServer:
                 try:
                     (event_type, event) = parse_ws_event(msg.data)
                 except Exception as ex:
+                    self.__http_metrics.count_ws_message("text", "invalid")
                     logger.error("Can't parse JSON event from websocket: %r", ex)
                 else:
                     handler = self.__ws_handlers.get(event_type)
                     if handler:
+                        self.__http_metrics.count_ws_message("text", event_type)
                         await handler(ws, event)
                     else:
+                        self.__http_metrics.count_ws_message("text", "unknown")
                         logger.error("Unknown websocket event: %r", msg.data)
 
             elif msg.type == WSMsgType.BINARY and len(msg.data) >= 1:
                 handler = self.__ws_bin_handlers.get(msg.data[0])
                 if handler:
+                    self.__http_metrics.count_ws_message("binary", str(msg.data[0]))
                     await handler(ws, msg.data[1:])
                 else:
+                    self.__http_metrics.count_ws_message("binary", "unknown")
                     logger.error("Unknown websocket binary event: %r", msg.data)
 
             else:
                 break
         return ws.wsr
 
-    async def _broadcast_ws_event(self, event_type: str, event: (dict | None)) -> None:
-        if self.__ws_sessions:
-            await asyncio.gather(*[
-                ws.send_event(event_type, event)
-                for ws in self.__ws_sessions
-                if ws.is_alive()
-            ], return_exceptions=True)
+    async def _broadcast_ws_event(
+        self,
+        event_type: str,
+        event: (dict | None),
+        get_state: (Callable[[], Coroutine[Any, Any, (dict | None)]] | None)=None,
+    ) -> None:
+
+        # Не ждет клиентов: событие кладется в очередь каждой сессии.
+        # get_state позволяет заменить несколько неотправленных событий одним полным состоянием.
+        wss = self.__ws_subs_all.union(self.__ws_subs.get(event_type, ()))
+        msgs: dict[str, bytes] = {}  # Каждая кодировка сериализуется один раз
+        for ws in wss:
+            if ws.is_alive():
+                msg = msgs.get(ws.encoding)
+                if msg is None:
+                    msg = msgs[ws.encoding] = make_ws_event(event_type, event, ws.encoding)
+                ws.queue_event(event_type, msg, get_state)
 
     async def _close_all_wss(self) -> bool:
         wss = self._get_wss()
@@ -458,15 +818,62 @@ class HttpServer:
             await self.__close_ws(ws)
         return bool(wss)
 
+    def _get_http_metrics(self) -> HttpMetrics:
+        return self.__http_metrics
+
     def _get_wss(self) -> list[WsSession]:
         return list(self.__ws_sessions)
 
+    def _set_ws_topics(self, ws: WsSession, topics: (set[str] | None)) -> None:
+        # None - все события, иначе только перечисленные типы
+        self.__unset_ws_topics(ws)
+        self.__ws_topics[ws] = (None if topics is None else set(topics))
+        if topics is None:
+            self.__ws_subs_all.add(ws)
+        else:
+            for event_type in topics:
+                self.__ws_subs.setdefault(event_type, set()).add(ws)
+        self.__notify_subs_changed()
+
+    def _get_ws_topics(self, ws: WsSession) -> (set[str] | None):
+        topics = self.__ws_topics.get(ws)
+        return (None if topics is None else set(topics))
+
+    def _has_subscribers(self, event_type: str) -> bool:
+        return bool(
+            self.__ws_subs_all
+            or self.__ws_subs.get(event_type)
+            or any((topics is None or event_type in topics) for topics in self.__sse_topics.values())
+        )
+
+    async def _wait_subscribers(self, event_type: str) -> None:
+        while not self._has_subscribers(event_type):
+            await self.__subs_changed.wait()
+
+    def __unset_ws_topics(self, ws: WsSession) -> None:
+        if ws in self.__ws_topics:
+            topics = self.__ws_topics.pop(ws)
+            if topics is None:
+                self.__ws_subs_all.discard(ws)
+            else:
+                for event_type in topics:
+                    wss = self.__ws_subs[event_type]
+                    wss.discard(ws)
+                    if not wss:
+                        del self.__ws_subs[event_type]
+            self.__notify_subs_changed()
+
+    def __notify_subs_changed(self) -> None:
+        self.__subs_changed.set()
+        self.__subs_changed = asyncio.Event()
+
     async def __close_ws(self, ws: WsSession) -> None:
         async with self.__ws_sessions_lock:
             try:
                 self.__ws_sessions.remove(ws)
+                self.__unset_ws_topics(ws)
                 get_logger(3).info("Removed client socket: %s; clients now: %d", ws, len(self.__ws_sessions))
-                await ws.wsr.close()
+                await ws.close()
             except Exception:
                 pass
         await self._on_ws_closed(ws)
@@ -493,24 +900,6 @@ class HttpServer:
 
     # =====
 
-    async def __make_app(self) -> Application:
-        self.__app = Application(middlewares=[normalize_path_middleware(  # pylint: disable=attribute-defined-outside-init
-            append_slash=False,
-            remove_slash=True,
-            merge_slashes=True,
-        )])
-
-        async def on_shutdown(_: Application) -> None:
-            await self._on_shutdown()
-        self.__app.on_shutdown.append(on_shutdown)
-
-        async def on_cleanup(_: Application) -> None:
-            await self._on_cleanup()
-        self.__app.on_cleanup.append(on_cleanup)
-
-        await self._init_app()
-        return self.__app
-
     def __run_app_print(self, text: str) -> None:
         logger = get_logger(0)
         for line in text.strip().splitlines():
@@ -0,0 +1,211 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import bisect
+
+from typing import MutableSequence
+
+
+# =====
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STREAM_BUCKETS = (1.0, 10.0, 60.0, 300.0, 1800.0, 3600.0, 21600.0, 86400.0)
+
+
+class Histogram:
+    # Гистограмма в духе Prometheus: счетчики по корзинам (последняя - +Inf) и сумма значений в конце.
+    # Хранилище можно передать снаружи со смещением, например RawArray в разделяемой памяти,
+    # тогда в него пишет один процесс, а экспортирует другой.
+
+    def __init__(
+        self,
+        buckets: tuple[float, ...]=LATENCY_BUCKETS,
+        values: (MutableSequence[float] | None)=None,
+        offset: int=0,
+    ) -> None:
+
+        self.__buckets = buckets
+        self.__size = self.get_size(buckets)
+        if values is None:
+            values = [0.0] * self.__size
+        assert len(values) >= offset + self.__size
+        self.__values = values
+        self.__offset = offset
+
+    @classmethod
+    def get_size(cls, buckets: tuple[float, ...]=LATENCY_BUCKETS) -> int:
+        return len(buckets) + 2
+
+    def observe(self, value: float) -> None:
+        self.__values[self.__offset + bisect.bisect_left(self.__buckets, value)] += 1
+        self.__values[self.__offset + self.__size - 1] += value
+
+    def get_count(self) -> int:
+        return int(sum(self.__values[self.__offset:self.__offset + self.__size - 1]))
+
+    def make_rows(self, name: str, labels: dict[str, str]) -> list[str]:
+        values = self.__values[self.__offset:self.__offset + self.__size]
+        rows: list[str] = []
+        count = 0
+        for (bound, value) in zip([*map(str, self.__buckets), "+Inf"], values[:-1]):
+            count += int(value)
+            rows.append(f"{name}_bucket{make_labels({**labels, 'le': bound})} {count}")
+        rows.extend([
+            f"{name}_sum{make_labels(labels)} {values[-1]}",
+            f"{name}_count{make_labels(labels)} {count}",
+        ])
+        return rows
+
+
+def make_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for (key, value) in labels.items()
+    )
+    return "{" + ",".join(f"{key}=\"{value}\"" for (key, value) in escaped) + "}"
+
+
+def make_header(name: str, kind: str, help_text: str) -> list[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+# =====
+class FrameLatency:
+    # Задержки кадра у потребителя стрима:
+    #   - queue: от получения кадра из стримера до того, как отправитель забрал его из очереди;
+    #   - send_start: от захвата кадра (grab_ts из ustreamer) до начала отправки клиенту;
+    #   - send_complete: от захвата кадра до конца отправки (включая drain()).
+
+    STAGES = ("queue", "send_start", "send_complete")
+
+    def __init__(self, values: (MutableSequence[float] | None)=None, offset: int=0) -> None:
+        if values is None:
+            values = [0.0] * self.get_size()
+        self.__hists = {
+            stage: Histogram(values=values, offset=(offset + index * Histogram.get_size()))
+            for (index, stage) in enumerate(self.STAGES)
+        }
+
+    @classmethod
+    def get_size(cls) -> int:
+        return Histogram.get_size() * len(cls.STAGES)
+
+    def get_histogram(self, stage: str) -> Histogram:
+        return self.__hists[stage]
+
+    def observe(self, grab_ts: float, recv_ts: float, dequeue_ts: float, start_ts: float, end_ts: float) -> None:
+        if grab_ts <= 0:
+            grab_ts = recv_ts  # Стример не сообщил время захвата
+        self.__hists["queue"].observe(max(dequeue_ts - recv_ts, 0.0))
+        self.__hists["send_start"].observe(max(start_ts - grab_ts, 0.0))
+        self.__hists["send_complete"].observe(max(end_ts - grab_ts, 0.0))
+
+    @classmethod
+    def make_rows(cls, prefix: str, latencies: list[tuple[dict[str, str], "FrameLatency"]]) -> list[str]:
+        rows: list[str] = []
+        for stage in cls.STAGES:
+            name = f"{prefix}_{stage}_seconds"
+            rows.extend(make_header(name, "histogram", f"Frame {stage.replace('_', '-')} latency"))
+            for (labels, latency) in latencies:
+                rows.extend(latency.get_histogram(stage).make_rows(name, labels))
+        return rows
+
+
+# =====
+class HttpMetrics:
+    # Метрики HTTP-ручек и вебсокета по шаблону пути, а не по реальному URL, чтобы не плодить ряды.
+    # Пишет только event loop сервера, поэтому блокировки не нужны.
+    # Стримы (вебсокеты, SSE, follow логов и т.п.) живут минутами и часами, поэтому их длительность
+    # пишется в отдельную гистограмму, чтобы не портить задержки обычных запросов.
+
+    def __init__(self) -> None:
+        self.__latencies: dict[tuple[str, str], Histogram] = {}
+        self.__stream_durations: dict[tuple[str, str], Histogram] = {}
+        self.__in_flight: dict[tuple[str, str], int] = {}
+        self.__responses: dict[tuple[str, str, int], int] = {}
+        self.__exceptions: dict[tuple[str, str, str], int] = {}
+        self.__ws_messages: dict[tuple[str, str], int] = {}
+
+    def start_request(self, method: str, path: str) -> None:
+        key = (method, path)
+        self.__in_flight[key] = self.__in_flight.get(key, 0) + 1
+
+    def finish_request(  # pylint: disable=too-many-arguments
+        self,
+        method: str,
+        path: str,
+        status: int,
+        error: str,
+        duration: float,
+        stream: bool=False,
+    ) -> None:
+
+        key = (method, path)
+        self.__in_flight[key] -= 1
+        hists = (self.__stream_durations if stream else self.__latencies)
+        hist = hists.get(key)
+        if hist is None:
+            hist = hists[key] = Histogram(STREAM_BUCKETS if stream else LATENCY_BUCKETS)
+        hist.observe(duration)
+        self.__responses[(method, path, status)] = self.__responses.get((method, path, status), 0) + 1
+        if error:
+            self.__exceptions[(method, path, error)] = self.__exceptions.get((method, path, error), 0) + 1
+
+    def count_ws_message(self, kind: str, event_type: str) -> None:
+        key = (kind, event_type)
+        self.__ws_messages[key] = self.__ws_messages.get(key, 0) + 1
+
+    def make_rows(self, prefix: str) -> list[str]:
+        rows: list[str] = []
+
+        name = f"{prefix}_http_request_duration_seconds"
+        rows.extend(make_header(name, "histogram", "HTTP request latency"))
+        for ((method, path), hist) in sorted(self.__latencies.items()):
+            rows.extend(hist.make_rows(name, {"method": method, "path": path}))
+
+        name = f"{prefix}_http_stream_duration_seconds"
+        rows.extend(make_header(name, "histogram", "HTTP streaming response duration"))
+        for ((method, path), hist) in sorted(self.__stream_durations.items()):
+            rows.extend(hist.make_rows(name, {"method": method, "path": path}))
+
+        name = f"{prefix}_http_requests_in_flight"
+        rows.extend(make_header(name, "gauge", "Number of HTTP requests being handled"))
+        for ((method, path), count) in sorted(self.__in_flight.items()):
+            rows.append(f"{name}{make_labels({'method': method, 'path': path})} {count}")
+
+        name = f"{prefix}_http_responses_total"
+        rows.extend(make_header(name, "counter", "Number of HTTP responses by status"))
+        for ((method, path, status), count) in sorted(self.__responses.items()):
+            rows.append(f"{name}{make_labels({'method': method, 'path': path, 'status': str(status)})} {count}")
+
+        name = f"{prefix}_http_exceptions_total"
+        rows.extend(make_header(name, "counter", "Number of exceptions raised by HTTP handlers"))
+        for ((method, path, error), count) in sorted(self.__exceptions.items()):
+            rows.append(f"{name}{make_labels({'method': method, 'path': path, 'exception': error})} {count}")
+
+        name = f"{prefix}_ws_messages_total"
+        rows.extend(make_header(name, "counter", "Number of received websocket messages"))
+        for ((kind, event_type), count) in sorted(self.__ws_messages.items()):
+            rows.append(f"{name}{make_labels({'type': kind, 'event_type': event_type})} {count}")
+
+        return rows
@@ -37,7 +37,7 @@ class AtxDisabledError(AtxOperationError):
 # =====
 class Plugin(BaseAtx):
     def __init__(self) -> None:
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> dict:
         return {
@@ -74,7 +74,7 @@ class Plugin(BaseAtx):  # pylint: disable=too-many-instance-attributes
         self.__click_delay = click_delay
         self.__long_click_delay = long_click_delay
 
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
         self.__region = aiotools.AioExclusiveRegion(AtxIsBusyError, self.__notifier)
 
         self.__line_req: (gpiod.LineRequest | None) = None
@@ -178,7 +178,7 @@ class BaseMsd(BasePlugin):
 
 
 class MsdFileReader(BaseMsdReader):  # pylint: disable=too-many-instance-attributes
-    def __init__(self, notifier: aiotools.AioNotifier, name: str, path: str, chunk_size: int) -> None:
+    def __init__(self, notifier: aiotools.AioCoalescingNotifier, name: str, path: str, chunk_size: int) -> None:
         self.__notifier = notifier
         self.__name = name
         self.__path = path
@@ -237,7 +237,7 @@ class MsdFileReader(BaseMsdReader):  # pylint: disable=too-many-instance-attribu
 
 
 class MsdFileWriter(BaseMsdWriter):  # pylint: disable=too-many-instance-attributes
-    def __init__(self, notifier: aiotools.AioNotifier, name: str, path: str, file_size: int, sync_size: int, chunk_size: int) -> None:
+    def __init__(self, notifier: aiotools.AioCoalescingNotifier, name: str, path: str, file_size: int, sync_size: int, chunk_size: int) -> None:
         self.__notifier = notifier
         self.__name = name
         self.__path = path
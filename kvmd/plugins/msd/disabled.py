@@ -41,7 +41,7 @@ class MsdDisabledError(MsdOperationError):
 # =====
 class Plugin(BaseMsd):
     def __init__(self) -> None:
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
 
     async def get_state(self) -> dict:
         return {
@@ -84,7 +84,7 @@ class _VirtualDriveState:
 
 
 class _State:
-    def __init__(self, notifier: aiotools.AioNotifier) -> None:
+    def __init__(self, notifier: aiotools.AioCoalescingNotifier) -> None:
         self.__notifier = notifier
 
         self.storage: (Storage | None) = None
@@ -139,7 +139,7 @@ class Plugin(BaseMsd):  # pylint: disable=too-many-instance-attributes
         self.__reader: (MsdFileReader | None) = None
         self.__writer: (MsdFileWriter | None) = None
 
-        self.__notifier = aiotools.AioNotifier()
+        self.__notifier = aiotools.AioCoalescingNotifier()
         self.__state = _State(self.__notifier)
         self.__reset = False
 
@@ -57,7 +57,7 @@ class BaseUserGpioDriver(BasePlugin):
     def __init__(  # pylint: disable=super-init-not-called
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
         **_: Any,
     ) -> None:
 
@@ -50,7 +50,7 @@ class Plugin(BaseUserGpioDriver):  # pylint: disable=too-many-instance-attribute
     def __init__(
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         url: str,
         verify: bool,
@@ -43,7 +43,7 @@ class Plugin(BaseUserGpioDriver):  # pylint: disable=too-many-instance-attribute
     def __init__(  # pylint: disable=super-init-not-called
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         cmd: list[str],
     ) -> None:
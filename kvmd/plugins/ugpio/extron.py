@@ -53,7 +53,7 @@ class Plugin(BaseUserGpioDriver):  # pylint: disable=too-many-instance-attribute
     def __init__(
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         device_path: str,
         speed: int,
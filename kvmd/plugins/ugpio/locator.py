@@ -43,7 +43,7 @@ class Plugin(BaseUserGpioDriver):
     def __init__(
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         device_path: str,
     ) -> None:
@@ -53,7 +53,7 @@ class Plugin(BaseUserGpioDriver):
     def __init__(  # pylint: disable=super-init-not-called
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         device_path: str,
     ) -> None:
@@ -45,7 +45,7 @@ class Plugin(BaseUserGpioDriver):
     def __init__(
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         otg_config: Section,  # XXX: Not from options, see /kvmd/apps/kvmd/__init__.py for details
     ) -> None:
@@ -46,7 +46,7 @@ class Plugin(BaseUserGpioDriver):
     def __init__(  # pylint: disable=super-init-not-called
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         chip: int,
         period: int,
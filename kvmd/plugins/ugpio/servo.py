@@ -36,7 +36,7 @@ class Plugin(PwmPlugin):
     def __init__(  # pylint: disable=super-init-not-called,too-many-arguments
         self,
         instance_name: str,
-        notifier: aiotools.AioNotifier,
+        notifier: aiotools.AioCoalescingNotifier,
 
         chip: int,
         period: int,
@@ -0,0 +1,91 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+from typing import Any
+
+
+# =====
+class StateStore:
+    # Последний опубликованный стейт подсистемы и дельты к нему в стиле JSON Merge Patch.
+    # Снимки не копируются: при обновлении пересобираются только словари на пути
+    # к изменениям, а неизменные поддеревья разделяются между версиями.
+    # Поэтому опубликованные значения нельзя менять после публикации.
+    # depth - сколько уровней словарей сравнивается поэлементно, глубже значения
+    # заменяются целиком. Это и есть гранулярность дельт подсистемы.
+    # Версия только растет: каждый новый полный стейт и каждая непустая дельта увеличивают ее,
+    # так что по ней можно понять, пропущено ли что-то, и запросить снимок заново.
+
+    def __init__(self, depth: int) -> None:
+        self.__depth = depth
+        self.__state: dict = {}
+        self.__version = 0
+
+    def get_state(self) -> dict:
+        return self.__state
+
+    def get_snapshot(self) -> tuple[int, dict]:
+        return (self.__version, self.__state)
+
+    def reset(self, state: dict) -> dict:
+        # Полный стейт целиком, например после trigger_state()
+        self.__state = state
+        self.__version += 1
+        return state
+
+    def update(self, state: dict, partial: bool=False) -> (dict | None):
+        # Возвращает минимальную дельту или None, если ничего не изменилось.
+        # Удаленные ключи попадают в дельту как None, а с partial=True
+        # отсутствующие ключи считаются неизменными.
+        (changed, merged, diff) = _make_diff(self.__state, state, self.__depth, partial)
+        if not changed:
+            return None
+        self.__state = merged
+        self.__version += 1
+        return diff
+
+
+def _make_diff(old: Any, new: Any, depth: int, partial: bool) -> tuple[bool, Any, Any]:
+    if new is old:
+        return (False, old, None)
+    if depth <= 0 or not isinstance(old, dict) or not isinstance(new, dict):
+        if new == old:
+            return (False, old, None)
+        return (True, new, new)
+
+    merged = (dict(old) if partial else {})
+    diff: dict = {}
+    for (key, value) in new.items():
+        if key in old:
+            (changed, merged[key], sub) = _make_diff(old[key], value, depth - 1, partial)
+            if changed:
+                diff[key] = sub
+        else:
+            merged[key] = value
+            diff[key] = value
+    if not partial:
+        for key in old:
+            if key not in new:
+                diff[key] = None
+
+    if not diff:
+        return (False, old, None)  # Сохраняем старый объект, чтобы дальше сработала проверка is
+    return (True, merged, diff)
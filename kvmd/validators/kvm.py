@@ -59,6 +59,19 @@ def valid_info_fields(arg: Any, variants: set[str]) -> set[str]:
     ))
 
 
+def valid_ws_topics(arg: Any, variants: set[str]) -> set[str]:
+    # Comma-separated string from the query or a list from the websocket event
+    return set(valid_string_list(
+        arg=arg,
+        subval=(lambda topic: check_string_in_list(topic, "websocket topic", variants)),
+        name="websocket topics list",
+    ))
+
+
+def valid_ws_encoding(arg: Any, variants: list[str]) -> str:
+    return check_string_in_list(arg, "websocket encoding", variants)
+
+
 def valid_log_seek(arg: Any) -> int:
     return int(valid_number(arg, min=0, name="log seek"))
 
@@ -88,3 +101,15 @@ def valid_stream_h264_bitrate(arg: Any) -> int:
 
 def valid_stream_h264_gop(arg: Any) -> int:
     return int(valid_number(arg, min=0, max=60, name="stream H264 GOP"))
+
+
+def valid_stream_simulcast_variant(arg: Any) -> str:
+    # WIDTHxHEIGHT:QUALITY, the resolution is the bounding box for the downscaled frame
+    name = "stream simulcast variant"
+    arg = valid_stripped_string_not_empty(arg, name)
+    parts = arg.split(":")
+    if len(parts) != 2:
+        raise_error(arg, name)
+    resolution = valid_stream_resolution(parts[0])
+    quality = valid_stream_quality(parts[1])
+    return f"{resolution}:{quality}"
@@ -0,0 +1,163 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+# Measures kvmd-media CPU against the number of H.264 viewers. The server runs in a child
+# process with a synthetic streamer, the viewers are websocket clients in this process.
+# With the per-frame message built once and shared by all clients, the server CPU per
+# client per frame should stay flat as the number of viewers grows.
+#
+# Usage: PYTHONPATH=. python testenv/benchmarks/media_fanout.py [clients,...] [frame_size] [fps] [duration]
+
+
+import sys
+import os
+import asyncio
+import contextlib
+import multiprocessing
+import tempfile
+import time
+
+from typing import Callable
+from typing import Awaitable
+from typing import AsyncGenerator
+
+import aiohttp
+import psutil
+
+from kvmd.clients.streamer import StreamerFormats
+from kvmd.clients.streamer import BaseStreamerClient
+
+from kvmd.apps.media.server import MediaServer
+
+
+# =====
+class _SyntheticStreamerClient(BaseStreamerClient):
+    def __init__(self, frame_size: int, fps: int) -> None:
+        self.__frame_size = frame_size
+        self.__fps = fps
+
+    def get_format(self) -> int:
+        return StreamerFormats.H264
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        frames = [os.urandom(self.__frame_size) for _ in range(30)]  # Like H.264, incompressible
+        index = 0
+        next_ts = time.monotonic()
+
+        async def read_frame(key_required: bool) -> dict:
+            nonlocal index, next_ts
+            await asyncio.sleep(max(next_ts - time.monotonic(), 0))
+            next_ts += 1 / self.__fps
+            index += 1
+            now_ts = time.monotonic()
+            return {
+                "online": True,
+                "width": 1920,
+                "height": 1080,
+                "key": (key_required or index % 30 == 0),
+                "format": StreamerFormats.H264,
+                "data": frames[index % len(frames)],
+                "grab_ts": now_ts,
+                "recv_ts": now_ts,
+            }
+
+        yield read_frame
+
+    def __str__(self) -> str:
+        return "SyntheticStreamerClient()"
+
+
+def _run_server(unix_path: str, frame_size: int, fps: int) -> None:
+    MediaServer(
+        h264_streamer=_SyntheticStreamerClient(frame_size, fps),
+        jpeg_streamer=None,
+        simulcast_variants=[],
+        simulcast_workers=1,
+    ).run(
+        unix_path=unix_path,
+        unix_rm=True,
+        unix_mode=0,
+        heartbeat=15.0,
+        access_log_format="",
+    )
+
+
+async def _viewer(unix_path: str, counter: list[int]) -> None:
+    async with aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=unix_path)) as session:
+        # Offer permessage-deflate like a browser does
+        async with session.ws_connect("http://localhost/ws", max_msg_size=0, compress=15) as ws:
+            await ws.send_json({"event_type": "start", "event": {"type": "video", "format": "h264"}})
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.BINARY and msg.data[0] == 1:
+                    counter[0] += 1
+
+
+async def _measure(unix_path: str, pid: int, clients: int, duration: float) -> tuple[float, int]:
+    counter = [0]
+    tasks = [asyncio.create_task(_viewer(unix_path, counter)) for _ in range(clients)]
+    await asyncio.sleep(2)  # Connect and wait for the first keyframe
+    proc = psutil.Process(pid)
+    times = proc.cpu_times()
+    cpu = times.user + times.system
+    counter[0] = 0
+    await asyncio.sleep(duration)
+    times = proc.cpu_times()
+    cpu = times.user + times.system - cpu
+    frames = counter[0]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(1)  # Let the server drop the clients
+    return (cpu, frames)
+
+
+async def _bench(clients_list: list[int], frame_size: int, fps: int, duration: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp_path:
+        unix_path = os.path.join(tmp_path, "media.sock")
+        # Spawn, not fork: the child must not inherit the running event loop
+        server = multiprocessing.get_context("spawn").Process(target=_run_server, args=(unix_path, frame_size, fps))
+        server.start()
+        try:
+            await asyncio.sleep(2)  # Server startup
+            assert server.pid is not None
+            for clients in clients_list:
+                (cpu, frames) = await _measure(unix_path, server.pid, clients, duration)
+                per_frame = (cpu / frames * 1000000 if frames else 0.0)
+                print(
+                    f"{clients:>4} clients: {frames / duration / clients:5.1f} fps per client,"
+                    f" server cpu={cpu / duration * 100:5.1f}%, {per_frame:6.1f} us per client-frame"
+                )
+        finally:
+            server.terminate()
+            server.join(5)
+
+
+def main() -> None:
+    clients_list = list(map(int, (sys.argv[1] if len(sys.argv) > 1 else "1,10,50").split(",")))
+    args = [int(sys.argv[2]) if len(sys.argv) > 2 else 131072, int(sys.argv[3]) if len(sys.argv) > 3 else 30]
+    duration = (float(sys.argv[4]) if len(sys.argv) > 4 else 5.0)
+    asyncio.run(_bench(clients_list, args[0], args[1], duration))
+
+
+if __name__ == "__main__":
+    main()
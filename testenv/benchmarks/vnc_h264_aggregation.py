@@ -0,0 +1,100 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+# Compares two ways of sending H.264 frames accumulated for a lagging VNC client:
+#   - join: the old one, data += frame for each queued frame and one write();
+#   - parts: the new one, a list of frames and one writelines().
+# The data goes to a real loopback socket and is discarded on the other side.
+#
+# Usage: PYTHONPATH=. python testenv/benchmarks/vnc_h264_aggregation.py [frames] [frame_size] [rounds]
+
+
+import sys
+import asyncio
+import time
+
+from typing import Callable
+from typing import Awaitable
+
+from kvmd.apps.vnc.rfb.stream import RfbClientStream
+
+
+# =====
+class _Stream(RfbClientStream):
+    async def send_joined(self, frames: list[bytes]) -> None:
+        data = b""
+        for frame in frames:
+            data += frame
+        await self._write_struct("joined", "", data)
+
+    async def send_parts(self, frames: list[bytes]) -> None:
+        parts: list[bytes] = []
+        for frame in frames:
+            parts.append(frame)
+        await self._write_parts("parts", parts)
+
+
+async def _measure(name: str, send: Callable[[list[bytes]], Awaitable[None]], payload: list[bytes], rounds: int) -> None:
+    cpu_ts = time.process_time()
+    wall_ts = time.monotonic()
+    for _ in range(rounds):
+        await send(payload)
+    cpu = time.process_time() - cpu_ts
+    wall = time.monotonic() - wall_ts
+    print(f"{name:>5}: {len(payload)} x {len(payload[0])} bytes, {rounds} rounds: cpu={cpu:.3f}s, wall={wall:.3f}s")
+
+
+async def _bench(frames: int, frame_size: int, rounds: int) -> None:
+    sink_done = asyncio.Event()
+
+    async def sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while (await reader.read(1024 * 1024)):
+            pass
+        writer.close()
+        sink_done.set()
+
+    server = await asyncio.start_server(sink, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+    stream = _Stream(reader, writer)
+
+    payload = [bytes([index % 256]) * frame_size for index in range(frames)]
+    for (name, send) in [
+        ("join", stream.send_joined),
+        ("parts", stream.send_parts),
+    ]:
+        await _measure(name, send, payload, rounds)
+
+    writer.close()
+    await writer.wait_closed()
+    await sink_done.wait()
+    server.close()
+    await server.wait_closed()
+
+
+def main() -> None:
+    args = list(map(int, sys.argv[1:]))
+    asyncio.run(_bench(*(args + [30, 65536, 200][len(args):])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+# Synthetic load for kvmd-vnc: runs the real VncServer in a child process
+# with a fake KVMD and a streamer replaying recorded frames, then connects
+# M simulated RFB clients and reports per-client fps, frame latency and server CPU.
+#
+# Frames are timestamped by the fake streamer: JPEG gets a COM segment,
+# H.264 gets an extra NAL unit of the unspecified type 31. The latency is
+# measured only for the frames which reach the client intact (not re-encoded).
+#
+# Usage:
+#   PYTHONPATH=. python testenv/benchmarks/vnc_load.py --clients 8 --duration 20
+#   PYTHONPATH=. python testenv/benchmarks/vnc_load.py --frames /path/to/h264/dump --encoding h264
+#
+# The frames directory contains *.jpg or *.h264 files, one frame per file,
+# replayed in the sorted order. Without it, synthetic JPEG frames are generated.
+
+
+import sys
+import os
+import io
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import multiprocessing
+import statistics
+import struct
+import tempfile
+import time
+
+from typing import Callable
+from typing import Awaitable
+from typing import AsyncGenerator
+
+import aiohttp.web
+import psutil
+
+from PIL import Image as PilImage
+from PIL import ImageDraw as PilImageDraw
+
+from kvmd.clients.kvmd import KvmdClient
+from kvmd.clients.streamer import StreamerFormats
+from kvmd.clients.streamer import BaseStreamerClient
+
+from kvmd.apps.vnc.rfb.encodings import RfbEncodings
+from kvmd.apps.vnc.server import VncServer
+
+
+# =====
+_STAMP_JPEG = b"\xFF\xFE\x00\x0AKVMD"  # COM segment: marker, length=2+4+8, tag
+_STAMP_H264 = b"\x00\x00\x00\x01\x1FKVMD"  # NAL type 31, tag
+
+
+def _stamp_frame(fmt: int, data: bytes) -> bytes:
+    stamp = struct.pack(">d", time.monotonic())
+    if fmt == StreamerFormats.JPEG:
+        assert data[:2] == b"\xFF\xD8", "Not a JPEG"
+        return data[:2] + _STAMP_JPEG[:2] + struct.pack(">H", 2 + 4 + 8) + _STAMP_JPEG[4:] + stamp + data[2:]
+    return _STAMP_H264 + stamp + data
+
+
+def _find_stamp(data: bytes) -> (float | None):
+    for tag in [_STAMP_JPEG[4:], _STAMP_H264[5:]]:
+        index = data.find(tag, 0, 64)
+        if index >= 0:
+            return struct.unpack(">d", data[index + len(tag):index + len(tag) + 8])[0]
+    return None
+
+
+def _is_h264_key(data: bytes) -> bool:
+    index = 0
+    while (index := data.find(b"\x00\x00\x01", index)) >= 0 and index + 3 < len(data):
+        if data[index + 3] & 0x1F in [5, 7]:  # IDR or SPS
+            return True
+        index += 3
+    return False
+
+
+def _load_frames(path: str, width: int, height: int) -> tuple[int, list[tuple[bytes, bool]]]:
+    if path:
+        frames: list[tuple[bytes, bool]] = []
+        fmt = StreamerFormats.JPEG
+        for name in sorted(os.listdir(path)):
+            with open(os.path.join(path, name), "rb") as file:
+                data = file.read()
+            if name.endswith(".h264"):
+                fmt = StreamerFormats.H264
+                frames.append((data, _is_h264_key(data)))
+            elif name.endswith((".jpg", ".jpeg")):
+                frames.append((data, True))
+        if not frames:
+            raise SystemExit(f"No *.jpg or *.h264 frames in {path}")
+        return (fmt, frames)
+
+    # A moving box over a static background, like a cursor on a desktop
+    frames = []
+    for index in range(60):
+        image = PilImage.new("RGB", (width, height), (0x20, 0x40, 0x60))
+        draw = PilImageDraw.Draw(image)
+        draw.text((20, 20), "KVMD VNC load test", fill=(0xFF, 0xFF, 0xFF))
+        x = (index * width // 60)
+        draw.rectangle((x, height // 2, x + 64, height // 2 + 64), fill=(0xFF, 0x80, 0x00))
+        bio = io.BytesIO()
+        image.save(bio, format="JPEG", quality=80)
+        frames.append((bio.getvalue(), True))
+    return (StreamerFormats.JPEG, frames)
+
+
+# =====
+class _ReplayStreamerClient(BaseStreamerClient):
+    def __init__(self, fmt: int, frames: list[tuple[bytes, bool]], width: int, height: int, fps: int) -> None:
+        self.__fmt = fmt
+        self.__frames = frames
+        self.__width = width
+        self.__height = height
+        self.__fps = fps
+
+    def get_format(self) -> int:
+        return self.__fmt
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        index = 0
+        next_ts = time.monotonic()
+
+        async def read_frame(key_required: bool) -> dict:
+            nonlocal index, next_ts
+            _ = key_required  # The recording is replayed as is, with its own GOP
+            await asyncio.sleep(max(next_ts - time.monotonic(), 0))
+            next_ts += 1 / self.__fps
+            (data, key) = self.__frames[index % len(self.__frames)]
+            index += 1
+            now_ts = time.monotonic()
+            return {
+                "online": True,
+                "width": self.__width,
+                "height": self.__height,
+                "key": key,
+                "format": self.__fmt,
+                "data": _stamp_frame(self.__fmt, data),
+                "grab_ts": now_ts,
+                "recv_ts": now_ts,
+            }
+
+        yield read_frame
+
+    def __str__(self) -> str:
+        return f"ReplayStreamerClient(frames={len(self.__frames)})"
+
+
+async def _run_fake_kvmd(unix_path: str) -> aiohttp.web.AppRunner:
+    async def ok_handler(_: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"ok": True, "result": {}})
+
+    async def streamer_handler(_: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"ok": True, "result": {"features": {"quality": True}}})
+
+    async def ws_handler(request: aiohttp.web.Request) -> aiohttp.web.WebSocketResponse:
+        ws = aiohttp.web.WebSocketResponse(heartbeat=15)
+        await ws.prepare(request)
+        async for _ in ws:  # HID events are just dropped
+            pass
+        return ws
+
+    app = aiohttp.web.Application()
+    app.router.add_get("/auth/check", ok_handler)
+    app.router.add_get("/streamer", streamer_handler)
+    app.router.add_post("/streamer/set_params", ok_handler)
+    app.router.add_post("/hid/set_params", ok_handler)
+    app.router.add_get("/ws", ws_handler)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    await aiohttp.web.UnixSite(runner, unix_path).start()
+    return runner
+
+
+class _NoVncAuthManager:
+    async def read_credentials(self) -> tuple[dict, bool]:
+        return ({}, True)
+
+
+def _run_server(options: argparse.Namespace, kvmd_path: str) -> None:
+    (fmt, frames) = _load_frames(options.frames, options.width, options.height)
+    VncServer(
+        host="127.0.0.1",
+        port=options.port,
+        max_clients=max(options.clients, 10),
+        processes=options.processes,
+        metrics_path=options.metrics,
+        no_delay=True,
+        keepalive_enabled=False,
+        keepalive_idle=10,
+        keepalive_interval=3,
+        keepalive_count=3,
+        tls_ciphers="",
+        tls_timeout=30.0,
+        x509_cert_path="",
+        x509_key_path="",
+        vencrypt_enabled=False,
+        desired_fps=options.fps,
+        mouse_output="usb",
+        keymap_path=options.keymap,
+        scroll_rate=4,
+        allow_cut_after=3.0,
+        workers=options.workers,
+        tiles_enabled=options.tiles,
+        tiles_size=64,
+        congestion_enabled=(not options.no_congestion),
+        congestion_min_fps=5,
+        congestion_min_quality=30,
+        congestion_high_water=262144,
+        kvmd=KvmdClient(unix_path=kvmd_path, timeout=5.0, user_agent="KVMD-VNC-Bench"),
+        streamers=[_ReplayStreamerClient(fmt, frames, options.width, options.height, options.fps)],
+        vnc_auth_manager=_NoVncAuthManager(),  # type: ignore
+    ).run()
+
+
+# =====
+@dataclasses.dataclass
+class _ClientStats:
+    frames: int = 0
+    bytes: int = 0
+    latencies: list[float] = dataclasses.field(default_factory=list)
+    error: str = ""
+
+
+class _RfbLoadClient:
+    def __init__(self, port: int, encoding: str, cont_updates: bool) -> None:
+        self.__port = port
+        self.__encoding = encoding
+        self.__cont_updates = cont_updates
+        self.stats = _ClientStats()
+        self.__measure = False
+        self.__size = (0, 0)
+
+    def start_measure(self) -> None:
+        self.__measure = True
+
+    async def run(self) -> None:
+        try:
+            (reader, writer) = await asyncio.open_connection("127.0.0.1", self.__port)
+        except Exception as ex:
+            self.stats.error = str(ex)
+            return
+        try:
+            await self.__handshake(reader, writer)
+            await self.__main_loop(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError) as ex:
+            self.stats.error = f"Disconnected: {type(ex).__name__}"
+        finally:
+            writer.close()
+
+    async def __handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await reader.readexactly(12)
+        writer.write(b"RFB 003.008\n")
+        sec_types = await reader.readexactly((await reader.readexactly(1))[0])
+        assert 1 in sec_types, f"NoneAuth is not offered: {list(sec_types)}"
+        writer.write(b"\x01")
+        assert (await reader.readexactly(4)) == b"\x00\x00\x00\x00", "Access denied"
+
+        writer.write(b"\x01")  # Shared
+        (width, height) = struct.unpack(">HH", await reader.readexactly(4))
+        await reader.readexactly(16)  # Pixel format
+        await reader.readexactly(struct.unpack(">L", await reader.readexactly(4))[0])  # Name
+
+        encodings = {
+            "tight": [RfbEncodings.TIGHT, -23],  # JPEG quality 80
+            "h264": [RfbEncodings.H264, RfbEncodings.TIGHT, -23],
+            "zrle": [RfbEncodings.ZRLE],
+            "raw": [RfbEncodings.RAW],
+        }[self.__encoding] + [RfbEncodings.RESIZE]
+        if self.__cont_updates:
+            encodings.append(RfbEncodings.CONT_UPDATES)
+        writer.write(struct.pack(f">BxH{len(encodings)}l", 2, len(encodings), *encodings))
+        writer.write(struct.pack(">B? HH HH", 3, False, 0, 0, width, height))
+        await writer.drain()
+        self.__size = (width, height)
+
+    async def __main_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            msg_type = (await reader.readexactly(1))[0]
+            if msg_type == 0:
+                await self.__read_fb_update(reader)
+                if not self.__cont_updates:
+                    writer.write(struct.pack(">B? HH HH", 3, True, 0, 0, *self.__size))
+                    await writer.drain()
+            elif msg_type == 150:  # EndOfContinuousUpdates: supported, enable it
+                writer.write(struct.pack(">BB HH HH", 150, 1, 0, 0, *self.__size))
+                await writer.drain()
+            elif msg_type == 2:  # Bell
+                pass
+            elif msg_type == 3:  # Cut text
+                await reader.readexactly(struct.unpack(">xxxL", await reader.readexactly(7))[0])
+            else:
+                raise RuntimeError(f"Unknown server message: {msg_type}")
+
+    async def __read_fb_update(self, reader: asyncio.StreamReader) -> None:  # pylint: disable=too-many-branches
+        (rects,) = struct.unpack(">xH", await reader.readexactly(3))
+        image = False
+        size = 0
+        stamp: (float | None) = None
+        for _ in range(rects):
+            (_, _, width, height, encoding) = struct.unpack(">HHHHl", await reader.readexactly(12))
+            data = b""
+            if encoding == RfbEncodings.TIGHT:
+                control = (await reader.readexactly(1))[0]
+                if control >> 4 == 0b1000:  # Fill
+                    data = await reader.readexactly(3)
+                elif control >> 4 == 0b1001 or width * height * 3 >= 12:  # JPEG or compressed basic
+                    data = await reader.readexactly(await self.__read_tight_length(reader))
+                else:
+                    data = await reader.readexactly(width * height * 3)
+            elif encoding == RfbEncodings.H264:
+                (length, _) = struct.unpack(">LL", await reader.readexactly(8))
+                data = await reader.readexactly(length)
+            elif encoding == RfbEncodings.ZRLE:
+                data = await reader.readexactly(struct.unpack(">L", await reader.readexactly(4))[0])
+            elif encoding == RfbEncodings.RAW:
+                data = await reader.readexactly(width * height * 4)
+            elif encoding == RfbEncodings.RESIZE:
+                self.__size = (width, height)
+                continue
+            elif encoding == RfbEncodings.RENAME:
+                await reader.readexactly(struct.unpack(">L", await reader.readexactly(4))[0])
+                continue
+            elif encoding == RfbEncodings.LEDS_STATE:
+                await reader.readexactly(1)
+                continue
+            elif encoding in [RfbEncodings.EXT_KEYS, RfbEncodings.EXT_MOUSE]:
+                continue
+            else:
+                raise RuntimeError(f"Unknown rect encoding: {encoding}")
+            image = True
+            size += len(data)
+            if stamp is None:
+                stamp = _find_stamp(data)
+        if image and self.__measure:
+            self.stats.frames += 1
+            self.stats.bytes += size
+            if stamp is not None:
+                self.stats.latencies.append(time.monotonic() - stamp)
+
+    async def __read_tight_length(self, reader: asyncio.StreamReader) -> int:
+        length = 0
+        for index in range(3):
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & (0x7F if index < 2 else 0xFF)) << (7 * index)
+            if index < 2 and not byte & 0x80:
+                break
+        return length
+
+
+# =====
+def _get_cpu_time(proc: psutil.Process) -> float:
+    total = 0.0
+    for item in [proc, *proc.children(recursive=True)]:
+        try:
+            times = item.cpu_times()
+            total += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def _percentile(values: list[float], percent: int) -> float:
+    return (statistics.quantiles(values, n=100)[percent - 1] if len(values) > 1 else values[0])
+
+
+async def _bench(options: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmp_path:
+        kvmd_path = os.path.join(tmp_path, "kvmd.sock")
+        runner = await _run_fake_kvmd(kvmd_path)
+        # Spawn, not fork: the child must not inherit the running event loop.
+        # Not a daemon, because in the multi-process mode the server forks its own workers.
+        server = multiprocessing.get_context("spawn").Process(target=_run_server, args=(options, kvmd_path))
+        server.start()
+        try:
+            await asyncio.sleep(2)  # Server startup
+            clients = [
+                _RfbLoadClient(options.port, options.encoding, (not options.no_cont_updates))
+                for _ in range(options.clients)
+            ]
+            tasks = [asyncio.create_task(client.run()) for client in clients]
+
+            await asyncio.sleep(options.warmup)
+            proc = psutil.Process(server.pid)
+            cpu = _get_cpu_time(proc)
+            for client in clients:
+                client.start_measure()
+            await asyncio.sleep(options.duration)
+            cpu = _get_cpu_time(proc) - cpu
+
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.sleep(1)  # Let the server close the connections
+        finally:
+            server.terminate()
+            server.join(5)
+            await runner.cleanup()
+
+    _print_report(options, clients, cpu)
+
+
+def _print_report(options: argparse.Namespace, clients: list[_RfbLoadClient], cpu: float) -> None:
+    fps = [client.stats.frames / options.duration for client in clients]
+    latencies = sorted(lat * 1000 for client in clients for lat in client.stats.latencies)
+    traffic = sum(client.stats.bytes for client in clients) / options.duration
+    print(f"Clients:      {len(clients)} x {options.encoding}, source {options.fps} fps, {options.duration}s")
+    print(f"Client fps:   min={min(fps):.1f} avg={statistics.mean(fps):.1f} max={max(fps):.1f}")
+    if latencies:
+        print(f"Latency, ms:  p50={_percentile(latencies, 50):.1f} p90={_percentile(latencies, 90):.1f}"
+              f" p99={_percentile(latencies, 99):.1f} max={latencies[-1]:.1f}")
+    else:
+        print("Latency, ms:  n/a (no intact stamped frames)")
+    print(f"Traffic:      {traffic / 1024 / 1024:.2f} MiB/s")
+    print(f"Server CPU:   {cpu / options.duration * 100:.1f}% of one core")
+    for (index, client) in enumerate(clients):
+        if client.stats.error:
+            print(f"Client {index}: {client.stats.error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Synthetic RFB load for kvmd-vnc")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--encoding", choices=["tight", "h264", "zrle", "raw"], default="tight")
+    parser.add_argument("--no-cont-updates", action="store_true")
+    parser.add_argument("--frames", default="", help="Directory with *.jpg or *.h264 frames")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--port", type=int, default=15900)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--tiles", action="store_true")
+    parser.add_argument("--no-congestion", action="store_true")
+    parser.add_argument("--metrics", default="", help="Write the server metrics with frame latencies to this file")
+    parser.add_argument("--keymap", default=os.path.join(os.path.dirname(__file__), "../../contrib/keymaps/en-us"))
+    options = parser.parse_args(sys.argv[1:])
+    asyncio.run(_bench(options))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+# Measures the cost of HttpServer._broadcast_ws_event() against the number of websocket clients.
+# The server runs in a child process and broadcasts a synthetic GPIO-like state event,
+# the clients are websocket connections in this process. The legacy mode serializes
+# the event with json.dumps() for each session, as the broadcast did before.
+# Other modes are websocket encodings (json, msgpack, cbor) negotiated by the clients.
+#
+# Usage: PYTHONPATH=. python testenv/benchmarks/ws_broadcast.py [clients,...] [channels] [rate] [duration] [legacy|encoding]
+
+
+import sys
+import os
+import asyncio
+import multiprocessing
+import tempfile
+import json
+import time
+
+import aiohttp
+import psutil
+
+from aiohttp.web import Request
+from aiohttp.web import WebSocketResponse
+
+from kvmd import aiotools
+
+from kvmd.htserver import exposed_http
+from kvmd.htserver import HttpServer
+
+
+# =====
+class _BroadcastServer(HttpServer):
+    def __init__(self, channels: int, rate: int, legacy: bool) -> None:
+        super().__init__()
+        self.__channels = channels
+        self.__rate = rate
+        self.__legacy = legacy
+
+    @exposed_http("GET", "/ws")
+    async def __ws_handler(self, req: Request) -> WebSocketResponse:
+        async with self._ws_session(req, encoding=req.query.get("encoding", "json")) as ws:
+            return (await self._ws_loop(ws))
+
+    async def _init_app(self) -> None:
+        aiotools.create_deadly_task("Broadcaster", self.__broadcaster())
+        self._add_exposed(self)
+
+    async def _on_shutdown(self) -> None:
+        await aiotools.stop_all_deadly_tasks()
+        await self._close_all_wss()
+
+    async def __broadcaster(self) -> None:
+        count = 0
+        while True:
+            count += 1
+            event = {
+                "state": {
+                    "inputs": {
+                        f"input{ch}": {"online": True, "state": bool((count + ch) % 2)}
+                        for ch in range(self.__channels)
+                    },
+                    "outputs": {
+                        f"output{ch}": {"online": True, "state": bool((count + ch) % 3), "busy": False}
+                        for ch in range(self.__channels)
+                    },
+                },
+            }
+            if self.__legacy:
+                await asyncio.gather(*[
+                    ws.wsr.send_str(json.dumps({"event_type": "gpio", "event": event}))
+                    for ws in self._get_wss()
+                    if ws.is_alive()
+                ], return_exceptions=True)
+            else:
+                await self._broadcast_ws_event("gpio", event)
+            await asyncio.sleep(1 / self.__rate)
+
+
+def _run_server(unix_path: str, channels: int, rate: int, legacy: bool) -> None:
+    _BroadcastServer(channels, rate, legacy).run(
+        unix_path=unix_path,
+        unix_rm=True,
+        unix_mode=0,
+        heartbeat=15.0,
+        access_log_format="",
+    )
+
+
+async def _client(unix_path: str, encoding: str, counter: list[int]) -> None:
+    async with aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=unix_path)) as session:
+        async with session.ws_connect(f"http://localhost/ws?encoding={encoding}", max_msg_size=0) as ws:
+            async for msg in ws:
+                if msg.type in [aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY]:
+                    counter[0] += 1
+                    counter[1] += len(msg.data)
+
+
+async def _start_clients(unix_path: str, clients: int, encoding: str, counter: list[int]) -> list[asyncio.Task]:
+    tasks = [asyncio.create_task(_client(unix_path, encoding, counter)) for _ in range(clients)]
+    await asyncio.sleep(2)  # Connect
+    return tasks
+
+
+async def _measure(unix_path: str, pid: int, clients: int, duration: float, encoding: str) -> tuple[float, float, int, int]:
+    counter = [0, 0]
+    tasks = await _start_clients(unix_path, clients, encoding, counter)
+    proc = psutil.Process(pid)
+    times = proc.cpu_times()
+    cpu = times.user + times.system
+    counter[0] = counter[1] = 0
+    started = time.monotonic()
+    await asyncio.sleep(duration)
+    times = proc.cpu_times()
+    cpu = times.user + times.system - cpu
+    duration = time.monotonic() - started
+    (events, size) = counter
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(1)  # Let the server drop the clients
+    return (duration, cpu, events, size)
+
+
+def _print_result(clients: int, duration: float, cpu: float, events: int, size: int) -> None:
+    per_event = (cpu / events * 1000000 if events else 0.0)
+    event_size = (size // events if events else 0)
+    print(
+        f"{clients:>4} clients: {events / duration / clients:6.1f} events/s per client,"
+        f" server cpu={cpu / duration * 100:5.1f}%, {per_event:6.1f} us per client-event,"
+        f" {event_size} bytes per event"
+    )
+
+
+async def _bench(clients_list: list[int], channels: int, rate: int, duration: float, mode: str) -> None:
+    legacy = (mode == "legacy")
+    encoding = ("json" if legacy else mode)
+    with tempfile.TemporaryDirectory() as tmp_path:
+        unix_path = os.path.join(tmp_path, "kvmd.sock")
+        # Spawn, not fork: the child must not inherit the running event loop
+        server = multiprocessing.get_context("spawn").Process(target=_run_server, args=(unix_path, channels, rate, legacy))
+        server.start()
+        try:
+            await asyncio.sleep(2)  # Server startup
+            assert server.pid is not None
+            for clients in clients_list:
+                _print_result(clients, *(await _measure(unix_path, server.pid, clients, duration, encoding)))
+        finally:
+            server.terminate()
+            server.join(5)
+
+
+def main() -> None:
+    clients_list = list(map(int, (sys.argv[1] if len(sys.argv) > 1 else "1,10,50,100").split(",")))
+    channels = (int(sys.argv[2]) if len(sys.argv) > 2 else 32)
+    rate = (int(sys.argv[3]) if len(sys.argv) > 3 else 50)
+    duration = (float(sys.argv[4]) if len(sys.argv) > 4 else 5.0)
+    mode = (sys.argv[5] if len(sys.argv) > 5 else "json")
+    asyncio.run(_bench(clients_list, channels, rate, duration, mode))
+
+
+if __name__ == "__main__":
+    main()
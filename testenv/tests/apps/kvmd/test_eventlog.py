@@ -0,0 +1,61 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import asyncio
+import json
+
+import pytest
+
+from kvmd.apps.kvmd.eventlog import EventLog
+
+
+# =====
+def test_ok__event_log() -> None:
+    log = EventLog(3)
+    assert log.get_since(0) == []
+    for index in range(1, 5):
+        log.append("test", {"index": index})
+    assert log.get_seq() == 4
+
+    events = log.get_since(2)
+    assert events is not None
+    assert [item.seq for item in events] == [3, 4]
+    assert json.loads(events[0].get_msg()) == {"event_type": "test", "event": {"index": 3}}
+    assert events[0].get_msg() is events[0].get_msg()
+    assert log.get_since(4) == []
+    assert log.get_since(0) is None  # Evicted
+
+    assert log.find_seq(log.make_id(1)) == 1
+    assert log.find_seq(log.make_id(4)) == 4
+    for event_id in [log.make_id(0), log.make_id(5), "", "xxx", "xxx-1", log.make_id(1) + "x"]:
+        assert log.find_seq(event_id) is None
+
+
+@pytest.mark.asyncio
+async def test_ok__event_log__wait() -> None:
+    log = EventLog(3)
+    assert not (await log.wait(0, 0.01))
+    waiter = asyncio.create_task(log.wait(0, 1))
+    await asyncio.sleep(0.01)
+    log.append("test", None)
+    assert (await waiter)
+    assert (await log.wait(0, 0.01))
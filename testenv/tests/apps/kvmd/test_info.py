@@ -0,0 +1,93 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import os
+import asyncio
+
+from typing import AsyncGenerator
+from typing import Any
+
+import pytest
+
+from kvmd.yamlconf import make_config
+
+from kvmd.apps import _get_config_scheme
+from kvmd.apps.kvmd import info
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__info_pollers_pause(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    polls: dict[str, int] = {}
+
+    async def poll_state(self: object) -> AsyncGenerator[dict, None]:
+        name = type(self).__name__
+        while True:
+            polls[name] = polls.get(name, 0) + 1
+            yield {"polls": polls[name]}
+            await asyncio.sleep(0.01)
+
+    for cls in [
+        info.SystemInfoSubmanager,
+        info.AuthInfoSubmanager,
+        info.MetaInfoSubmanager,
+        info.ExtrasInfoSubmanager,
+        info.HealthInfoSubmanager,
+        info.FanInfoSubmanager,
+    ]:
+        monkeypatch.setattr(cls, "poll_state", poll_state)
+
+    for name in ["meta.yaml", "platform"]:
+        with open(os.path.join(tmp_path, name), "w"):
+            pass
+    scheme = _get_config_scheme()
+    config = make_config({
+        "kvmd": {
+            "info": {
+                "meta": os.path.join(tmp_path, "meta.yaml"),
+                "extras": str(tmp_path),
+                "hw": {"platform": os.path.join(tmp_path, "platform"), "vcgencmd_cmd": ["/bin/true"]},
+            },
+            "streamer": {"cmd": ["/bin/true"]},
+        },
+    }, {"kvmd": {key: scheme["kvmd"][key] for key in ["info", "streamer", "auth"]}})
+
+    manager = info.InfoManager(config)
+    systask = asyncio.create_task(manager.systask())
+    changes = manager.poll_state()
+    try:
+        assert set(await anext(changes)) <= manager.get_subs()
+
+        # Nobody takes the changes: the submanagers stop on their next yield
+        await asyncio.sleep(0.1)
+        paused = dict(polls)
+        await asyncio.sleep(0.1)
+        assert polls == paused
+        assert all(count <= 2 for count in paused.values())
+
+        await anext(changes)
+        await asyncio.sleep(0.1)
+        assert all(polls[name] > count for (name, count) in paused.items())
+    finally:
+        await changes.aclose()
+        systask.cancel()
+        await asyncio.gather(systask, return_exceptions=True)
@@ -0,0 +1,161 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import os
+import asyncio
+import contextlib
+
+from typing import Callable
+from typing import Awaitable
+from typing import AsyncGenerator
+
+import pytest
+
+from kvmd import aiotools
+
+from kvmd.clients.streamer import StreamerFormats
+from kvmd.clients.streamer import BaseStreamerClient
+
+from kvmd.apps.kvmd.recorder import RecorderDisabledError
+from kvmd.apps.kvmd.recorder import RecorderIsBusyError
+from kvmd.apps.kvmd.recorder import RecorderNotRecordingError
+from kvmd.apps.kvmd.recorder import Recorder
+
+
+# =====
+class _FakeStreamer(BaseStreamerClient):
+    def __init__(self) -> None:
+        self.key_requests: list[bool] = []
+
+    def get_format(self) -> int:
+        return StreamerFormats.H264
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        count = 0
+
+        async def read_frame(key_required: bool) -> dict:
+            nonlocal count
+            await asyncio.sleep(0.001)
+            count += 1
+            key = (count % 5 == 0)
+            self.key_requests.append(key_required)
+            return {"key": key, "data": (b"K" if key else b"P") * 100}
+
+        yield read_frame
+
+
+def _make_recorder(streamer: (BaseStreamerClient | None), path: str, **kwargs: int) -> Recorder:
+    return Recorder(
+        streamer=streamer,
+        storage_path=path,
+        segment_time=60.0,
+        segment_size=kwargs.get("segment_size", 1000),
+        retention_time=0.0,
+        retention_size=kwargs.get("retention_size", 0),
+        buffer_size=1024 * 1024,
+    )
+
+
+async def _record(recorder: Recorder, duration: float) -> None:
+    notifier = aiotools.AioNotifier()
+    task = asyncio.create_task(recorder.run(notifier))
+    try:
+        await recorder.start()
+        await asyncio.sleep(duration)
+        assert recorder.recording()
+        assert (await recorder.get_state())["segment"]
+        await recorder.stop()
+        for _ in range(100):
+            if not recorder.recording():
+                break
+            await asyncio.sleep(0.01)
+        assert not recorder.recording()
+        assert (await notifier.wait()) == 0  # The stream controller was notified
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__recorder__segments(tmpdir) -> None:  # type: ignore
+    path = os.path.join(tmpdir, "rec")
+    streamer = _FakeStreamer()
+    await _record(_make_recorder(streamer, path), 0.5)
+
+    names = sorted(os.listdir(path))
+    assert len(names) > 1
+    assert streamer.key_requests[0]  # The first segment asks the encoder for a keyframe
+    requests = sum(
+        1 for (prev, cur) in zip([False] + streamer.key_requests, streamer.key_requests)
+        if cur and not prev
+    )
+    assert requests >= len(names)  # And so does every rotation
+    assert all(name.endswith(".h264") for name in names)  # No .part files after stop
+    for name in names:
+        with open(os.path.join(path, name), "rb") as file:
+            data = file.read()
+        assert data.startswith(b"K" * 100)  # Each segment starts from a keyframe
+        assert len(data) % 100 == 0
+    for name in names[:-1]:
+        assert os.path.getsize(os.path.join(path, name)) >= 1000
+
+
+@pytest.mark.asyncio
+async def test_ok__recorder__retention(tmpdir) -> None:  # type: ignore
+    path = os.path.join(tmpdir, "rec")
+    await _record(_make_recorder(_FakeStreamer(), path, segment_size=500, retention_size=2000), 0.5)
+    total = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    assert total <= 2000
+
+
+@pytest.mark.asyncio
+async def test_fail__recorder__control(tmpdir) -> None:  # type: ignore
+    with pytest.raises(RecorderDisabledError):
+        await _make_recorder(None, str(tmpdir)).start()
+
+    recorder = _make_recorder(_FakeStreamer(), str(tmpdir))
+    with pytest.raises(RecorderNotRecordingError):
+        await recorder.stop()
+    await recorder.start()
+    with pytest.raises(RecorderIsBusyError):
+        await recorder.start()
+
+
+@pytest.mark.asyncio
+async def test_ok__recorder__dropped(tmpdir, monkeypatch: pytest.MonkeyPatch) -> None:  # type: ignore
+    monkeypatch.setattr("kvmd.apps.kvmd.recorder._SegmentWriter.write", (lambda *_: False))  # The disk is too slow
+    recorder = _make_recorder(_FakeStreamer(), str(tmpdir))
+    states = recorder.poll_state()
+    task = asyncio.create_task(recorder.run(aiotools.AioNotifier()))
+    try:
+        await recorder.start()
+        dropped: list[int] = []
+        while len(dropped) < 3:
+            state = await asyncio.wait_for(anext(states), 1)
+            if state["dropped"] not in [0, *dropped]:
+                dropped.append(state["dropped"])
+        assert dropped == sorted(dropped)  # Every drop is reported, not only on the next segment
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,360 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import os
+import json
+import asyncio
+import contextlib
+
+from typing import AsyncGenerator
+from typing import Any
+
+import aiohttp
+import aiohttp.web
+import pytest
+
+from kvmd import aiotools
+
+from kvmd.htserver import HttpExposed
+
+from kvmd.plugins.atx.disabled import Plugin as AtxDisabled
+from kvmd.plugins.msd.disabled import Plugin as MsdDisabled
+
+from kvmd.apps.kvmd.server import KvmdServer
+
+
+# =====
+class _FakeSubsystem:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.notifier = aiotools.AioCoalescingNotifier()
+        self.get_state_calls = 0
+        self.get_state_delay = 0.0
+        self.get_state_errors = 0
+        self.polls = 0
+
+    async def get_state(self) -> dict:
+        self.get_state_calls += 1
+        polls = self.polls
+        await asyncio.sleep(self.get_state_delay)
+        if self.get_state_errors > 0:
+            self.get_state_errors -= 1
+            raise RuntimeError("Test error")
+        return {"name": self.name, "polls": polls}
+
+    async def poll_state(self) -> AsyncGenerator[dict, None]:
+        while True:
+            await self.notifier.wait()
+            self.polls += 1
+            yield {"polls": self.polls}
+
+
+class _FakeHid(_FakeSubsystem):
+    def clear_events(self) -> None:
+        pass
+
+
+class _FakeStreamer(_FakeSubsystem):
+    async def ensure_start(self, **_: Any) -> None:
+        pass
+
+    async def ensure_stop(self, **_: Any) -> None:
+        pass
+
+    def is_working(self) -> bool:
+        return False
+
+
+class _FakeSnapshoter:
+    def snapshoting(self) -> bool:
+        return False
+
+    async def run(self, **_: Any) -> None:
+        await aiotools.wait_infinite()
+
+
+class _FakeRecorder(_FakeSubsystem):
+    def recording(self) -> bool:
+        return False
+
+    async def run(self, *_: Any) -> None:
+        await aiotools.wait_infinite()
+
+
+class _Server(KvmdServer):
+    async def _check_request_auth(self, exposed: HttpExposed, req: aiohttp.web.Request) -> None:
+        pass
+
+
+_ALL_TOPICS = {"gpio", "hid", "hid_keymaps", "atx", "msd", "streamer", "ocr", "info", "switch", "recorder"}
+
+
+@contextlib.asynccontextmanager
+async def _run_server(
+    tmp_path: Any,
+    event_log_size: int=16,
+    heartbeat: float=15.0,
+) -> AsyncGenerator[tuple[_Server, dict[str, _FakeSubsystem], aiohttp.ClientSession], None]:
+
+    keymap_path = os.path.join(tmp_path, "keymaps", "en-us")
+    os.mkdir(os.path.dirname(keymap_path))
+    with open(keymap_path, "w") as file:
+        file.write("# Empty keymap\n")
+
+    subs = {
+        "gpio":     _FakeSubsystem("gpio"),
+        "hid":      _FakeHid("hid"),
+        "streamer": _FakeStreamer("streamer"),
+        "ocr":      _FakeSubsystem("ocr"),
+        "info":     _FakeSubsystem("info"),
+        "switch":   _FakeSubsystem("switch"),
+        "recorder": _FakeRecorder("recorder"),
+    }
+    server = _Server(
+        auth_manager=None,  # type: ignore
+        info_manager=subs["info"],  # type: ignore
+        log_reader=None,
+        user_gpio=subs["gpio"],  # type: ignore
+        ocr=subs["ocr"],  # type: ignore
+        switch=subs["switch"],  # type: ignore
+        hid=subs["hid"],  # type: ignore
+        atx=AtxDisabled(),
+        msd=MsdDisabled(),
+        streamer=subs["streamer"],  # type: ignore
+        snapshoter=_FakeSnapshoter(),  # type: ignore
+        recorder=subs["recorder"],  # type: ignore
+        keymap_path=keymap_path,
+        stream_forever=False,
+        event_log_size=event_log_size,
+        vnc_metrics_path=os.path.join(tmp_path, "vnc.prom"),
+    )
+
+    unix_path = os.path.join(tmp_path, "server.sock")
+    app = await server.make_app(heartbeat=heartbeat)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    await aiohttp.web.UnixSite(runner, unix_path).start()
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=unix_path)) as session:
+            yield (server, subs, session)
+    finally:
+        await runner.cleanup()
+
+
+async def _receive_events(ws: aiohttp.ClientWebSocketResponse, count: int) -> list[dict]:
+    return [(await ws.receive_json(timeout=1)) for _ in range(count)]
+
+
+async def _assert_no_events(ws: aiohttp.ClientWebSocketResponse) -> None:
+    with pytest.raises(asyncio.TimeoutError):
+        await ws.receive_json(timeout=0.2)
+
+
+async def _read_sse(resp: aiohttp.ClientResponse, count: int, timeout: float=1) -> list[dict]:
+    async def read() -> list[dict]:
+        events: list[dict] = []
+        fields: dict = {}
+        while len(events) < count:
+            line = await resp.content.readline()
+            assert line, "Unexpected EOF"
+            if line != b"\n":
+                (name, _, value) = line.decode().rstrip("\n").partition(": ")
+                fields[name] = (json.loads(value) if name == "data" else value)
+            else:
+                if fields != {"": "ping"}:
+                    events.append(fields)
+                fields = {}
+        return events
+    return (await asyncio.wait_for(read(), timeout))
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__initial_state__shared(tmp_path: Any) -> None:
+    async with _run_server(tmp_path) as (_, subs, session):
+        subs["gpio"].get_state_delay = 0.1
+        wss = await asyncio.gather(*[
+            session.ws_connect("http://localhost/ws?topics=gpio")
+            for _ in range(5)
+        ])
+        for ws in wss:
+            assert (await _receive_events(ws, 2))[1] == {"event_type": "gpio", "event": {"name": "gpio", "polls": 0}}
+        assert subs["gpio"].get_state_calls == 1  # One call for all of the concurrent clients
+
+        ws = await session.ws_connect("http://localhost/ws?topics=gpio")
+        await _receive_events(ws, 2)
+        assert subs["gpio"].get_state_calls == 1  # Cached until the next change
+
+        subs["gpio"].notifier.notify()
+        for ws in [*wss, ws]:
+            assert (await _receive_events(ws, 1)) == [{"event_type": "gpio", "event": {"polls": 1}}]
+        ws = await session.ws_connect("http://localhost/ws?topics=gpio")
+        assert (await _receive_events(ws, 2))[1] == {"event_type": "gpio", "event": {"name": "gpio", "polls": 1}}
+        assert subs["gpio"].get_state_calls == 2
+
+
+@pytest.mark.asyncio
+async def test_ok__initial_state__retries(tmp_path: Any, caplog: pytest.LogCaptureFixture) -> None:
+    async with _run_server(tmp_path) as (_, subs, session):
+        subs["gpio"].get_state_errors = 2
+        ws = await session.ws_connect("http://localhost/ws?topics=gpio")
+        assert (await _receive_events(ws, 2))[1] == {"event_type": "gpio", "event": {"name": "gpio", "polls": 0}}
+        assert subs["gpio"].get_state_calls == 3
+        assert "Can't get the initial state" not in caplog.text
+
+        subs["gpio"].notifier.notify()  # Drops the cache
+        await _receive_events(ws, 1)
+        subs["gpio"].get_state_errors = 3
+        ws = await session.ws_connect("http://localhost/ws?topics=gpio,atx")
+        events = await _receive_events(ws, 2)
+        assert [event["event_type"] for event in events] == ["loop", "atx"]  # No gpio, the rest is fine
+        await _assert_no_events(ws)
+        assert subs["gpio"].get_state_calls == 6
+        assert "Can't get the initial state of User-GPIO" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_ok__initial_state__only_for_new_client(tmp_path: Any) -> None:
+    async with _run_server(tmp_path) as (_, _, session):
+        ws = await session.ws_connect("http://localhost/ws")
+        await _receive_events(ws, len(_ALL_TOPICS) + 1)
+        new_ws = await session.ws_connect("http://localhost/ws")
+        assert len(await _receive_events(new_ws, len(_ALL_TOPICS) + 1)) == len(_ALL_TOPICS) + 1
+        await _assert_no_events(ws)  # Nothing is re-broadcasted to the old client
+
+
+@pytest.mark.asyncio
+async def test_ok__ws_subscribe(tmp_path: Any) -> None:
+    async with _run_server(tmp_path) as (_, subs, session):
+        ws = await session.ws_connect("http://localhost/ws?topics=gpio")
+        assert (await _receive_events(ws, 2))[1] == {"event_type": "gpio", "event": {"name": "gpio", "polls": 0}}
+
+        await ws.send_json({"event_type": "subscribe", "event": {"topics": ["gpio", "foobar"]}})  # Ignored
+        await _assert_no_events(ws)
+
+        await ws.send_json({"event_type": "subscribe", "event": {"topics": None}})
+        events = await _receive_events(ws, len(_ALL_TOPICS) - 1)
+        assert {event["event_type"] for event in events} == _ALL_TOPICS - {"gpio"}  # Only the new topics
+        await _assert_no_events(ws)
+
+        await ws.send_json({"event_type": "subscribe", "event": {"topics": ["atx"]}})
+        await _assert_no_events(ws)  # Nothing new
+        subs["gpio"].notifier.notify()
+        await _assert_no_events(ws)
+        await ws.close()
+
+
+@pytest.mark.asyncio
+async def test_ok__poller_pause(tmp_path: Any) -> None:
+    async with _run_server(tmp_path) as (_, subs, session):
+        streamer = subs["streamer"]
+        ws = await session.ws_connect("http://localhost/ws?topics=gpio")
+        await _receive_events(ws, 2)
+
+        for _ in range(10):
+            streamer.notifier.notify()
+            await asyncio.sleep(0.01)
+        assert streamer.polls == 1  # The poller is paused on the first unwanted event
+
+        await ws.send_json({"event_type": "subscribe", "event": {"topics": ["gpio", "streamer"]}})
+        events = await _receive_events(ws, 2)
+        assert {"event_type": "streamer", "event": {"polls": 2}} in events  # Notifications were coalesced
+        assert any(event["event"].get("name") == "streamer" for event in events)
+        await _assert_no_events(ws)
+        assert streamer.polls == 2
+
+        streamer.notifier.notify()
+        assert (await _receive_events(ws, 1)) == [{"event_type": "streamer", "event": {"polls": 3}}]
+        await ws.close()
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__sse_resume(tmp_path: Any) -> None:
+    async with _run_server(tmp_path, heartbeat=0.2) as (_, subs, session):
+        async with session.get("http://localhost/state/stream?topics=gpio,streamer") as resp:
+            events = await _read_sse(resp, 3)
+            assert events[:2] == [  # The full state goes without ids
+                {"data": {"event_type": "gpio", "event": {"name": "gpio", "polls": 0}}},
+                {"data": {"event_type": "streamer", "event": {"name": "streamer", "polls": 0}}},
+            ]
+            epoch = events[2]["id"].rpartition("-")[0]
+            assert events[2] == {"id": f"{epoch}-0"}  # The checkpoint
+
+            subs["gpio"].notifier.notify()
+            assert (await _read_sse(resp, 1)) == [{"id": f"{epoch}-1", "data": {"event_type": "gpio", "event": {"polls": 1}}}]
+
+        subs["gpio"].notifier.notify()
+        subs["streamer"].notifier.notify()
+        await asyncio.sleep(0.1)
+
+        async with session.get("http://localhost/state/stream?topics=gpio,streamer", headers={"Last-Event-ID": f"{epoch}-1"}) as resp:
+            assert (await _read_sse(resp, 2)) == [
+                {"id": f"{epoch}-2", "data": {"event_type": "gpio", "event": {"polls": 2}}},
+                {"id": f"{epoch}-3", "data": {"event_type": "streamer", "event": {"polls": 1}}},
+            ]
+            with pytest.raises(asyncio.TimeoutError):
+                await _read_sse(resp, 1, 0.2)
+
+        async with session.get("http://localhost/state/stream?topics=streamer", headers={"Last-Event-ID": f"{epoch}-2"}) as resp:
+            # Only the subscribed types, the rest just moves the checkpoint
+            assert (await _read_sse(resp, 1)) == [{"id": f"{epoch}-3", "data": {"event_type": "streamer", "event": {"polls": 1}}}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("event_id", ["", "foobar-1", "{epoch}-x", "{epoch}-0", "{epoch}-100"])
+async def test_ok__sse_resume__full_state(tmp_path: Any, event_id: str) -> None:
+    async with _run_server(tmp_path, event_log_size=2, heartbeat=0.2) as (_, subs, session):
+        async with session.get("http://localhost/state/stream?topics=gpio") as resp:
+            epoch = (await _read_sse(resp, 2))[1]["id"].rpartition("-")[0]
+            for _ in range(3):
+                subs["gpio"].notifier.notify()
+                await _read_sse(resp, 1)
+
+        # The event #1 is evicted from the log, the others are not resumable too
+        headers = ({"Last-Event-ID": event_id.format(epoch=epoch)} if event_id else {})
+        async with session.get("http://localhost/state/stream?topics=gpio", headers=headers) as resp:
+            assert (await _read_sse(resp, 2)) == [
+                {"data": {"event_type": "gpio", "event": {"name": "gpio", "polls": 3}}},
+                {"id": f"{epoch}-3"},
+            ]
+
+
+@pytest.mark.asyncio
+async def test_ok__sse_resume__since(tmp_path: Any) -> None:
+    async with _run_server(tmp_path, heartbeat=0.2) as (_, subs, session):
+        subs["gpio"].get_state_delay = 0.2
+        subs["streamer"].get_state_delay = 0.2
+        async with session.get("http://localhost/state/stream?topics=gpio,streamer") as resp:
+            await asyncio.sleep(0.1)
+            subs["streamer"].notifier.notify()  # Before the streamer snapshot: it's already there
+            await asyncio.sleep(0.2)
+            subs["gpio"].notifier.notify()  # After the gpio snapshot: must be sent
+            events = await _read_sse(resp, 3)
+            epoch = events[2]["id"].rpartition("-")[0]
+            assert events == [
+                {"data": {"event_type": "gpio", "event": {"name": "gpio", "polls": 0}}},
+                {"data": {"event_type": "streamer", "event": {"name": "streamer", "polls": 1}}},
+                {"id": f"{epoch}-2", "data": {"event_type": "gpio", "event": {"polls": 1}}},
+            ]
+            with pytest.raises(asyncio.TimeoutError):
+                await _read_sse(resp, 1, 0.2)
@@ -0,0 +1,85 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import time
+
+from kvmd.apps.media.gop import MediaFrame
+from kvmd.apps.media.gop import GopRing
+
+
+# =====
+def _make_frame(key: bool, size: int=10) -> MediaFrame:
+    return MediaFrame(key=key, msg=bytes(size), grab_ts=0.0, recv_ts=0.0)
+
+
+# =====
+def test_ok__gop_ring__key_wait() -> None:
+    gop = GopRing()
+    for _ in range(3):
+        gop.push(_make_frame(False))
+    assert not gop.get_frames()  # P-frames without a keyframe are useless for the new clients
+
+    frames = [_make_frame(True), _make_frame(False), _make_frame(False)]
+    for frame in frames:
+        gop.push(frame)
+    assert gop.get_frames() == frames
+
+    key = _make_frame(True)
+    gop.push(key)
+    assert gop.get_frames() == [key]  # The new GOP replaces the old one
+
+    gop.reset()
+    assert not gop.get_frames()
+
+
+def test_ok__gop_ring__eviction() -> None:
+    gop = GopRing(max_frames=4, max_size=100)
+    for key in [True, False, False, False]:
+        gop.push(_make_frame(key))
+    assert len(gop.get_frames()) == 4
+    gop.push(_make_frame(False))
+    assert not gop.get_frames()  # Too long GOP, the new clients will wait for the next keyframe
+    gop.push(_make_frame(False))
+    assert not gop.get_frames()
+
+    gop.push(_make_frame(True, 60))
+    gop.push(_make_frame(False, 40))
+    assert len(gop.get_frames()) == 2
+    gop.push(_make_frame(False, 1))
+    assert not gop.get_frames()  # Too big GOP
+
+
+def test_ok__gop_ring__key_rate_limit() -> None:
+    gop = GopRing(key_interval=0.2)
+    assert not gop.is_key_required()
+    gop.request_key()
+    assert gop.is_key_required()
+
+    gop.push(_make_frame(True))
+    assert not gop.is_key_required()  # The keyframe is received
+    gop.request_key()
+    assert not gop.is_key_required()  # Too early after the last keyframe
+    time.sleep(0.25)
+    assert gop.is_key_required()
+
+    gop.push(_make_frame(False))
+    assert gop.is_key_required()  # P-frames don't satisfy the request
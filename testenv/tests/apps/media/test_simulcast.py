@@ -0,0 +1,98 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import io
+import contextlib
+import concurrent.futures
+
+from typing import Callable
+from typing import Awaitable
+from typing import AsyncGenerator
+
+import pytest
+
+from PIL import Image as PilImage
+
+from kvmd.clients.streamer import StreamerFormats
+from kvmd.clients.streamer import BaseStreamerClient
+
+from kvmd.apps.media.simulcast import SimulcastVariant
+from kvmd.apps.media.simulcast import SimulcastStreamerClient
+from kvmd.apps.media.simulcast import encode_variant
+
+
+# =====
+def _make_jpeg(width: int, height: int) -> bytes:
+    with io.BytesIO() as bio:
+        PilImage.new("RGB", (width, height), (255, 0, 0)).save(bio, format="jpeg", quality=95)
+        return bio.getvalue()
+
+
+class _FakeStreamerClient(BaseStreamerClient):
+    def get_format(self) -> int:
+        return StreamerFormats.JPEG
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        async def read_frame(key_required: bool) -> dict:
+            _ = key_required
+            return {
+                "online": True,
+                "width": 1920,
+                "height": 1080,
+                "key": True,
+                "format": StreamerFormats.JPEG,
+                "data": _make_jpeg(1920, 1080),
+                "grab_ts": 1.0,
+                "recv_ts": 2.0,
+            }
+        yield read_frame
+
+
+# =====
+def test_ok__variant_from_string() -> None:
+    assert SimulcastVariant.from_string("640x360:60") == SimulcastVariant("640x360:60", 640, 360, 60)
+
+
+@pytest.mark.parametrize("variant, size", [
+    ("640x360:60", (640, 360)),
+    ("320x320:50", (320, 180)),
+    ("4000x4000:80", (1920, 1080)),
+])
+def test_ok__encode_variant(variant: str, size: tuple[int, int]) -> None:
+    (data, width, height) = encode_variant(_make_jpeg(1920, 1080), SimulcastVariant.from_string(variant))
+    assert (width, height) == size
+    with PilImage.open(io.BytesIO(data)) as image:
+        assert image.size == size
+
+
+@pytest.mark.asyncio
+async def test_ok__simulcast_streamer() -> None:
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        streamer = SimulcastStreamerClient(_FakeStreamerClient(), SimulcastVariant.from_string("480x270:50"), executor)
+        assert streamer.get_format() == StreamerFormats.JPEG
+        async with streamer.reading() as read_frame:
+            frame = await read_frame(False)
+    assert (frame["width"], frame["height"]) == (480, 270)
+    assert (frame["grab_ts"], frame["recv_ts"]) == (1.0, 2.0)
+    with PilImage.open(io.BytesIO(frame["data"])) as image:
+        assert image.size == (480, 270)
@@ -0,0 +1,65 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import time
+
+import pytest
+
+from kvmd.apps.vnc.congestion import CongestionController
+
+
+# =====
+def test_ok__congestion__disabled() -> None:
+    cc = CongestionController(enabled=False, max_fps=30, min_fps=5, min_quality=30, high_water=1000)
+    assert not cc.update(100000, 10.0)
+    assert cc.get_state() == (30, 0)
+    assert cc.get_delay() == 0.0
+    assert cc.get_jpeg_params(80) == (80, 1.0)
+
+
+def test_ok__congestion__degrade_and_recover() -> None:
+    cc = CongestionController(enabled=True, max_fps=30, min_fps=5, min_quality=30, high_water=1000)
+    assert cc.update(2000, 0.0)
+    assert cc.get_state() == (15, 1)
+    assert cc.get_jpeg_params(80) == (65, 1.0)
+    assert cc.get_delay() > 0
+
+    assert not cc.update(2000, 0.0)  # Not more often than once per second
+    assert cc.get_state() == (15, 1)
+
+    for _ in range(14):
+        assert not cc.update(0, 0.0)
+    assert cc.update(0, 0.0)
+    assert cc.get_state() == (18, 0)
+    assert cc.get_jpeg_params(80) == (80, 1.0)
+
+
+def test_ok__congestion__quality_floor(monkeypatch: pytest.MonkeyPatch) -> None:
+    cc = CongestionController(enabled=True, max_fps=30, min_fps=5, min_quality=30, high_water=1000)
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", (lambda: now[0]))
+    for _ in range(4):
+        now[0] += 1
+        cc.update(2000, 0.0)
+    assert cc.get_state() == (5, 4)
+    assert cc.get_jpeg_params(80) == (30, 0.5)
+    assert cc.get_jpeg_params(20) == (20, 0.5)
@@ -0,0 +1,139 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import asyncio
+import contextlib
+
+from typing import Callable
+from typing import Awaitable
+from typing import AsyncGenerator
+
+import pytest
+
+from kvmd.clients.streamer import StreamerFormats
+from kvmd.clients.streamer import BaseStreamerClient
+
+from kvmd.apps.vnc.hub import StreamerHub
+
+
+# =====
+class _FakeStreamer(BaseStreamerClient):
+    def __init__(self, fmt: int, key_every: int=0) -> None:
+        self.__fmt = fmt
+        self.__key_every = key_every
+        self.opened = 0
+        self.closed = 0
+        self.count = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    def get_format(self) -> int:
+        return self.__fmt
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> AsyncGenerator[Callable[[bool], Awaitable[dict]], None]:
+        self.opened += 1
+        try:
+            yield self.__read_frame
+        finally:
+            self.closed += 1
+
+    async def __read_frame(self, key_required: bool) -> dict:
+        await self.gate.wait()
+        await asyncio.sleep(0)
+        self.count += 1
+        return {
+            "key": (key_required or (self.__key_every > 0 and self.count % self.__key_every == 0)),
+            "number": self.count,
+        }
+
+
+async def _wait_for(check: Callable[[], bool]) -> None:
+    for _ in range(100):
+        if check():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__hub__shared_reader() -> None:
+    streamer = _FakeStreamer(StreamerFormats.JPEG)
+    hub = StreamerHub(streamer)
+    async with hub.reading() as read_frame_1:
+        async with hub.reading() as read_frame_2:
+            numbers_1 = [(await read_frame_1(False))["number"] for _ in range(5)]
+            numbers_2 = [(await read_frame_2(False))["number"] for _ in range(5)]
+        assert streamer.opened == 1
+        assert numbers_1 == list(range(numbers_1[0], numbers_1[0] + 5))
+        assert numbers_2 == list(range(numbers_2[0], numbers_2[0] + 5))
+        await read_frame_1(False)  # The second subscriber is gone, the reader is still alive
+        assert streamer.closed == 0
+
+
+@pytest.mark.asyncio
+async def test_ok__hub__stop_and_restart() -> None:
+    streamer = _FakeStreamer(StreamerFormats.JPEG)
+    hub = StreamerHub(streamer)
+    async with hub.reading() as read_frame:
+        await read_frame(False)
+    await _wait_for(lambda: streamer.closed == 1)
+    count = streamer.count
+    await asyncio.sleep(0.05)
+    assert streamer.count == count  # Nobody reads the stream
+
+    async with hub.reading() as read_frame:
+        await read_frame(False)
+    assert streamer.opened == 2
+
+
+@pytest.mark.asyncio
+async def test_ok__hub__jpeg_drop_oldest() -> None:
+    streamer = _FakeStreamer(StreamerFormats.JPEG)
+    hub = StreamerHub(streamer)
+    async with hub.reading() as read_frame_slow:
+        async with hub.reading() as read_frame_fast:
+            for _ in range(40):
+                await read_frame_fast(False)
+            streamer.gate.clear()
+            await asyncio.sleep(0.01)
+            last = streamer.count
+            numbers = [(await read_frame_slow(False))["number"] for _ in range(16)]
+    assert numbers == list(range(last - 15, last + 1))  # Only the newest frames are kept
+
+
+@pytest.mark.asyncio
+async def test_ok__hub__h264_drop_until_key() -> None:
+    streamer = _FakeStreamer(StreamerFormats.H264, key_every=50)
+    hub = StreamerHub(streamer)
+    async with hub.reading() as read_frame_slow:
+        async with hub.reading() as read_frame_fast:
+            assert (await read_frame_slow(False))["key"]  # New subscribers start from a keyframe
+            for _ in range(40):
+                await read_frame_fast(False)  # Overflows the slow subscriber queue
+            streamer.gate.clear()
+            await asyncio.sleep(0.01)
+            streamer.gate.set()
+            frame = await read_frame_slow(False)
+    assert frame["key"]
+    assert frame["number"] > 17
@@ -0,0 +1,142 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import zlib
+
+import numpy
+import pytest
+
+from kvmd.apps.vnc.rfb.errors import RfbError
+from kvmd.apps.vnc.rfb.pixels import RfbPixelFormat
+from kvmd.apps.vnc.rfb.pixels import RfbRawEncoder
+from kvmd.apps.vnc.rfb.pixels import RfbZrleEncoder
+from kvmd.apps.vnc.rfb.pixels import RfbTightEncoder
+from kvmd.apps.vnc.rfb.pixels import make_tight_length
+from kvmd.apps.vnc.rfb.pixels import make_tight_jpeg_header
+
+
+# =====
+_RGB888 = RfbPixelFormat(32, 24, False, True, 255, 255, 255, 16, 8, 0)
+_RGB565 = RfbPixelFormat(16, 16, True, True, 31, 63, 31, 11, 5, 0)
+
+
+def _make_rgb() -> numpy.ndarray:
+    rgb = numpy.zeros((70, 100, 3), dtype=numpy.uint8)
+    rgb[:, :, 0] = 0x12
+    rgb[10:20, 80:90] = (0xFF, 0x80, 0x01)
+    return rgb
+
+
+# =====
+def test_ok__pixel_format() -> None:
+    rgb = numpy.array([[(0xFF, 0x80, 0x01)]], dtype=numpy.uint8)
+    assert _RGB888.make_pixels(rgb).tobytes() == b"\x01\x80\xFF\x00"
+    assert _RGB888.make_cpixels(rgb).tobytes() == b"\x01\x80\xFF"
+    assert _RGB888.make_tpixels(rgb).tobytes() == b"\xFF\x80\x01"
+    value = (31 << 11) | (32 << 5) | 0
+    assert _RGB565.make_pixels(rgb).tobytes() == value.to_bytes(2, "big")
+    assert _RGB565.make_tpixels(rgb).tobytes() == value.to_bytes(2, "big")
+
+
+def test_fail__pixel_format() -> None:
+    with pytest.raises(RfbError):
+        RfbPixelFormat(24, 24, False, True, 255, 255, 255, 16, 8, 0)
+    with pytest.raises(RfbError):
+        RfbPixelFormat(8, 8, False, False, 0, 0, 0, 0, 0, 0)
+
+
+@pytest.mark.parametrize("length", [0, 127, 128, 16383, 16384, 4194303])
+def test_ok__make_tight_length(length: int) -> None:
+    data = make_tight_length(length)
+    value = 0
+    for (index, byte) in enumerate(data):
+        value |= (byte & (0xFF if index == 2 else 0x7F)) << (7 * index)
+    assert value == length
+
+
+def test_ok__raw_encoder() -> None:
+    rects = RfbRawEncoder().encode(_RGB888, _make_rgb(), [(80, 10, 10, 10)])
+    assert rects == [(80, 10, 10, 10, b"\x01\x80\xFF\x00" * 100)]
+
+
+def test_ok__zrle_encoder() -> None:
+    rgb = _make_rgb()
+    encoder = RfbZrleEncoder(1)
+    unzlib = zlib.decompressobj()
+    for _ in range(2):  # The zlib stream is persistent
+        rects = encoder.encode(_RGB888, rgb, [(0, 0, 100, 70)])
+        assert len(rects) == 1
+        (x, y, width, height, data) = rects[0]
+        assert (x, y, width, height) == (0, 0, 100, 70)
+        assert int.from_bytes(data[:4], "big") == len(data) - 4
+        tiles = unzlib.decompress(data[4:])
+        # 64x64 tiles: 0,0 is solid, 64,0 is raw, 0,64 and 64,64 are solid
+        assert tiles[:4] == b"\x01\x00\x00\x12"
+        raw = tiles[4:5 + 36 * 64 * 3]
+        assert raw[0] == 0 and len(raw) == 1 + 36 * 64 * 3
+        assert tiles[len(raw) + 4:] == b"\x01\x00\x00\x12" * 2
+
+
+def test_ok__tight_encoder() -> None:
+    rgb = numpy.zeros((100, 3000, 3), dtype=numpy.uint8)
+    rgb[50, 2500] = 0xFF
+    rects = RfbTightEncoder(1).encode(_RGB888, rgb, [(0, 0, 3000, 100)])
+    assert [rect[:4] for rect in rects] == [
+        (0, 0, 2048, 32), (0, 32, 2048, 32), (0, 64, 2048, 32), (0, 96, 2048, 4),
+        (2048, 0, 952, 68), (2048, 68, 952, 32),
+    ]
+    assert rects[0][4] == b"\x80\x00\x00\x00"  # Fill
+    assert rects[4][4][0] == 0  # Basic, stream 0
+    data = rects[4][4][1:]
+    length = (data[0] & 0x7F) | (data[1] & 0x7F) << 7 | (data[2] << 14 if data[1] & 0x80 else 0)
+    offset = (3 if data[1] & 0x80 else 2)
+    assert length == len(data) - offset
+    tpixels = numpy.frombuffer(zlib.decompressobj().decompress(data[offset:]), dtype=numpy.uint8).reshape(68, 952, 3)
+    assert (tpixels == rgb[:68, 2048:]).all()
+
+
+def test_ok__tight_encoder_with_jpeg() -> None:
+    def read_length(data: bytes) -> tuple[int, int]:
+        length = 0
+        for (index, byte) in enumerate(data[:3]):
+            length |= (byte & (0xFF if index == 2 else 0x7F)) << (7 * index)
+            if index == 2 or not byte & 0x80:
+                return (length, index + 1)
+        raise AssertionError("Unterminated length")
+
+    rgb = _make_rgb()
+    encoder = RfbTightEncoder(1)
+    unzlib = zlib.decompressobj()
+    jpeg = make_tight_jpeg_header(4) + b"JPEG"
+    for _ in range(3):  # Basic and JPEG rects are interleaved on the same connection
+        for data in [encoder.encode(_RGB888, rgb, [(75, 5, 20, 20)])[0][4], jpeg]:
+            control = data[0]
+            if control & 0x01:  # The client resets stream 0 as requested
+                unzlib = zlib.decompressobj()
+            (length, offset) = read_length(data[1:])
+            assert length == len(data) - offset - 1
+            if control >> 4 == 0b1001:
+                assert data[offset + 1:] == b"JPEG"
+            else:
+                assert control == 0  # Basic, stream 0
+                tpixels = numpy.frombuffer(unzlib.decompress(data[offset + 1:]), dtype=numpy.uint8).reshape(20, 20, 3)
+                assert (tpixels == rgb[5:25, 75:95]).all()
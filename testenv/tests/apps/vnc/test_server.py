@@ -0,0 +1,43 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import multiprocessing
+
+from kvmd.apps.vnc.server import _WorkersStats
+
+
+# =====
+def test_ok__workers_stats__shared_clients() -> None:
+    stats = _WorkersStats(3)
+    for worker in [1, 2, 2]:
+        proc = multiprocessing.get_context("fork").Process(target=stats.on_connected, args=(worker,))
+        proc.start()
+        proc.join()
+    stats.on_connected(0)
+    assert stats.get_clients() == 4  # The limit is checked against all of the workers
+
+    proc = multiprocessing.get_context("fork").Process(target=stats.on_disconnected, args=(2,))
+    proc.start()
+    proc.join()
+    assert stats.get_clients() == 3
+    assert [item["clients"] for item in stats.get()] == [1, 1, 1]
+    assert [item["connections"] for item in stats.get()] == [1, 1, 2]
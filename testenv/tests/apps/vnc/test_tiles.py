@@ -0,0 +1,45 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import numpy
+
+from kvmd.apps.vnc.tiles import find_dirty_rects
+
+
+# =====
+def test_ok__find_dirty_rects__same() -> None:
+    prev = numpy.zeros((100, 130, 3), dtype=numpy.uint8)
+    assert not find_dirty_rects(prev, prev.copy(), 32)
+
+
+def test_ok__find_dirty_rects__merged_and_clipped() -> None:
+    prev = numpy.zeros((100, 130, 3), dtype=numpy.uint8)
+    cur = prev.copy()
+    cur[5, 5] = 1
+    cur[5, 40] = 1  # Neighbour of the first tile, should be merged
+    cur[70, 64] = (0, 0, 9)
+    cur[99, 129] = 3  # Bottom-right tile is smaller than the others
+    assert find_dirty_rects(prev, cur, 32) == [
+        (0, 0, 64, 32),
+        (64, 64, 32, 32),
+        (128, 96, 2, 4),
+    ]
@@ -0,0 +1,134 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import os
+import asyncio
+import contextlib
+import struct
+import time
+
+from typing import AsyncGenerator
+from typing import Any
+
+import aiohttp.web
+import pytest
+
+from kvmd.clients.kvmd import KvmdClientWs
+
+
+# =====
+@contextlib.asynccontextmanager
+async def _make_client_ws(unix_path: str, move_interval: float) -> AsyncGenerator[tuple[KvmdClientWs, asyncio.Queue], None]:
+    received: "asyncio.Queue[tuple[float, bytes]]" = asyncio.Queue()
+
+    async def ws_handler(request: aiohttp.web.Request) -> aiohttp.web.WebSocketResponse:
+        ws = aiohttp.web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            received.put_nowait((time.monotonic(), msg.data))
+        return ws
+
+    app = aiohttp.web.Application()
+    app.router.add_get("/ws", ws_handler)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    await aiohttp.web.UnixSite(runner, unix_path).start()
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=unix_path)) as session:
+            async with session.ws_connect("http://localhost/ws") as ws:
+                client_ws = KvmdClientWs(ws, move_interval)
+
+                async def communicate() -> None:
+                    async for _ in client_ws.communicate():
+                        pass
+
+                task = asyncio.create_task(communicate())
+                try:
+                    yield (client_ws, received)
+                finally:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+    finally:
+        await runner.cleanup()
+
+
+async def _read(received: asyncio.Queue, count: int) -> list[tuple[float, bytes]]:
+    return [await asyncio.wait_for(received.get(), 1) for _ in range(count)]
+
+
+def _unpack_deltas(data: bytes) -> list[tuple[int, int]]:
+    return [struct.unpack(">bb", data[index:index + 2]) for index in range(2, len(data), 2)]
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__coalesced_moves(tmp_path: Any) -> None:
+    async with _make_client_ws(os.path.join(tmp_path, "kvmd.sock"), 0.2) as (client_ws, received):
+        for pos in range(1, 5):
+            await client_ws.send_mouse_move_event(pos, pos)
+        [(first_ts, first), (last_ts, last)] = await _read(received, 2)
+        assert first == struct.pack(">bhh", 3, 1, 1)  # Nothing was sent recently, so the first move goes at once
+        assert last == struct.pack(">bhh", 3, 4, 4)  # The intermediate moves are replaced by the last one
+        assert last_ts - first_ts >= 0.15
+        assert received.empty()
+
+
+@pytest.mark.asyncio
+async def test_ok__batched_deltas(tmp_path: Any) -> None:
+    async with _make_client_ws(os.path.join(tmp_path, "kvmd.sock"), 10) as (client_ws, received):
+        await client_ws.send_mouse_relative_event(1, -1)
+        await _read(received, 1)  # The first delta is flushed at once, the following ones are waiting
+        deltas = [(index % 7 - 3, index % 5 - 2) for index in range(70)]
+        for delta in deltas:
+            await client_ws.send_mouse_relative_event(*delta)
+        [(_, batch)] = await _read(received, 1)
+        assert batch[:2] == bytes([4, 0])
+        assert _unpack_deltas(batch) == deltas[:64]  # The batch is limited
+        await client_ws.send_key_event("KeyA", True)  # Flush
+        [(_, batch), (_, key)] = await _read(received, 2)
+        assert _unpack_deltas(batch) == deltas[64:]
+        assert key == bytes([1, 1]) + b"KeyA"
+        assert received.empty()
+
+
+@pytest.mark.asyncio
+async def test_ok__pointer_order(tmp_path: Any) -> None:
+    async with _make_client_ws(os.path.join(tmp_path, "kvmd.sock"), 10) as (client_ws, received):
+        await client_ws.send_mouse_move_event(10, 10)
+        await _read(received, 1)
+        await client_ws.send_mouse_wheel_event(0, 1)
+        await client_ws.send_mouse_wheel_event(0, 2)
+        await client_ws.send_mouse_move_event(20, 20)
+        await client_ws.send_mouse_move_event(30, 30)
+        await client_ws.send_mouse_wheel_event(0, -1)
+        await client_ws.send_mouse_relative_event(5, 5)
+        await client_ws.send_mouse_button_event("left", True)
+        await client_ws.send_mouse_button_event("left", False)
+        assert [data for (_, data) in await _read(received, 6)] == [
+            bytes([5, 0, 0, 1, 0, 2]),
+            struct.pack(">bhh", 3, 30, 30),
+            bytes([5, 0, 0, 0xFF]),
+            bytes([4, 0, 5, 5]),
+            bytes([2, 1]) + b"left",
+            bytes([2, 0]) + b"left",
+        ]
+        assert received.empty()
@@ -0,0 +1,210 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2020  Maxim Devaev <mdevaev@gmail.com>                    #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import io
+import os
+import asyncio
+import concurrent.futures
+import threading
+import time
+import types
+
+from typing import Any
+
+import aiohttp.web
+import pytest
+
+from PIL import Image as PilImage
+
+from kvmd.clients import streamer as streamer_module
+from kvmd.clients.streamer import StreamerTempError
+from kvmd.clients.streamer import StreamerPermError
+from kvmd.clients.streamer import StreamerFormats
+from kvmd.clients.streamer import HttpStreamerClient
+from kvmd.clients.streamer import MemsinkStreamerClient
+from kvmd.clients.streamer import StreamerSnapshot
+
+
+# =====
+class _FakeMemsink:
+    opened = 0
+    fail: (Exception | None) = None
+
+    def __init__(self, **_: Any) -> None:
+        self.__count = 0
+
+    def __enter__(self) -> "_FakeMemsink":
+        if _FakeMemsink.fail is not None:
+            raise _FakeMemsink.fail
+        _FakeMemsink.opened += 1
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        pass
+
+    def wait_frame(self, key_required: bool) -> (dict | None):
+        time.sleep(0.01)
+        self.__count += 1
+        return {
+            "key": (key_required or self.__count % 5 == 0),
+            "format": StreamerFormats.H264,
+            "data": self.__count.to_bytes(4, "big"),
+            "thread": threading.current_thread().name,
+        }
+
+
+@pytest.fixture(name="streamer")
+def _streamer_fixture(monkeypatch: pytest.MonkeyPatch) -> MemsinkStreamerClient:
+    monkeypatch.setattr(streamer_module, "ustreamer", types.SimpleNamespace(Memsink=_FakeMemsink))
+    _FakeMemsink.opened = 0
+    _FakeMemsink.fail = None
+    return MemsinkStreamerClient("H264", StreamerFormats.H264, "test", 1.0, 1.0, 0.0)
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__memsink__shared_reader(streamer: MemsinkStreamerClient) -> None:
+    async with streamer.reading() as read_frame_1:
+        async with streamer.reading() as read_frame_2:
+            frames_1 = [await read_frame_1(False) for _ in range(5)]
+            frames_2 = [await read_frame_2(False) for _ in range(5)]
+    assert _FakeMemsink.opened == 1
+    for frames in [frames_1, frames_2]:
+        assert frames[0]["key"]  # H264 subscribers start from a keyframe
+        assert all(frame["thread"] == "memsink-H264" for frame in frames)
+        numbers = [int.from_bytes(frame["data"], "big") for frame in frames]
+        assert numbers == list(range(numbers[0], numbers[0] + 5))
+
+
+@pytest.mark.asyncio
+async def test_ok__memsink__restart(streamer: MemsinkStreamerClient) -> None:
+    async with streamer.reading() as read_frame:
+        await read_frame(True)
+    await asyncio.sleep(0.1)  # The reader thread notices that there are no subscribers
+    async with streamer.reading() as read_frame:
+        await read_frame(True)
+    assert _FakeMemsink.opened == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("ex, error_cls", [
+    (FileNotFoundError("No sink"), StreamerTempError),
+    (RuntimeError("Broken sink"), StreamerPermError),
+])
+async def test_fail__memsink__error(streamer: MemsinkStreamerClient, ex: Exception, error_cls: type) -> None:
+    _FakeMemsink.fail = ex
+    async with streamer.reading() as read_frame:
+        with pytest.raises(error_cls):
+            await asyncio.wait_for(read_frame(False), 1)
+
+
+# =====
+async def _stream_handler(request: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
+    assert request.query["extra_headers"] == "1"
+    resp = aiohttp.web.StreamResponse(headers={"Content-Type": "multipart/x-mixed-replace;boundary=boundarydonotcross"})
+    await resp.prepare(request)
+    for index in range(3):
+        data = bytes([index]) * (100 + index) + b"\r\n--boundarydonotcross\r\n"  # Boundary inside the image
+        grab_time = [
+            f"X-UStreamer-Grab-Time: {time.monotonic() - 0.02:.06f}\r\n",  # Monotonic, like in uStreamer
+            "",  # No extra header
+            f"X-UStreamer-Grab-Time: {time.time():.06f}\r\n",  # Some other clock
+        ][index]
+        await resp.write(
+            b"--boundarydonotcross\r\n"
+            b"Content-Type: image/jpeg\r\n"
+            + f"Content-Length: {len(data)}\r\n".encode()
+            + f"X-Timestamp: {time.time():.06f}\r\n".encode()  # Wall-clock send time
+            + b"X-UStreamer-Online: true\r\n"
+            + f"X-UStreamer-Width: {640 + index}\r\n".encode()
+            + b"X-UStreamer-Height: 480\r\n"
+            + grab_time.encode()
+            + b"\r\n"
+            + data + b"\r\n"
+        )
+    return resp
+
+
+@pytest.mark.asyncio
+async def test_ok__http_streamer(tmp_path: Any) -> None:
+    unix_path = os.path.join(tmp_path, "ustreamer.sock")
+    app = aiohttp.web.Application()
+    app.router.add_get("/stream", _stream_handler)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    await aiohttp.web.UnixSite(runner, unix_path).start()
+    try:
+        streamer = HttpStreamerClient("JPEG", unix_path, 5.0, "test")
+        async with streamer.reading() as read_frame:
+            for index in range(3):
+                frame = await read_frame(False)
+                assert frame["online"]
+                assert frame["width"] == 640 + index
+                assert frame["height"] == 480
+                assert frame["data"] == bytes([index]) * (100 + index) + b"\r\n--boundarydonotcross\r\n"
+                if index == 0:
+                    assert 0.02 <= frame["recv_ts"] - frame["grab_ts"] < 1
+                else:
+                    assert frame["grab_ts"] == 0  # The receive time will be used
+            with pytest.raises(StreamerTempError):
+                await read_frame(False)
+    finally:
+        await runner.cleanup()
+
+
+# =====
+def _make_snapshot() -> StreamerSnapshot:
+    with io.BytesIO() as bio:
+        PilImage.new("RGB", (640, 480), (0, 128, 255)).save(bio, format="jpeg")
+        return StreamerSnapshot(online=True, width=640, height=480, headers=(), data=bio.getvalue())
+
+
+@pytest.mark.asyncio
+async def test_ok__snapshot_preview(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[str] = []
+    orig = streamer_module.PilImage.open
+
+    def counting_open(*args: Any) -> Any:
+        calls.append(threading.current_thread().name)
+        return orig(*args)
+
+    monkeypatch.setattr(streamer_module.PilImage, "open", counting_open)
+    snapshot = _make_snapshot()
+
+    with concurrent.futures.ThreadPoolExecutor(2, thread_name_prefix="test-preview") as executor:
+        previews = await asyncio.gather(*[snapshot.make_preview(160, 120, 80, executor) for _ in range(5)])
+        assert len(calls) == 1
+        assert len(set(previews)) == 1
+        with orig(io.BytesIO(previews[0])) as image:
+            assert image.size == (160, 120)
+
+        assert (await snapshot.make_preview(160, 120, 80, executor)) == previews[0]
+        assert len(calls) == 1
+
+        with orig(io.BytesIO(await snapshot.make_preview(100, 100, 50, executor))) as image:
+            assert image.size == (100, 75)
+        assert len(calls) == 2
+
+        assert (await snapshot.make_preview(640, 480, 80, executor)) == snapshot.data
+        assert (await _make_snapshot().make_preview(160, 120, 80, executor)) == previews[0]
+        assert len(calls) == 3
+        assert all(name.startswith("test-preview") for name in calls)  # Not the default executor
@@ -0,0 +1,44 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import multiprocessing
+
+import pytest
+
+from kvmd.aiomulti import AioProcessNotifier
+
+
+# =====
+def _notify_many(notifier: AioProcessNotifier) -> None:
+    for mask in [0, 1, 2, 4] * 1000:
+        notifier.notify(mask)
+
+
+@pytest.mark.asyncio
+async def test_ok__process_notifier() -> None:
+    notifier = AioProcessNotifier()
+    proc = multiprocessing.Process(target=_notify_many, args=(notifier,), daemon=True)
+    proc.start()
+    proc.join()
+    assert (await notifier.wait()) == 7  # The waiter was busy, the notifications are merged
+    notifier.notify()
+    assert (await notifier.wait()) == 0  # Nothing is left from the previous batch
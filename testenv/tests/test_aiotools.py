@@ -25,6 +25,8 @@ import asyncio
 import pytest
 
 from kvmd.aiotools import AioExclusiveRegion
+from kvmd.aiotools import AioNotifier
+from kvmd.aiotools import AioCoalescingNotifier
 from kvmd.aiotools import shield_fg
 
 
@@ -147,3 +149,38 @@ async def test_ok__shield_fg() -> None:
     with pytest.raises(asyncio.CancelledError):
         await task
     assert ops == ["foo1", "foo2", "foo2-noexc", "done"]
+
+
+# =====
+@pytest.mark.asyncio
+async def test_ok__notifier() -> None:
+    notifier = AioNotifier()
+    assert (await notifier.wait(0.01)) == -1
+    notifier.notify(1)
+    notifier.notify(2)
+    assert (await notifier.wait()) == 3  # The pending notifications are merged
+    assert (await notifier.wait(0.01)) == -1
+
+    # Every notification wakes one of the waiters
+    waiters = [asyncio.create_task(notifier.wait(1)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    notifier.notify(1)
+    notifier.notify(2)
+    assert sorted(await asyncio.gather(*waiters)) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_ok__coalescing_notifier() -> None:
+    notifier = AioCoalescingNotifier()
+    assert (await notifier.wait(0.01)) == -1
+    for mask in [0, 1, 2, 4] * 1000:  # The waiter is busy
+        notifier.notify(mask)
+    assert (await notifier.wait()) == 7
+    assert (await notifier.wait(0.01)) == -1
+
+    waiter = asyncio.create_task(notifier.wait(1))
+    await asyncio.sleep(0.01)
+    notifier.notify(1)
+    notifier.notify(2)
+    assert (await waiter) == 3
+    assert (await notifier.wait(0.01)) == -1
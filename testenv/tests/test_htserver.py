@@ -0,0 +1,390 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import os
+import json
+import asyncio
+import contextlib
+
+from typing import AsyncGenerator
+from typing import Any
+
+import aiohttp
+import aiohttp.web
+import pytest
+
+from kvmd import htserver
+from kvmd.htserver import exposed_http
+from kvmd.htserver import make_json_response
+from kvmd.htserver import make_ws_event
+from kvmd.htserver import WsSession
+from kvmd.htserver import HttpServer
+
+
+# =====
+class _Server(HttpServer):
+    @exposed_http("GET", "/ws")
+    async def __ws_handler(self, req: aiohttp.web.Request) -> aiohttp.web.WebSocketResponse:
+        topics = (set(req.query["topics"].split(",")) if "topics" in req.query else None)
+        async with self._ws_session(req, topics=topics, encoding=req.query.get("encoding", "json")) as ws:
+            return (await self._ws_loop(ws))
+
+    @exposed_http("GET", "/sse")
+    async def __sse_handler(self, req: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
+        async with self._sse_session(req, set(req.query["topics"].split(","))) as sse:
+            await sse.send_event(make_ws_event("test", {"value": 1}), "1")
+            await sse.send_event(None, "2")
+            while True:
+                await sse.send_ping()
+                await asyncio.sleep(0.01)
+        return sse.resp
+
+    @exposed_http("GET", "/error")
+    async def __error_handler(self, _: aiohttp.web.Request) -> aiohttp.web.Response:
+        raise RuntimeError("Test error")
+
+    @exposed_http("GET", "/slow")
+    async def __slow_handler(self, _: aiohttp.web.Request) -> aiohttp.web.Response:
+        await asyncio.sleep(60)
+        return make_json_response()
+
+    @exposed_http("GET", "/state")
+    async def __state_handler(self, _: aiohttp.web.Request) -> aiohttp.web.Response:
+        return make_json_response({"b": 1, "a": [1, "ы"]})
+
+    async def _init_app(self) -> None:
+        self._add_exposed(self)
+
+    async def broadcast(self, event_type: str, event: dict) -> None:
+        await self._broadcast_ws_event(event_type, event)
+
+
+@contextlib.asynccontextmanager
+async def _run_server(
+    tmp_path: Any,
+    handler_cancellation: bool=False,
+) -> AsyncGenerator[tuple[_Server, aiohttp.ClientSession], None]:
+
+    unix_path = os.path.join(tmp_path, "server.sock")
+    server = _Server()
+    app = await server.make_app(heartbeat=15.0)
+    runner = aiohttp.web.AppRunner(app, handler_cancellation=handler_cancellation)
+    await runner.setup()
+    await aiohttp.web.UnixSite(runner, unix_path).start()
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=unix_path)) as session:
+            yield (server, session)
+    finally:
+        await runner.cleanup()
+
+
+async def _wait_clients(server: _Server, count: int) -> None:
+    for _ in range(100):
+        if len(server._get_wss()) == count:  # pylint: disable=protected-access
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Expected {count} clients")
+
+
+# =====
+@pytest.mark.parametrize("fast", [True, False])
+def test_ok__make_ws_event(monkeypatch: pytest.MonkeyPatch, fast: bool) -> None:
+    if not fast:
+        monkeypatch.setattr(htserver, "_json_dumps", htserver._std_json_dumps)  # pylint: disable=protected-access
+    event = {"b": [1, 2.5, None], "a": {"x": "ы"}}
+    assert json.loads(make_ws_event("test", event)) == {"event_type": "test", "event": event}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fast", [True, False])
+@pytest.mark.parametrize("query, accept, pretty", [
+    ("", "*/*", False),
+    ("", "application/json", False),
+    ("", "text/html,application/xhtml+xml,*/*;q=0.8", True),
+    ("?pretty=1", "*/*", True),
+    ("?pretty=0", "text/html", False),
+    ("?pretty=xxx", "*/*", False),
+])
+async def test_ok__json_response(
+    tmp_path: Any,
+    monkeypatch: pytest.MonkeyPatch,
+    fast: bool,
+    query: str,
+    accept: str,
+    pretty: bool,
+) -> None:
+
+    if not fast:
+        monkeypatch.setattr(htserver, "_json_dumps", htserver._std_json_dumps)  # pylint: disable=protected-access
+    async with _run_server(tmp_path) as (_, session):
+        async with session.get(f"http://localhost/state{query}", headers={"Accept": accept}) as resp:
+            assert resp.status == 200
+            assert resp.headers["Content-Type"] == "application/json; charset=utf-8"
+            text = await resp.text()
+    result = {"ok": True, "result": {"b": 1, "a": [1, "ы"]}}
+    assert json.loads(text) == result
+    if pretty:
+        assert text == json.dumps(result, sort_keys=True, indent=4)
+    else:
+        assert "\n" not in text
+        assert " " not in text
+
+
+@pytest.mark.asyncio
+async def test_ok__broadcast_serialized_once(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[str] = []
+    orig = htserver.make_ws_event
+
+    def counting_make_ws_event(event_type: str, event: dict, encoding: str="json") -> bytes:
+        calls.append(event_type)
+        return orig(event_type, event, encoding)
+
+    monkeypatch.setattr(htserver, "make_ws_event", counting_make_ws_event)
+    async with _run_server(tmp_path) as (server, session):
+        wss = [await session.ws_connect("http://localhost/ws") for _ in range(5)]
+        await _wait_clients(server, 5)
+        await server.broadcast("test", {"value": 1})
+        for ws in wss:
+            assert (await ws.receive_json(timeout=1)) == {"event_type": "test", "event": {"value": 1}}
+            await ws.close()
+    assert calls == ["test"]
+
+
+@pytest.mark.asyncio
+async def test_ok__broadcast_encodings(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    msgpack = pytest.importorskip("msgpack")
+    cbor2 = pytest.importorskip("cbor2")
+    calls: list[str] = []
+    orig = htserver.make_ws_event
+
+    def counting_make_ws_event(event_type: str, event: dict, encoding: str="json") -> bytes:
+        calls.append(encoding)
+        return orig(event_type, event, encoding)
+
+    monkeypatch.setattr(htserver, "make_ws_event", counting_make_ws_event)
+    event = {"value": 1, "items": [1.5, None, "ы"]}
+    expected = {"event_type": "test", "event": event}
+    async with _run_server(tmp_path) as (server, session):
+        wss = {
+            encoding: [await session.ws_connect(f"http://localhost/ws?encoding={encoding}") for _ in range(3)]
+            for encoding in ["json", "msgpack", "cbor"]
+        }
+        await _wait_clients(server, 9)
+        await server.broadcast("test", event)
+        for ws in wss["json"]:
+            assert (await ws.receive_json(timeout=1)) == expected
+        for ws in wss["msgpack"]:
+            assert msgpack.unpackb(await ws.receive_bytes(timeout=1)) == expected
+        for ws in wss["cbor"]:
+            assert cbor2.loads(await ws.receive_bytes(timeout=1)) == expected
+        for ws in sum(wss.values(), []):
+            await ws.close()
+    assert sorted(calls) == ["cbor", "json", "msgpack"]
+
+
+@pytest.mark.asyncio
+async def test_ok__broadcast_topics(tmp_path: Any) -> None:
+    async with _run_server(tmp_path) as (server, session):
+        ws_all = await session.ws_connect("http://localhost/ws")
+        ws_foo = await session.ws_connect("http://localhost/ws?topics=foo")
+        ws_bar = await session.ws_connect("http://localhost/ws?topics=foo,bar")
+        await _wait_clients(server, 3)
+        await server.broadcast("bar", {"value": 1})
+        await server.broadcast("foo", {"value": 2})
+        assert (await ws_all.receive_json(timeout=1))["event_type"] == "bar"
+        assert (await ws_all.receive_json(timeout=1))["event_type"] == "foo"
+        assert (await ws_foo.receive_json(timeout=1))["event_type"] == "foo"
+        assert (await ws_bar.receive_json(timeout=1))["event_type"] == "bar"
+        assert (await ws_bar.receive_json(timeout=1))["event_type"] == "foo"
+
+        await ws_all.close()
+        await _wait_clients(server, 2)
+        assert server._has_subscribers("bar")  # pylint: disable=protected-access
+        assert not server._has_subscribers("baz")  # pylint: disable=protected-access
+        waiter = asyncio.create_task(server._wait_subscribers("baz"))  # pylint: disable=protected-access
+        await ws_bar.close()
+        await _wait_clients(server, 1)
+        assert not server._has_subscribers("bar")  # pylint: disable=protected-access
+        assert not waiter.done()
+        await (await session.ws_connect("http://localhost/ws")).close()
+        await asyncio.wait_for(waiter, 1)
+        await ws_foo.close()
+
+
+@pytest.mark.asyncio
+async def test_ok__sse_session(tmp_path: Any) -> None:
+    async with _run_server(tmp_path) as (server, session):
+        assert not server._has_subscribers("foo")  # pylint: disable=protected-access
+        async with session.get("http://localhost/sse?topics=foo") as resp:
+            assert resp.headers["Content-Type"] == "text/event-stream"
+            assert resp.headers["Cache-Control"] == "no-cache"
+            data = b""
+            while data.count(b"\n\n") < 3:
+                data += await resp.content.readany()
+            assert data.startswith(
+                b"id: 1\ndata: {\"event_type\":\"test\",\"event\":{\"value\":1}}\n\n"
+                b"id: 2\n\n"
+                b": ping\n\n"
+            )
+            assert server._has_subscribers("foo")  # pylint: disable=protected-access
+            assert not server._has_subscribers("bar")  # pylint: disable=protected-access
+        for _ in range(100):
+            if not server._has_subscribers("foo"):  # pylint: disable=protected-access
+                break
+            await asyncio.sleep(0.01)
+        assert not server._has_subscribers("foo")  # pylint: disable=protected-access
+
+
+@pytest.mark.asyncio
+async def test_ok__http_metrics(tmp_path: Any) -> None:
+    async with _run_server(tmp_path) as (server, session):
+        for _ in range(2):
+            async with session.get("http://localhost/state?pretty=1") as resp:
+                assert resp.status == 200
+        async with session.get("http://localhost/error") as resp:
+            assert resp.status == 500
+        ws = await session.ws_connect("http://localhost/ws")
+        await ws.send_json({"event_type": "ping", "event": {}})
+        await ws.send_bytes(b"\x00")
+        for _ in range(100):
+            rows = server._get_http_metrics().make_rows("test")  # pylint: disable=protected-access
+            if "test_ws_messages_total{type=\"binary\",event_type=\"unknown\"} 1" in rows:
+                break
+            await asyncio.sleep(0.01)
+        await ws.close()
+        async with session.get("http://localhost/sse?topics=foo") as resp:
+            await resp.content.readany()
+        for _ in range(100):
+            stream_rows = server._get_http_metrics().make_rows("test")  # pylint: disable=protected-access
+            if "test_http_stream_duration_seconds_count{method=\"GET\",path=\"/sse\"} 1" in stream_rows:
+                break
+            await asyncio.sleep(0.01)
+    assert "test_http_request_duration_seconds_count{method=\"GET\",path=\"/state\"} 2" in rows
+    assert "test_http_requests_in_flight{method=\"GET\",path=\"/ws\"} 1" in rows
+    assert "test_http_responses_total{method=\"GET\",path=\"/state\",status=\"200\"} 2" in rows
+    assert "test_http_responses_total{method=\"GET\",path=\"/error\",status=\"500\"} 1" in rows
+    assert "test_http_exceptions_total{method=\"GET\",path=\"/error\",exception=\"RuntimeError\"} 1" in rows
+    assert "test_ws_messages_total{type=\"text\",event_type=\"unknown\"} 1" in rows
+    assert "test_ws_messages_total{type=\"binary\",event_type=\"unknown\"} 1" in rows
+    assert "test_http_stream_duration_seconds_count{method=\"GET\",path=\"/ws\"} 1" in stream_rows
+    assert "test_http_stream_duration_seconds_count{method=\"GET\",path=\"/sse\"} 1" in stream_rows
+    assert not any(row.startswith("test_http_request_duration_seconds_count{method=\"GET\",path=\"/ws\"}") for row in stream_rows)
+    assert not any(row.startswith("test_http_request_duration_seconds_count{method=\"GET\",path=\"/sse\"}") for row in stream_rows)
+
+
+@pytest.mark.asyncio
+async def test_ok__http_metrics__cancelled(tmp_path: Any) -> None:
+    async with _run_server(tmp_path, handler_cancellation=True) as (server, session):
+        with pytest.raises(asyncio.TimeoutError):
+            async with session.get("http://localhost/slow", timeout=aiohttp.ClientTimeout(total=0.1)):
+                pass
+        for _ in range(100):
+            rows = server._get_http_metrics().make_rows("test")  # pylint: disable=protected-access
+            if "test_http_requests_in_flight{method=\"GET\",path=\"/slow\"} 0" in rows:
+                break
+            await asyncio.sleep(0.01)
+    assert "test_http_responses_total{method=\"GET\",path=\"/slow\",status=\"499\"} 1" in rows
+    assert "test_http_exceptions_total{method=\"GET\",path=\"/slow\",exception=\"CancelledError\"} 1" in rows
+    assert not any(row.startswith("test_http_responses_total{method=\"GET\",path=\"/slow\",status=\"500\"}") for row in rows)
+
+
+# =====
+class _SlowWsResponse:
+    def __init__(self) -> None:
+        self.closed = False
+        self.gate = asyncio.Event()
+        self.sent: list[dict | bytes] = []
+
+    async def send_frame(self, msg: bytes, opcode: aiohttp.WSMsgType) -> None:
+        await self.gate.wait()
+        self.sent.append(json.loads(msg) if opcode == aiohttp.WSMsgType.TEXT else msg)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_ok__ws_session_queue() -> None:
+    wsr = _SlowWsResponse()
+    ws = WsSession(wsr, {}, queue_size=3)  # type: ignore
+    get_state_calls = 0
+
+    async def get_state() -> dict:
+        nonlocal get_state_calls
+        get_state_calls += 1
+        return {"full": True}
+
+    assert ws.queue_event("loop", make_ws_event("loop", {}))
+    assert ws.queue_event("foo", make_ws_event("foo", {"delta": 1}), get_state)
+    assert ws.queue_event("foo", make_ws_event("foo", {"delta": 2}), get_state)  # Coalesced
+    assert ws.queue_event("bar", make_ws_event("bar", {"delta": 3}))
+    assert not wsr.closed
+
+    assert not ws.queue_event("bar", make_ws_event("bar", {"delta": 4}))  # Overflow
+    await asyncio.sleep(0.01)
+    assert wsr.closed
+
+    wsr.gate.set()
+    await asyncio.sleep(0.01)
+    assert wsr.sent == [
+        {"event_type": "loop", "event": {}},
+        {"event_type": "foo", "event": {"full": True}},
+        {"event_type": "bar", "event": {"delta": 3}},
+    ]
+    assert get_state_calls == 1
+
+    assert ws.queue_event("foo", make_ws_event("foo", {"delta": 5}), get_state)  # Not coalesced, nothing is pending
+    await asyncio.sleep(0.01)
+    assert wsr.sent[-1] == {"event_type": "foo", "event": {"delta": 5}}
+    assert get_state_calls == 1
+    await ws.close()
+
+
+@pytest.mark.asyncio
+async def test_ok__ws_session_bin_queue() -> None:
+    wsr = _SlowWsResponse()
+    ws = WsSession(wsr, {}, queue_size=3)  # type: ignore
+
+    assert ws.queue_event("foo", make_ws_event("foo", {}))
+    bin_task = asyncio.create_task(ws.send_bin(1, b"data"))
+    await asyncio.sleep(0.01)
+    assert not bin_task.done()  # Waits for the actual sending
+    assert ws.queue_event("bar", make_ws_event("bar", {}))
+    wsr.gate.set()
+    await asyncio.wait_for(bin_task, 1)
+    await asyncio.sleep(0.01)
+    assert wsr.sent == [  # Binary messages don't overtake the events
+        {"event_type": "foo", "event": {}},
+        b"\x01data",
+        {"event_type": "bar", "event": {}},
+    ]
+
+    wsr.gate.clear()
+    tasks = [asyncio.create_task(ws.send_prepared_bin(bytes([index]))) for index in range(4)]
+    await asyncio.sleep(0.01)
+    assert isinstance(tasks[-1].exception(), ConnectionResetError)  # Overflow
+    assert wsr.closed
+    assert not any(task.done() for task in tasks[:-1])
+    await ws.close()
+    for task in tasks[:-1]:  # The pending messages are not lost silently
+        with pytest.raises(ConnectionResetError):
+            await asyncio.wait_for(task, 1)
@@ -0,0 +1,99 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+import multiprocessing
+
+from kvmd.metrics import Histogram
+from kvmd.metrics import FrameLatency
+from kvmd.metrics import HttpMetrics
+from kvmd.metrics import make_labels
+
+
+# =====
+def test_ok__histogram() -> None:
+    hist = Histogram(buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 3.0]:
+        hist.observe(value)
+    assert hist.get_count() == 4
+    assert hist.make_rows("test", {"client": "a"}) == [
+        "test_bucket{client=\"a\",le=\"0.1\"} 2",
+        "test_bucket{client=\"a\",le=\"1.0\"} 3",
+        "test_bucket{client=\"a\",le=\"+Inf\"} 4",
+        "test_sum{client=\"a\"} 3.65",
+        "test_count{client=\"a\"} 4",
+    ]
+
+
+def test_ok__histogram__shared_values() -> None:
+    values = multiprocessing.RawArray("d", Histogram.get_size((1.0,)) * 2)
+    (first, second) = (Histogram((1.0,), values, 0), Histogram((1.0,), values, 3))
+    first.observe(0.5)
+    second.observe(2.0)
+    second.observe(2.0)
+    assert list(values) == [1.0, 0.0, 0.5, 0.0, 2.0, 4.0]
+    assert (first.get_count(), second.get_count()) == (1, 2)
+
+
+def test_ok__make_labels() -> None:
+    assert make_labels({}) == ""
+    assert make_labels({"a": "x\"y\\z\n"}) == "{a=\"x\\\"y\\\\z\\n\"}"
+
+
+def test_ok__frame_latency() -> None:
+    latency = FrameLatency()
+    latency.observe(grab_ts=10.0, recv_ts=10.02, dequeue_ts=10.024, start_ts=10.04, end_ts=10.2)
+    latency.observe(grab_ts=0.0, recv_ts=20.0, dequeue_ts=20.0, start_ts=20.0, end_ts=20.0005)
+    assert [latency.get_histogram(stage).get_count() for stage in FrameLatency.STAGES] == [2, 2, 2]
+    rows = FrameLatency.make_rows("kvmd_test_frame", [({"worker": "0"}, latency)])
+    assert "# TYPE kvmd_test_frame_send_complete_seconds histogram" in rows
+    assert "kvmd_test_frame_send_complete_seconds_bucket{worker=\"0\",le=\"0.001\"} 1" in rows
+    assert "kvmd_test_frame_send_complete_seconds_bucket{worker=\"0\",le=\"0.25\"} 2" in rows
+    assert "kvmd_test_frame_queue_seconds_bucket{worker=\"0\",le=\"0.001\"} 1" in rows
+
+
+def test_ok__http_metrics() -> None:
+    metrics = HttpMetrics()
+    metrics.start_request("GET", "/ws")
+    for (status, error) in [(200, ""), (400, "ValidatorError")]:
+        metrics.start_request("POST", "/hid/events/send_key")
+        metrics.finish_request("POST", "/hid/events/send_key", status, error, 0.003)
+    metrics.start_request("GET", "/log")
+    metrics.finish_request("GET", "/log", 200, "", 120.0, stream=True)
+    metrics.count_ws_message("text", "ping")
+    metrics.count_ws_message("text", "ping")
+    metrics.count_ws_message("binary", "1")
+    rows = metrics.make_rows("kvmd")
+    assert "# TYPE kvmd_http_request_duration_seconds histogram" in rows
+    labels = "method=\"POST\",path=\"/hid/events/send_key\""
+    assert f"kvmd_http_request_duration_seconds_bucket{{{labels},le=\"0.0025\"}} 0" in rows
+    assert f"kvmd_http_request_duration_seconds_bucket{{{labels},le=\"0.005\"}} 2" in rows
+    assert not any(row.startswith("kvmd_http_request_duration_seconds_count{method=\"GET\",path=\"/log\"}") for row in rows)
+    assert "kvmd_http_stream_duration_seconds_bucket{method=\"GET\",path=\"/log\",le=\"60.0\"} 0" in rows
+    assert "kvmd_http_stream_duration_seconds_bucket{method=\"GET\",path=\"/log\",le=\"300.0\"} 1" in rows
+    assert "kvmd_http_responses_total{method=\"GET\",path=\"/log\",status=\"200\"} 1" in rows
+    assert f"kvmd_http_requests_in_flight{{{labels}}} 0" in rows
+    assert "kvmd_http_requests_in_flight{method=\"GET\",path=\"/ws\"} 1" in rows
+    assert f"kvmd_http_responses_total{{{labels},status=\"200\"}} 1" in rows
+    assert f"kvmd_http_responses_total{{{labels},status=\"400\"}} 1" in rows
+    assert f"kvmd_http_exceptions_total{{{labels},exception=\"ValidatorError\"}} 1" in rows
+    assert "kvmd_ws_messages_total{type=\"text\",event_type=\"ping\"} 2" in rows
+    assert "kvmd_ws_messages_total{type=\"binary\",event_type=\"1\"} 1" in rows
@@ -0,0 +1,66 @@
+# ========================================================================== #
+#                                                                            #
+#    KVMD - The main PiKVM daemon.                                           #
+#                                                                            #
+#    Copyright (C) 2018-2024  Maxim Devaev <mdevaev@gmail.com>               #
+#                                                                            #
+#    This program is free software: you can redistribute it and/or modify    #
+#    it under the terms of the GNU General Public License as published by    #
+#    the Free Software Foundation, either version 3 of the License, or       #
+#    (at your option) any later version.                                     #
+#                                                                            #
+#    This program is distributed in the hope that it will be useful,         #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#    GNU General Public License for more details.                            #
+#                                                                            #
+#    You should have received a copy of the GNU General Public License       #
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                            #
+# ========================================================================== #
+
+
+from kvmd.statediff import StateStore
+
+
+# =====
+def test_ok__state_store__update() -> None:
+    store = StateStore(depth=2)
+    state = {"inputs": {"a": {"state": False}, "b": {"state": False}}, "outputs": {"c": {"state": True}}}
+    assert store.get_snapshot() == (0, {})
+    assert store.update(state) == state
+    published = store.get_state()
+    assert store.update({"inputs": {"a": {"state": False}, "b": {"state": False}}, "outputs": {"c": {"state": True}}}) is None
+    assert store.get_state() is published  # Nothing new was published
+    assert store.get_snapshot() == (1, state)
+
+    diff = store.update({"inputs": {"a": {"state": True}, "b": {"state": False}}, "outputs": {"c": {"state": True}}})
+    assert diff == {"inputs": {"a": {"state": True}}}
+    assert store.get_snapshot()[0] == 2
+    assert state["inputs"]["a"] == {"state": False}  # The previous snapshot is intact
+    assert store.get_state()["outputs"] is state["outputs"]  # Unchanged subtrees are shared
+
+    assert store.update({"inputs": {"a": {"state": True}}, "outputs": {}}) == {"inputs": {"b": None}, "outputs": {"c": None}}
+    assert store.get_state() == {"inputs": {"a": {"state": True}}, "outputs": {}}
+
+
+def test_ok__state_store__partial() -> None:
+    store = StateStore(depth=1)
+    assert store.reset({"params": {"q": 80}, "streamer": None}) == {"params": {"q": 80}, "streamer": None}
+    assert store.update({"streamer": None}, partial=True) is None
+    assert store.update({"streamer": {"fps": 30}}, partial=True) == {"streamer": {"fps": 30}}
+    assert store.update({"streamer": {"fps": 25}}, partial=True) == {"streamer": {"fps": 25}}  # Full value below the depth
+    assert store.update({"streamer": None}, partial=True) == {"streamer": None}
+    assert store.get_snapshot() == (4, {"params": {"q": 80}, "streamer": None})  # The reset and three diffs
+
+
+def test_ok__state_store__full() -> None:
+    store = StateStore(depth=0)
+    state = {"cpu": {"percent": 10}, "mem": {"percent": 50}}
+    assert store.update(state) is state
+    assert store.update({"cpu": {"percent": 10}, "mem": {"percent": 50}}) is None
+    state = {"cpu": {"percent": 11}, "mem": {"percent": 50}}
+    assert store.update(state) is state
+    assert store.get_snapshot() == (2, state)
+    assert store.reset(state) is state
+    assert store.get_snapshot() == (3, state)  # A reset is a new version even with the same state
@@ -29,12 +29,15 @@ from kvmd.validators.kvm import valid_atx_power_action
 from kvmd.validators.kvm import valid_atx_button
 from kvmd.validators.kvm import valid_msd_image_name
 from kvmd.validators.kvm import valid_info_fields
+from kvmd.validators.kvm import valid_ws_topics
+from kvmd.validators.kvm import valid_ws_encoding
 from kvmd.validators.kvm import valid_log_seek
 from kvmd.validators.kvm import valid_stream_quality
 from kvmd.validators.kvm import valid_stream_fps
 from kvmd.validators.kvm import valid_stream_resolution
 from kvmd.validators.kvm import valid_stream_h264_bitrate
 from kvmd.validators.kvm import valid_stream_h264_gop
+from kvmd.validators.kvm import valid_stream_simulcast_variant
 
 
 # =====
@@ -126,6 +129,38 @@ def test_fail__valid_info_fields(arg: Any) -> None:
         print(valid_info_fields(arg, set(["foo", "bar"])))
 
 
+# =====
+@pytest.mark.parametrize("arg, retval", [
+    ("hid", {"hid"}),
+    ("HID, info ", {"hid", "info"}),
+    (["info", "hid", "info"], {"hid", "info"}),
+    ("", set()),
+    ([], set()),
+])
+def test_ok__valid_ws_topics(arg: Any, retval: set[str]) -> None:
+    value = valid_ws_topics(arg, set(["hid", "info"]))
+    assert type(value) is set  # pylint: disable=unidiomatic-typecheck
+    assert value == retval
+
+
+@pytest.mark.parametrize("arg", ["xxx", "hid,xxx", ["hid", None], ["hid", 1], None])
+def test_fail__valid_ws_topics(arg: Any) -> None:
+    with pytest.raises(ValidatorError):
+        print(valid_ws_topics(arg, set(["hid", "info"])))
+
+
+# =====
+@pytest.mark.parametrize("arg", ["json ", "MSGPACK", " cbor"])
+def test_ok__valid_ws_encoding(arg: Any) -> None:
+    assert valid_ws_encoding(arg, ["json", "msgpack", "cbor"]) == arg.strip().lower()
+
+
+@pytest.mark.parametrize("arg", ["cbor", "xxx", "", None])
+def test_fail__valid_ws_encoding(arg: Any) -> None:
+    with pytest.raises(ValidatorError):
+        print(valid_ws_encoding(arg, ["json", "msgpack"]))
+
+
 # =====
 @pytest.mark.parametrize("arg", ["0 ", 0, 1, 13])
 def test_ok__valid_log_seek(arg: Any) -> None:
@@ -208,3 +243,20 @@ def test_ok__valid_stream_h264_gop(arg: Any) -> None:
 def test_fail__valid_stream_h264_gop(arg: Any) -> None:
     with pytest.raises(ValidatorError):
         print(valid_stream_h264_gop(arg))
+
+
+# =====
+@pytest.mark.parametrize("arg", ["640x360:60 ", "1x1:1", "1920x1080:100"])
+def test_ok__valid_stream_simulcast_variant(arg: Any) -> None:
+    value = valid_stream_simulcast_variant(arg)
+    assert type(value) is str  # pylint: disable=unidiomatic-typecheck
+    assert value == str(arg).strip()
+
+
+@pytest.mark.parametrize("arg", [
+    "test", "", None, "640x360", "640x360:", "640x360:0", "640x360:101",
+    "0x360:60", "640:60", "640x360:60:1",
+])
+def test_fail__valid_stream_simulcast_variant(arg: Any) -> None:
+    with pytest.raises(ValidatorError):
+        print(valid_stream_simulcast_variant(arg))